@@ -1,44 +1,130 @@
 import os
 import io
+import json
 import time
-import ollama
-from config import CATEGORIES, MODEL_NAME, USE_STREAMING, CACHE_DIR
-from utils import get_filename_from_url, is_cache_expired
+from functools import lru_cache
+from config import (USE_STREAMING, CACHE_DIR, MICRO_BATCH_CLASSIFY, SHORT_PAGE_CHARS,
+                    CATEGORIZER, DOMAIN_CACHE_ENABLED)
+from llm import chat
+from classify_batcher import classify_batcher
+from embeddings import get_categorizer
+from domain_cache import domain_cache
+from cache_manager import cache_manager
+from utils import get_filename_from_url, is_cache_expired, match_category, cache_path, canonical_url
+from schema import SCHEMAS, CATEGORY_LIST, get_schema
+
+CATEGORY_CACHE_SUFFIX = "_category.json"
 
 def check_category_cache(url):
     """Check if we already have a category classification for this URL in cache"""
-    cache_file = os.path.join(CACHE_DIR, get_filename_from_url(url).replace('.txt', '_category.txt'))
+    cache_file = cache_path(url, CATEGORY_CACHE_SUFFIX)
     
     # Check if cache file exists and is not expired
     if os.path.exists(cache_file) and not is_cache_expired(cache_file):
         try:
             with open(cache_file, 'r', encoding='utf-8') as f:
-                return f.read().strip()
+                entry = json.load(f)
+            if canonical_url(entry["url"]) == canonical_url(url):
+                cache_manager.record_lookup(cache_file, True)
+                return entry["category"]
         except Exception as e:
             print(f"Error reading cache: {e}")
-            return None
-    return None
+        cache_manager.record_lookup(cache_file, False)
+        return None
+    category = check_legacy_category_cache(url)
+    cache_manager.record_lookup(cache_file, category is not None)
+    return category
+
+def check_legacy_category_cache(url):
+    """Read a category cached under the old URL-derived file name and move it to the hashed layout"""
+    legacy_file = os.path.join(CACHE_DIR, get_filename_from_url(url).replace('.txt', '_category.txt'))
+    if not os.path.exists(legacy_file) or is_cache_expired(legacy_file):
+        return None
+    try:
+        with open(legacy_file, 'r', encoding='utf-8') as f:
+            category = f.read().strip()
+        mtime = os.path.getmtime(legacy_file)
+    except Exception as e:
+        print(f"Error reading cache: {e}")
+        return None
+    
+    # Keep the original age so the entry still expires on schedule
+    cache_file = save_category_cache(url, category)
+    if cache_file:
+        os.utime(cache_file, (mtime, mtime))
+    return category
 
 def save_category_cache(url, category):
-    """Save category classification to cache"""
-    cache_file = os.path.join(CACHE_DIR, get_filename_from_url(url).replace('.txt', '_category.txt'))
+    """Save category classification to cache and return the cache file"""
+    cache_file = cache_path(url, CATEGORY_CACHE_SUFFIX)
     try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
         with open(cache_file, 'w', encoding='utf-8') as f:
-            f.write(category)
+            json.dump({"url": url, "category": category}, f)
+            size = f.tell()
+        cache_manager.record_write(cache_file, size)
+        return cache_file
     except Exception as e:
         print(f"Error saving to cache: {e}")
-        pass
+        return None
+
+def remember_category(url, category, website_text, learn_embedding=True):
+    """Cache a classification and let the domain prior and embedding categorizer learn from it"""
+    save_category_cache(url, category)
+    if DOMAIN_CACHE_ENABLED:
+        domain_cache.record(url, category)
+    if learn_embedding and CATEGORIZER == 'embedding':
+        categorizer = get_categorizer()
+        if categorizer:
+            try:
+                categorizer.add_label(url, category, website_text)
+            except Exception as e:
+                print(f"Error storing embedding: {e}")
 
 def detect_category(website_text, url):
     """Detect website category with caching"""
+    return detect_category_with_source(website_text, url)[0]
+
+def detect_category_with_source(website_text, url):
+    """Detect website category and report where it came from
+
+    Returns (category, source) with source one of "cache", "domain",
+    "embedding", "batch", "llm" or "error".
+    """
     # Check cache first
     cached_category = check_category_cache(url)
-    if cached_category and cached_category in CATEGORIES:
-        return cached_category
+    if cached_category and cached_category in SCHEMAS:
+        return cached_category, "cache"
+    
+    # Pages of an established domain inherit its category
+    if DOMAIN_CACHE_ENABLED:
+        inherited_category = domain_cache.inherited_category(url)
+        if inherited_category:
+            save_category_cache(url, inherited_category)
+            return inherited_category, "domain"
+    
+    # Nearest-centroid classification on embeddings, when enough labeled pages exist
+    if CATEGORIZER == 'embedding':
+        categorizer = get_categorizer()
+        if categorizer:
+            try:
+                category = categorizer.classify(website_text, url)
+                if category:
+                    remember_category(url, category, website_text, learn_embedding=False)
+                    return category, "embedding"
+            except Exception as e:
+                print(f"Error in embedding categorizer: {e}")
+    
+    # Short pages are classified together with other short pages in one call
+    if MICRO_BATCH_CLASSIFY and len(website_text) < SHORT_PAGE_CHARS:
+        category = classify_batcher.classify(website_text, url)
+        if category:
+            remember_category(url, category, website_text)
+            return category, "batch"
     
     # classify using url
     sample_text = website_text[0:3000] if len(website_text)<3000 else website_text
-    categories = ", ".join(CATEGORIES.keys())
+    categories = CATEGORY_LIST
     message = f"""
 As a classifier, identify the category of this website from its text.
 Choose ONE from: {categories}
@@ -55,33 +141,31 @@ Response must be ONLY ONE WORD from the categories list.
             {'role': 'user', 'content': message}
         ]
         
-        response = ollama.chat(
-            model=MODEL_NAME,
-            messages=messages
-        )
+        response = chat(messages, 'classify', url=url)
         
-        reply = response['message']['content'].strip()
+        reply = response['content'].strip()
         
-        # Extract category name
-        for category in CATEGORIES.keys():
-            if category.lower() in reply.lower():
-                # Cache the result
-                save_category_cache(url, category)
-                return category
+        # Extract category name, with Default as fallback
+        category = match_category(reply) or 'Default'
         
-        # Default fallback
-        save_category_cache(url, 'Default')
-        return 'Default'
+        # Cache the result
+        remember_category(url, category, website_text)
+        return category, "llm"
     except Exception as e:
         print(f"Error detecting category: {e}")
-        return 'Default'
+        return 'Default', "error"
 
-def analyze_with_ollama(website_text, category, url):
-    """Analyze website content using Ollama"""
-    analysis_points = CATEGORIES.get(category, CATEGORIES['Default'])
+@lru_cache(maxsize=None)
+def analysis_prompt_prefix(category):
+    """Return the static part of the analysis prompt for a category
+
+    It comes before the website text and is byte-identical for every page of
+    the category, so Ollama can reuse its KV cache across consecutive requests.
+    """
+    analysis_points = get_schema(category).points
     
     # Optimize by reducing prompt size but keeping structure
-    prompt = f"""
+    return f"""
     You are a professional website content analyst. Your task is to extract specific answers from a {category} website.
 
     Below are the exact analysis questions you must answer:
@@ -107,8 +191,11 @@ def analyze_with_ollama(website_text, category, url):
     ...continue this format for all questions.
 
     Website content:
-    {website_text}
-"""
+    """
+
+def analyze_with_ollama(website_text, category, url):
+    """Analyze website content using Ollama"""
+    prompt = f"{analysis_prompt_prefix(category)}{website_text}\n"
     try:
         messages = [
             {'role': 'system', 'content': "You are a website analyst focused on extracting key information efficiently."},
@@ -122,26 +209,12 @@ def analyze_with_ollama(website_text, category, url):
         # Use streaming based on global setting
         if USE_STREAMING:
             # Streaming mode (slower but shows progress)
-            stream = ollama.chat(
-                model=MODEL_NAME,
-                messages=messages,
-                stream=True
-            )
-            
-            for chunk in stream:
-                if 'message' in chunk:
-                    content = chunk['message']['content']
-                    print(content, end='', flush=True)
-                    analysis_buffer.write(content)
-                    print(content)
+            response = chat(messages, 'analyze', url=url, category=category, on_chunk=lambda content: print(content, end='', flush=True))
+            print()
         else:
             # Non-streaming mode (faster)
-            response = ollama.chat(
-                model=MODEL_NAME,
-                messages=messages
-            )
-            content = response['message']['content']
-            analysis_buffer.write(content)
+            response = chat(messages, 'analyze', url=url, category=category)
+        analysis_buffer.write(response['content'])
     
         
         return analysis_buffer.getvalue()
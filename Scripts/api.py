@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Analysis API
+------------
+Local HTTP API for single-URL analysis, backed by the same caches and
+outputs as the batch mode.
+
+    python api.py [--port 8766]
+
+    GET /analyze?url=...    scrape, classify, analyze and save a URL
+    GET /classify?url=...   scrape and classify a URL
+    GET /result?url=...     the saved analysis of a URL
+    GET /stats              latency percentiles per endpoint, admission queue
+
+POST with a JSON body {"url": "..."} works as well. Concurrent requests for
+the same URL share one computation.
+"""
+
+import sys
+import json
+import time
+import argparse
+import threading
+import concurrent.futures
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+from config import (API_PORT, API_MAX_CONCURRENT, API_MAX_QUEUE, API_QUEUE_TIMEOUT, RESULTS_DB_ENABLED,
+                    STORAGE_MODE)
+from processor import prepare_url
+from analyzer import analyze_with_ollama
+from file_handler import create_folders, save_analysis_to_file, analysis_txt_path
+from export_csv import start_csv_writer, stop_csv_writer, parse_analysis, extract_analysis_text
+from llm import warm_up, pop_think_tokens
+from utils import validate_url, canonical_url, percentile
+from schema import SCHEMAS, get_schema
+from segments import close_segment_store
+from cache_manager import cache_manager
+from domain_cache import domain_cache
+
+LATENCY_WINDOW = 1000  # Recent requests per endpoint used for the percentiles
+
+
+class Overloaded(Exception):
+    """The admission queue is full or the request waited too long"""
+
+
+class AdmissionQueue:
+    """At most limit computations at once, with a bounded queue of waiting requests"""
+
+    def __init__(self, limit=API_MAX_CONCURRENT, max_waiting=API_MAX_QUEUE, timeout=API_QUEUE_TIMEOUT):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            if self.running >= self.limit:
+                if self.waiting >= self.max_waiting:
+                    self.rejected += 1
+                    raise Overloaded("Too many requests waiting")
+                self.waiting += 1
+                try:
+                    admitted = self._condition.wait_for(lambda: self.running < self.limit, self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.rejected += 1
+                    raise Overloaded(f"Not admitted within {self.timeout} seconds")
+            self.running += 1
+
+    def release(self):
+        with self._condition:
+            self.running -= 1
+            self._condition.notify()
+
+    def summary(self):
+        with self._condition:
+            return {"limit": self.limit, "running": self.running, "waiting": self.waiting,
+                    "rejected": self.rejected}
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one computation"""
+
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        """Return function()'s result, computed once for all callers waiting on key at the same time"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self._calls[key] = future
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                future.set_result(function())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+        return future.result()
+
+
+class EndpointStats:
+    """Request counts and recent latencies per endpoint"""
+
+    def __init__(self):
+        self.requests = {}
+        self.errors = {}
+        self.latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status):
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            if status >= 400:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            self.latencies.setdefault(endpoint, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def summary(self):
+        """Return {endpoint: {requests, errors, p50, p95, p99}} with latencies in milliseconds"""
+        with self._lock:
+            latencies = {endpoint: list(values) for endpoint, values in self.latencies.items()}
+            summary = {endpoint: {"requests": count, "errors": self.errors.get(endpoint, 0)}
+                       for endpoint, count in self.requests.items()}
+        for endpoint, values in latencies.items():
+            for p in (50, 95, 99):
+                summary[endpoint][f"p{p}_ms"] = round(percentile(values, p) * 1000, 1)
+        return summary
+
+
+class APIError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+admission = AdmissionQueue()
+flight = SingleFlight()
+stats = EndpointStats()
+
+
+def _answers(url, category, analysis_text):
+    schema = get_schema(category)
+    return dict(zip(schema.questions, schema.row(url, parse_analysis(analysis_text))[1:]))
+
+
+def _prepare(url):
+    """Scrape and classify a URL once for all classify and analyze requests in flight"""
+    validated_url, success, outcome = flight.do(("prepare", canonical_url(url)), lambda: prepare_url(url))
+    if not success:
+        raise APIError(502, outcome)
+    return validated_url, outcome
+
+
+def _admitted(function):
+    """Run a computation once the admission queue lets it through"""
+    admission.acquire()
+    try:
+        return function()
+    finally:
+        admission.release()
+
+
+def classify(url):
+    def compute():
+        validated_url, (website_text, category) = _prepare(url)
+        return {"url": validated_url, "category": category}
+    return flight.do(("classify", canonical_url(url)), lambda: _admitted(compute))
+
+
+def analyze(url):
+    def compute():
+        validated_url, (website_text, category) = _prepare(url)
+        start = time.time()
+        analysis_text = analyze_with_ollama(website_text, category, validated_url)
+        analyze_seconds = time.time() - start
+        success, saved_to = save_analysis_to_file(analysis_text, category, validated_url,
+                                                  website_text, analyze_seconds)
+        if not success:
+            raise APIError(500, f"Failed to save: {saved_to}")
+        return {"url": validated_url, "category": category, "analysis": analysis_text,
+                "answers": _answers(validated_url, category, analysis_text),
+                "analyze_seconds": round(analyze_seconds, 3), "saved_to": saved_to}
+    return flight.do(("analyze", canonical_url(url)), lambda: _admitted(compute))
+
+
+def find_result(url):
+    """Return the saved analysis of a URL from the results store, the segments or the TXT files"""
+    if RESULTS_DB_ENABLED:
+        from results_store import get_results_store
+        stored = get_results_store().get(url)
+        if stored:
+            return {"url": url, "category": stored["category"], "analysis": stored["analysis"],
+                    "answers": dict(stored["answers"]), "saved_at": stored["created_at"]}
+    if STORAGE_MODE == "segments":
+        from segments import get_segment_store
+        record = get_segment_store().get(url)
+        if record:
+            return {"url": url, "category": record["category"], "analysis": record["analysis"],
+                    "answers": _answers(url, record["category"], record["analysis"]),
+                    "saved_at": record["saved_at"]}
+        return None
+    for category in SCHEMAS:
+        path = analysis_txt_path(url, category)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            continue
+        # Truncated file names can collide, so check the URL inside
+        if content.split("\n", 1)[0] != f"URL: {url}":
+            continue
+        analysis_text = extract_analysis_text(content)
+        return {"url": url, "category": category, "analysis": analysis_text,
+                "answers": _answers(url, category, analysis_text), "saved_to": path}
+    return None
+
+
+def result(url):
+    found = find_result(url)
+    if found is None:
+        raise APIError(404, f"No saved analysis for {url}")
+    return found
+
+
+ENDPOINTS = {"/analyze": analyze, "/classify": classify, "/result": result}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 503:
+            self.send_header("Retry-After", "5")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self, url):
+        endpoint = urlsplit(self.path).path
+        if endpoint == "/stats":
+            self._send(200, {"endpoints": stats.summary(), "admission": admission.summary(),
+                             "coalesced": flight.coalesced})
+            return
+        handler = ENDPOINTS.get(endpoint)
+        if handler is None:
+            self._send(404, {"error": f"Unknown endpoint {endpoint}"})
+            return
+
+        start = time.perf_counter()
+        validated_url = None
+        try:
+            validated_url = validate_url(url or "")
+            if not validated_url:
+                raise APIError(400, "Missing or invalid url")
+            status, body = 200, handler(validated_url)
+        except APIError as e:
+            status, body = e.status, {"error": str(e)}
+        except Overloaded as e:
+            status, body = 503, {"error": str(e)}
+        except Exception as e:
+            status, body = 500, {"error": str(e)}
+        finally:
+            # Don't let think tokens of failed URLs grow with uptime
+            if validated_url:
+                pop_think_tokens(validated_url)
+        stats.record(endpoint, time.perf_counter() - start, status)
+        self._send(status, body)
+
+    def do_GET(self):
+        query = parse_qs(urlsplit(self.path).query)
+        self._handle(query.get("url", [None])[0])
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send(400, {"error": "Body must be JSON"})
+            return
+        if urlsplit(self.path).path == "/stats":
+            self._handle(None)
+            return
+        url = body.get("url") if isinstance(body, dict) else None
+        if not isinstance(url, str) or not url.strip():
+            self._send(400, {"error": 'Body must be a JSON object with a non-empty "url" string'})
+            return
+        self._handle(url)
+
+
+def serve(port=API_PORT):
+    """Serve the API on 127.0.0.1 until interrupted"""
+    create_folders()
+    warm_up()
+    start_csv_writer()
+    cache_manager.start_janitor()
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    print(f"Analysis API listening on http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping API...")
+    finally:
+        server.server_close()
+        stop_csv_writer()
+        close_segment_store()
+        cache_manager.stop_janitor()
+        domain_cache.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve single-URL analysis over local HTTP")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args()
+    serve(args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
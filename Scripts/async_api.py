@@ -0,0 +1,155 @@
+"""
+Async library API
+-----------------
+Use the analyzer from your own code and consume results as they complete:
+
+    import asyncio
+    from async_api import analyze_urls, AnalyzeOptions
+
+    async def run():
+        async for result in analyze_urls(urls, AnalyzeOptions(concurrency=8)):
+            print(result.url, result.category, result.answers)
+
+    asyncio.run(run())
+
+Results are saved to the TXT/CSV outputs exactly as in batch mode.
+"""
+
+import asyncio
+import threading
+import concurrent.futures
+from processor import prepare_url, finish_url
+from file_handler import create_folders
+from export_csv import start_csv_writer, stop_csv_writer, parse_analysis
+from llm import warm_up, pop_think_tokens
+from concurrency import worker_count
+from schema import get_schema
+
+CACHED_SOURCES = ("cache", "domain")  # Category sources that didn't need a model call
+
+
+class AnalyzeOptions:
+    """Options of analyze_urls()
+
+    concurrency: URLs processed at once (default: the batch worker count).
+    warm_up: load the models before the first URL.
+    """
+
+    def __init__(self, concurrency=None, warm_up=True):
+        self.concurrency = concurrency or worker_count()
+        self.warm_up = warm_up
+
+
+class AnalysisResult:
+    """Outcome of one URL as yielded by analyze_urls()"""
+
+    def __init__(self, url, success, category=None, answers=None, analysis=None, saved_to=None,
+                 error=None, timings=None, category_source=None, html_bytes=None, think_tokens=0):
+        self.url = url
+        self.success = success
+        self.category = category
+        self.answers = answers or {}       # question -> answer, in the category's question order
+        self.analysis = analysis
+        self.saved_to = saved_to
+        self.error = error
+        self.timings = timings or {}       # stage -> seconds (fetch, extract, classify, analyze, save)
+        self.category_source = category_source
+        self.html_bytes = html_bytes
+        self.think_tokens = think_tokens
+
+    @property
+    def category_cache_hit(self):
+        """True if the category came from the URL or domain cache"""
+        return self.category_source in CACHED_SOURCES
+
+    def as_dict(self):
+        return dict(vars(self), category_cache_hit=self.category_cache_hit)
+
+    def __repr__(self):
+        status = self.category if self.success else f"failed: {self.error}"
+        return f"AnalysisResult({self.url!r}, {status})"
+
+
+def _analyze(url, cancelled):
+    """Run one URL through the pipeline in a worker thread and build its result"""
+    if cancelled.is_set():
+        return None
+    info = {}
+    validated_url = url
+    try:
+        validated_url, success, outcome = prepare_url(url, info)
+        if not success:
+            return AnalysisResult(validated_url, False, error=outcome, timings=info.get("timings"))
+        website_text, category = outcome
+        if cancelled.is_set():
+            return None
+        validated_url, success, outcome = finish_url(validated_url, website_text, category, info)
+
+        analysis = info.get("analysis")
+        answers = {}
+        if analysis:
+            schema = get_schema(category)
+            answers = dict(zip(schema.questions, schema.row(validated_url, parse_analysis(analysis))[1:]))
+        return AnalysisResult(validated_url, success, category, answers, analysis,
+                              saved_to=outcome if success else None, error=None if success else outcome,
+                              timings=info.get("timings"), category_source=info.get("category_source"),
+                              html_bytes=info.get("html_bytes"), think_tokens=pop_think_tokens(validated_url))
+    finally:
+        # Don't keep think tokens of failed and cancelled URLs for the life of the caller's process
+        pop_think_tokens(validated_url)
+
+
+async def _iterate(urls):
+    """Iterate a sync or async iterable of URLs"""
+    if hasattr(urls, "__aiter__"):
+        async for url in urls:
+            yield url
+    else:
+        for url in urls:
+            yield url
+
+
+async def analyze_urls(urls, options=None):
+    """Analyze URLs and yield an AnalysisResult as each one completes
+
+    urls may be any iterable or async iterable and is consumed lazily, with
+    at most options.concurrency URLs in flight. Closing the generator or
+    cancelling the task consuming it stops the remaining work: queued URLs
+    are dropped and URLs in progress stop after their current stage.
+    """
+    options = options or AnalyzeOptions()
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=options.concurrency)
+    cancelled = threading.Event()
+    pending = set()
+
+    create_folders()
+    if options.warm_up:
+        await loop.run_in_executor(executor, warm_up)
+    owns_writer = start_csv_writer()
+    try:
+        source = _iterate(urls)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < options.concurrency:
+                try:
+                    url = await source.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(loop.run_in_executor(executor, _analyze, url, cancelled))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if result is not None:
+                    yield result
+    finally:
+        cancelled.set()
+        for future in pending:
+            future.cancel()
+        # Threads still running finish their current stage; don't block the event loop on them
+        executor.shutdown(wait=False, cancel_futures=True)
+        if owns_writer:
+            await loop.run_in_executor(None, stop_csv_writer)
@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import random
+import threading
+from config import BASE_SAVE_DIR, REPORT_DIR, REPORT_SAMPLE_SIZE, MODEL_NAME
+from utils import percentile
+from llm import token_totals
+from cache_manager import cache_manager
+from domain_cache import domain_cache
+
+STAGES = ("fetch", "extract", "classify", "analyze", "save")
+PERCENTILES = (50, 90, 99)
+
+# Failure messages of prepare_url/finish_url by prefix
+ERROR_CLASSES = (
+    ("Invalid URL format", "invalid_url"),
+    ("Failed to scrape website", "fetch_failed"),
+    ("Failed to extract content", "extract_failed"),
+    ("Failed to save", "save_failed"),
+)
+
+
+def error_class(message):
+    """Group a failure message into a small set of classes"""
+    message = str(message)
+    for prefix, name in ERROR_CLASSES:
+        if message.startswith(prefix):
+            return name
+    lowered = message.lower()
+    if "deadline" in lowered or "timed out" in lowered or "timeout" in lowered:
+        return "timeout"
+    if "connect" in lowered:
+        return "connection"
+    return "other"
+
+
+class BatchReport:
+    """Statistics of one batch for the summary report
+
+    Stage latencies are kept exactly up to REPORT_SAMPLE_SIZE per stage and
+    as a uniform reservoir sample beyond that; counts, totals, bytes and
+    tokens are exact. Nothing is recorded outside start() and stop().
+    """
+
+    def __init__(self, sample_size=REPORT_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.active = False
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.started_at = time.time()
+        self.finished_at = None
+        self.samples = {}          # stage -> sampled latencies
+        self.stage_counts = {}     # stage -> timed calls
+        self.stage_totals = {}     # stage -> total seconds
+        self.completed = {}        # minute since start -> finished URLs
+        self.succeeded = 0
+        self.failed = 0
+        self.errors = {}           # error class -> [count, example messages]
+        self.bytes_fetched = 0
+        self.pages_fetched = 0
+        self.category_sources = {}
+
+    def start(self):
+        with self._lock:
+            self._reset()
+            self.active = True
+
+    def stop(self):
+        with self._lock:
+            self.active = False
+            self.finished_at = time.time()
+
+    def record_stage(self, stage, seconds):
+        if not self.active:
+            return
+        with self._lock:
+            count = self.stage_counts.get(stage, 0) + 1
+            self.stage_counts[stage] = count
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0) + seconds
+            samples = self.samples.setdefault(stage, [])
+            if len(samples) < self.sample_size:
+                samples.append(seconds)
+            else:
+                slot = random.randrange(count)
+                if slot < self.sample_size:
+                    samples[slot] = seconds
+
+    def record_fetch(self, size):
+        if not self.active:
+            return
+        with self._lock:
+            self.pages_fetched += 1
+            self.bytes_fetched += size
+
+    def record_category_source(self, source):
+        if not self.active:
+            return
+        with self._lock:
+            self.category_sources[source] = self.category_sources.get(source, 0) + 1
+
+    def record_result(self, result):
+        """Count a finished (url, success, message) result"""
+        if not self.active:
+            return
+        with self._lock:
+            minute = int((time.time() - self.started_at) // 60)
+            self.completed[minute] = self.completed.get(minute, 0) + 1
+            if result[1]:
+                self.succeeded += 1
+                return
+            self.failed += 1
+            entry = self.errors.setdefault(error_class(result[2]), [0, []])
+            entry[0] += 1
+            if len(entry[1]) < 3:
+                entry[1].append(f"{result[0]}: {result[2]}")
+
+    def build(self):
+        """Return the report as a JSON-serializable dict"""
+        with self._lock:
+            elapsed = (self.finished_at or time.time()) - self.started_at
+            total = self.succeeded + self.failed
+            stages = {}
+            for stage in sorted(self.stage_counts, key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+                samples = self.samples[stage]
+                stages[stage] = {"count": self.stage_counts[stage],
+                                 "total_seconds": round(self.stage_totals[stage], 3),
+                                 **{f"p{p}": round(percentile(samples, p), 4) for p in PERCENTILES},
+                                 "max": round(max(samples), 4)}
+            minutes = max(self.completed, default=-1) + 1
+            report = {
+                "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started_at)),
+                "model": MODEL_NAME,
+                "elapsed_seconds": round(elapsed, 2),
+                "urls": total,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "urls_per_minute": round(total / elapsed * 60, 1) if elapsed else None,
+                "urls_per_minute_over_time": [self.completed.get(minute, 0) for minute in range(minutes)],
+                "stages": stages,
+                "errors": {name: {"count": count, "examples": examples}
+                           for name, (count, examples) in sorted(self.errors.items(), key=lambda e: -e[1][0])},
+                "pages_fetched": self.pages_fetched,
+                "bytes_fetched": self.bytes_fetched,
+                "category_sources": dict(self.category_sources),
+            }
+        report["tokens"] = token_totals()
+        report["caches"] = {
+            "category_cache": _hit_rate(cache_manager.hits, cache_manager.lookups),
+            "domain_prior": _hit_rate(domain_cache.hits, domain_cache.lookups),
+        }
+        return report
+
+
+def _hit_rate(hits, lookups):
+    return {"hits": hits, "lookups": lookups, "hit_rate": round(hits / lookups, 3) if lookups else None}
+
+
+def format_report(report):
+    """Render a report dict as the human-readable summary"""
+    lines = [f"Batch report ({report['started_at']}, {report['model']})",
+             f"URLs: {report['urls']} ({report['succeeded']} succeeded, {report['failed']} failed) "
+             f"in {report['elapsed_seconds']:.1f} s, {report['urls_per_minute'] or 0:.1f} URLs/min"]
+    if report["urls_per_minute_over_time"]:
+        lines.append("URLs per minute: " + " ".join(str(count) for count in report["urls_per_minute_over_time"]))
+
+    if report["stages"]:
+        lines.append("")
+        lines.append(f"{'Stage':<10} {'count':>7} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} {'max s':>8} {'total s':>9}")
+        for stage, stats in report["stages"].items():
+            lines.append(f"{stage:<10} {stats['count']:>7} {stats['p50']:>8.3f} {stats['p90']:>8.3f} "
+                         f"{stats['p99']:>8.3f} {stats['max']:>8.3f} {stats['total_seconds']:>9.1f}")
+
+    if report["errors"]:
+        lines.append("")
+        lines.append("Failures by class:")
+        for name, entry in report["errors"].items():
+            lines.append(f"  {name}: {entry['count']}")
+            for example in entry["examples"]:
+                lines.append(f"    e.g. {example}")
+
+    lines.append("")
+    lines.append(f"Fetched: {report['pages_fetched']} pages, {report['bytes_fetched'] / 1e6:.1f} MB")
+    for call_type, tokens in sorted(report["tokens"].items()):
+        lines.append(f"Tokens ({call_type}): {tokens['calls']} calls, {tokens['prompt_tokens']} prompt, "
+                     f"{tokens['eval_tokens']} generated, {tokens['think_tokens']} thinking")
+    for name, cache in report["caches"].items():
+        rate = f"{cache['hit_rate']:.0%}" if cache["hit_rate"] is not None else "-"
+        lines.append(f"{name.replace('_', ' ').capitalize()}: {cache['hits']}/{cache['lookups']} hits ({rate})")
+    if report["category_sources"]:
+        lines.append("Category sources: " + ", ".join(f"{source} {count}" for source, count
+                                                       in sorted(report["category_sources"].items())))
+    return "\n".join(lines)
+
+
+def write_report(report):
+    """Write batch_report.txt/.json and a dated JSON copy for comparing runs; returns the text and JSON paths"""
+    text_path = os.path.join(BASE_SAVE_DIR, "batch_report.txt")
+    json_path = os.path.join(BASE_SAVE_DIR, "batch_report.json")
+    try:
+        with open(text_path, 'w', encoding='utf-8') as f:
+            f.write(format_report(report) + "\n")
+        data = json.dumps(report, indent=2)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        with open(os.path.join(REPORT_DIR, time.strftime("report-%Y%m%d-%H%M%S.json")), 'w', encoding='utf-8') as f:
+            f.write(data)
+    except Exception as e:
+        print(f"Error writing batch report: {e}")
+    return text_path, json_path
+
+
+batch_report = BatchReport()
@@ -0,0 +1,530 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark
+--------------------
+Offline throughput benchmark of the whole pipeline. Two local HTTP servers
+stand in for the outside world:
+
+- a web server, used as the HTTP proxy of the run, that answers every URL
+  with a recorded page from --corpus (or a synthetic one) after a random
+  latency, with configurable page sizes and failure rates;
+- an Ollama-compatible server with a fixed number of parallel slots and
+  configurable prompt and generation speeds.
+
+Each scenario runs batch_process_urls (or the single-URL path) in a fresh
+process with empty caches and reports URLs/s, stage latencies and peak RSS.
+Results are appended to BENCHMARK_RESULTS_FILE with the git commit, and each
+run is compared with the last stored run of the same scenario and workload
+from another commit.
+
+    python benchmark.py e2e [--urls 200] [--scenario baseline --scenario streamed ...]
+    python benchmark.py e2e --history
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit
+from config import BENCHMARK_RESULTS_FILE
+from schema import CATEGORY_NAMES, get_schema
+
+# Settings changed from the config defaults in each scenario; "single" runs process_single_url
+SCENARIOS = {
+    "baseline": {},
+    "streamed": {"GROUP_BY_CATEGORY": False},
+    "no-micro-batch": {"MICRO_BATCH_CLASSIFY": False},
+    "no-domain-cache": {"DOMAIN_CACHE_ENABLED": False},
+    "fixed-concurrency": {"ADAPTIVE_CONCURRENCY": False},
+    "embedding": {"CATEGORIZER": "embedding"},
+    "single": {},
+}
+DEFAULT_SCENARIOS = ("baseline", "streamed", "single")
+RESULT_PREFIX = "BENCH_RESULT "
+TOPICS = tuple(name for name in CATEGORY_NAMES if name != "Default")
+WORDS = ("product", "service", "customer", "platform", "solution", "team", "market", "quality",
+         "support", "design", "data", "network", "project", "research", "experience", "global")
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def _topic(host):
+    """Category every page of a site is about, so the fake classifier can answer consistently"""
+    return TOPICS[_hash(host) % len(TOPICS)]
+
+
+# Fake web
+
+def synthetic_pages(count=50, median_kb=40, seed=1):
+    """HTML templates with lognormal sizes around median_kb; {topic} marks the category"""
+    rng = random.Random(seed)
+    pages = []
+    for n in range(count):
+        size = int(median_kb * 1024 * math.exp(rng.gauss(0, 0.6)))
+        paragraphs = []
+        length = 0
+        while length < size:
+            paragraph = "<p>" + " ".join(rng.choice(WORDS) for _ in range(60)) + ".</p>"
+            paragraphs.append(paragraph)
+            length += len(paragraph)
+        pages.append(f"<html><head><title>Page {n}</title><script>var x = {n};</script></head><body>"
+                     f"<nav>Home About Contact</nav><h1>Topic: {{topic}}</h1>{''.join(paragraphs)}"
+                     f"<footer>Copyright</footer></body></html>")
+    return pages
+
+
+def load_corpus(directory):
+    """Recorded pages: every .html/.htm file in a directory"""
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(('.html', '.htm')):
+            with open(os.path.join(directory, name), 'r', encoding='utf-8', errors='replace') as f:
+                html = f.read()
+            pages.append("<p>Topic: {topic}</p>" + html.replace("{", "{{").replace("}", "}}"))
+    return pages
+
+
+class FakeWeb:
+    """Answers proxied GETs with a page chosen by URL
+
+    failure_rate of the URLs always fail with 404 and flaky_rate of all
+    requests fail with 503, so retries can succeed. Latency is lognormal
+    around latency_ms.
+    """
+
+    def __init__(self, pages, latency_ms=80, failure_rate=0.02, flaky_rate=0.02):
+        self.pages = pages
+        self.latency = latency_ms / 1000
+        self.failure_rate = failure_rate
+        self.flaky_rate = flaky_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def respond(self, url):
+        """Return (status, body bytes) for a URL after its simulated latency"""
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency * math.exp(random.gauss(0, 0.5)))
+        key = _hash(url)
+        if key % 10000 < self.failure_rate * 10000:
+            return 404, b"Not found"
+        if random.random() < self.flaky_rate:
+            return 503, b"Service unavailable"
+        host = urlsplit(url).hostname or ""
+        return 200, self.pages[key % len(self.pages)].format(topic=_topic(host)).encode('utf-8')
+
+
+# Fake Ollama
+
+class FakeOllama:
+    """Ollama-compatible /api/chat, /api/generate and /api/embed
+
+    At most slots requests are served at once; the rest queue. A request
+    spends prompt_tokens / prompt_tokens_per_second on the prompt and then
+    streams its reply at tokens_per_second. Classification replies name the
+    page's topic, analyses answer every question of the category with about
+    analysis_tokens tokens in total.
+    """
+
+    def __init__(self, slots=4, tokens_per_second=400, prompt_tokens_per_second=4000, analysis_tokens=250):
+        self.slots = slots
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.analysis_tokens = analysis_tokens
+        self.calls = 0
+        self._slots = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+
+    def reply(self, messages):
+        system, prompt = messages[0]['content'], messages[-1]['content']
+        topics = re.findall(r"Topic: ([\w-]+)", prompt)
+        if "numbered category names" in system:
+            return "\n".join(f"{n}. {topic}" for n, topic in enumerate(topics, 1))
+        if "classifier" in system:
+            return topics[0] if topics else "Default"
+        match = re.search(r"answers from an? (.+?) website", prompt)
+        questions = get_schema(match.group(1) if match else "Default").questions
+        filler = max(1, self.analysis_tokens // len(questions) - len(questions[0].split()) - 2)
+        return "\n\n".join(f"{n}. {question}:\n- " + " ".join(random.choice(WORDS) for _ in range(filler))
+                           for n, question in enumerate(questions, 1))
+
+    def embedding(self, text):
+        """Vector close to its topic's axis, so the embedding categorizer has clusters to find"""
+        topics = re.findall(r"Topic: ([\w-]+)", text)
+        vector = [random.uniform(0, 0.1) for _ in range(len(TOPICS))]
+        if topics and topics[0] in TOPICS:
+            vector[TOPICS.index(topics[0])] += 1.0
+        return vector
+
+    def chat(self, body, write):
+        """Serve one chat request through write(dict) after queueing for a slot"""
+        messages = body.get('messages', [])
+        prompt_tokens = sum(len(m.get('content', '')) for m in messages) // 4
+        text = self.reply(messages)
+        tokens = re.findall(r"\S+\s*", text)
+        with self._slots:
+            with self._lock:
+                self.calls += 1
+            start = time.time()
+            time.sleep(prompt_tokens / self.prompt_tokens_per_second)
+            prompt_seconds = time.time() - start
+            chunk = 8
+            streamed = []
+            for i in range(0, len(tokens), chunk):
+                time.sleep(len(tokens[i:i + chunk]) / self.tokens_per_second)
+                streamed.append("".join(tokens[i:i + chunk]))
+                if body.get('stream', True):
+                    write({'model': body.get('model'), 'created_at': '', 'done': False,
+                           'message': {'role': 'assistant', 'content': streamed[-1]}})
+            total = time.time() - start
+        final = {'model': body.get('model'), 'created_at': '', 'done': True, 'done_reason': 'stop',
+                 'message': {'role': 'assistant', 'content': '' if body.get('stream', True) else "".join(streamed)},
+                 'total_duration': int(total * 1e9), 'load_duration': 0,
+                 'prompt_eval_count': prompt_tokens, 'prompt_eval_duration': int(prompt_seconds * 1e9),
+                 'eval_count': len(tokens), 'eval_duration': int((total - prompt_seconds) * 1e9)}
+        write(final)
+
+
+def _start_server(handler):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_fake_web(web):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, as with a real proxy
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            status, body = web.respond(self.path)
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return _start_server(Handler)
+
+
+def start_fake_ollama(ollama):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            path = urlsplit(self.path).path
+            if path == "/api/embed":
+                inputs = body.get('input', '')
+                inputs = [inputs] if isinstance(inputs, str) else inputs
+                self._json({'model': body.get('model'), 'embeddings': [ollama.embedding(text) for text in inputs]})
+            elif path == "/api/generate":
+                self._json({'model': body.get('model'), 'created_at': '', 'response': '', 'done': True,
+                            'load_duration': 0})
+            elif path == "/api/chat":
+                if body.get('stream', True):
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/x-ndjson")
+                    self.end_headers()
+
+                    def write(chunk):
+                        self.wfile.write((json.dumps(chunk) + "\n").encode('utf-8'))
+                        self.wfile.flush()
+                    try:
+                        ollama.chat(body, write)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass
+                else:
+                    ollama.chat(body, self._json)
+            else:
+                self.send_error(404)
+
+    return _start_server(Handler)
+
+
+# Scenario process
+
+def _peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it isn't available"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return round(psutil.Process().memory_info().peak_wset / 1e6, 1)
+        except Exception:
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1e6 if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def run_scenario(spec):
+    """Run one scenario in this process and print its result line
+
+    Must run before anything else imports the pipeline: config is pointed at
+    the scenario's save directory and the fake Ollama before the modules that
+    copy config values at import time are loaded.
+    """
+    import config
+    base = config.BASE_SAVE_DIR
+    for name in dir(config):
+        value = getattr(config, name)
+        if isinstance(value, str) and value.startswith(base):
+            setattr(config, name, spec["save_dir"] + value[len(base):])
+    config.OLLAMA_HOSTS = [spec["ollama"]]
+    config.TRACE_ENABLED = False
+    for name, value in spec["settings"].items():
+        setattr(config, name, value)
+    if config.CATEGORIZER == "embedding":
+        config.WARMUP_MODELS = [config.MODEL_NAME, config.EMBED_MODEL]
+
+    import io
+    import contextlib
+    from processor import batch_process_urls, process_single_url
+    from batch_report import batch_report
+    from utils import percentile
+
+    with open(spec["urls_file"], 'r', encoding='utf-8') as f:
+        urls = f.read().split()
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        if spec["scenario"] == "single":
+            latencies = []
+            failed = 0
+            start = time.time()
+            for url in urls:
+                url_start = time.time()
+                failed += not process_single_url(url)
+                latencies.append(time.time() - url_start)
+            elapsed = time.time() - start
+            stages = {"url": {f"p{p}": round(percentile(latencies, p), 4) for p in (50, 90, 99)}}
+        else:
+            batch_process_urls(urls, collect_results=False)
+            report = batch_report.build()
+            elapsed = report["elapsed_seconds"]
+            failed = report["failed"]
+            stages = {stage: {key: stats[key] for key in ("p50", "p90", "p99")}
+                      for stage, stats in report["stages"].items()}
+
+    result = {"urls": len(urls), "failed": failed, "elapsed_seconds": round(elapsed, 2),
+              "urls_per_second": round(len(urls) / elapsed, 2) if elapsed else None,
+              "stages": stages, "peak_rss_mb": _peak_rss_mb()}
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+# Driver
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, timeout=30).stdout.strip()
+    except Exception:
+        return ""
+
+
+def _launch(scenario, workload, ollama_url, web_url, urls_file):
+    """Run a scenario in a child process with a fresh save directory; returns its result or None"""
+    save_dir = tempfile.mkdtemp(prefix=f"bench-{scenario}-")
+    spec = {"scenario": scenario, "settings": SCENARIOS[scenario], "save_dir": save_dir,
+            "ollama": ollama_url, "urls_file": urls_file}
+    env = dict(os.environ, HTTP_PROXY=web_url, http_proxy=web_url,
+               NO_PROXY="127.0.0.1,localhost", no_proxy="127.0.0.1,localhost")
+    try:
+        proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-scenario", json.dumps(spec)],
+                              env=env, capture_output=True, text=True, timeout=workload["timeout"])
+    except subprocess.TimeoutExpired:
+        print(f"{scenario}: timed out after {workload['timeout']} seconds")
+        return None
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+    for line in proc.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"{scenario}: no result (exit code {proc.returncode})")
+    print("\n".join((proc.stdout + proc.stderr).splitlines()[-20:]))
+    return None
+
+
+def _stage_cell(result, stage):
+    stats = result["stages"].get(stage)
+    return f"{stats['p50']:.3f}/{stats['p99']:.3f}" if stats else "-"
+
+
+def print_results(records):
+    columns = ("fetch", "classify", "analyze", "url")
+    print(f"\n{'Scenario':<18}{'URLs':>6}{'Failed':>8}{'URLs/s':>9}"
+          + "".join(f"{stage + ' p50/p99':>22}" for stage in columns) + f"{'Peak RSS MB':>13}")
+    for record in records:
+        result = record["result"]
+        rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "-"
+        print(f"{record['scenario']:<18}{result['urls']:>6}{result['failed']:>8}{result['urls_per_second'] or 0:>9.2f}"
+              + "".join(f"{_stage_cell(result, stage):>22}" for stage in columns) + f"{rss:>13}")
+
+
+def load_history(path=BENCHMARK_RESULTS_FILE):
+    records = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return records
+
+
+def store_results(records, path=BENCHMARK_RESULTS_FILE):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        print(f"\nResults appended to: {path}")
+    except Exception as e:
+        print(f"Error storing benchmark results: {e}")
+
+
+def compare(records, history):
+    """Print the change against the last stored run of each scenario and workload from another commit"""
+    lines = []
+    for record in records:
+        previous = [old for old in history if old["scenario"] == record["scenario"]
+                    and old["workload"] == record["workload"] and old["commit"] != record["commit"]]
+        if not previous:
+            continue
+        old, new = previous[-1]["result"], record["result"]
+        changes = []
+        if old["urls_per_second"] and new["urls_per_second"]:
+            changes.append(f"URLs/s {old['urls_per_second']:.2f} -> {new['urls_per_second']:.2f} "
+                           f"({(new['urls_per_second'] / old['urls_per_second'] - 1) * 100:+.1f}%)")
+        if old["peak_rss_mb"] and new["peak_rss_mb"]:
+            changes.append(f"peak RSS {old['peak_rss_mb']:.1f} -> {new['peak_rss_mb']:.1f} MB")
+        lines.append(f"{record['scenario']:<18}vs {previous[-1]['commit'] or 'unknown'}: " + ", ".join(changes))
+    if lines:
+        print("\nCompared with earlier commits:")
+        print("\n".join(lines))
+
+
+def print_history(history):
+    if not history:
+        print(f"No stored results in {BENCHMARK_RESULTS_FILE}")
+        return
+    print(f"{'Date':<21}{'Commit':<12}{'Scenario':<18}{'URLs':>6}{'URLs/s':>9}{'Peak RSS MB':>13}")
+    for record in history:
+        result = record["result"]
+        commit = (record["commit"] or "unknown") + ("+" if record.get("dirty") else "")
+        rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "-"
+        print(f"{record['timestamp']:<21}{commit:<12}{record['scenario']:<18}{result['urls']:>6}"
+              f"{result['urls_per_second'] or 0:>9.2f}{rss:>13}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end pipeline benchmark against local fake web and Ollama servers")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help=f"Scenario to run, repeatable (default: {', '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument("--urls", type=int, default=200, help="URLs per batch scenario")
+    parser.add_argument("--single-urls", type=int, default=10, help="URLs in the single-URL scenario")
+    parser.add_argument("--pages-per-site", type=int, default=5, help="URLs sharing a domain")
+    parser.add_argument("--corpus", help="Directory of recorded .html pages (default: synthetic pages)")
+    parser.add_argument("--page-kb", type=float, default=40, help="Median synthetic page size")
+    parser.add_argument("--latency-ms", type=float, default=80, help="Median web response latency")
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="Share of URLs that always fail (404)")
+    parser.add_argument("--flaky-rate", type=float, default=0.02, help="Share of requests that fail once (503)")
+    parser.add_argument("--slots", type=int, default=4, help="Parallel requests the fake Ollama serves")
+    parser.add_argument("--tokens-per-second", type=float, default=400, help="Generation speed per request")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=4000, help="Prompt processing speed")
+    parser.add_argument("--analysis-tokens", type=int, default=250, help="Tokens per analysis reply")
+    parser.add_argument("--timeout", type=int, default=1800, help="Seconds a scenario may take")
+    parser.add_argument("--no-store", action="store_true", help="Don't append the results to the history")
+    parser.add_argument("--history", action="store_true", help="Print the stored results and exit")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_scenario:
+        run_scenario(json.loads(args.run_scenario))
+        return 0
+    history = load_history()
+    if args.history:
+        print_history(history)
+        return 0
+
+    pages = load_corpus(args.corpus) if args.corpus else synthetic_pages(median_kb=args.page_kb)
+    if not pages:
+        print(f"No .html pages in {args.corpus}")
+        return 1
+    web = FakeWeb(pages, args.latency_ms, args.failure_rate, args.flaky_rate)
+    ollama = FakeOllama(args.slots, args.tokens_per_second, args.prompt_tokens_per_second, args.analysis_tokens)
+    web_server = start_fake_web(web)
+    ollama_server = start_fake_ollama(ollama)
+    web_url = f"http://127.0.0.1:{web_server.server_address[1]}"
+    ollama_url = f"http://127.0.0.1:{ollama_server.server_address[1]}"
+
+    workload = {key: getattr(args, key) for key in ("urls", "single_urls", "pages_per_site", "corpus", "page_kb",
+                                                   "latency_ms", "failure_rate", "flaky_rate", "slots",
+                                                   "tokens_per_second", "prompt_tokens_per_second",
+                                                   "analysis_tokens")}
+    commit = _git("rev-parse", "--short", "HEAD") or None
+    dirty = bool(_git("status", "--porcelain", "--untracked-files=no"))
+    print(f"Fake web: {len(pages)} pages, {args.latency_ms:.0f} ms median latency, "
+          f"{args.failure_rate:.0%} failing URLs, {args.flaky_rate:.0%} flaky requests")
+    print(f"Fake Ollama: {args.slots} slots, {args.tokens_per_second:.0f} tokens/s, "
+          f"{args.prompt_tokens_per_second:.0f} prompt tokens/s")
+
+    records = []
+    urls_dir = tempfile.mkdtemp(prefix="bench-urls-")
+    try:
+        for scenario in args.scenario or DEFAULT_SCENARIOS:
+            count = args.single_urls if scenario == "single" else args.urls
+            urls = [f"http://site{n // args.pages_per_site}.bench.test/page{n}" for n in range(count)]
+            urls_file = os.path.join(urls_dir, f"{scenario}.txt")
+            with open(urls_file, 'w', encoding='utf-8') as f:
+                f.write("\n".join(urls) + "\n")
+            print(f"Running {scenario} ({count} URLs)...")
+            result = _launch(scenario, dict(workload, timeout=args.timeout), ollama_url, web_url, urls_file)
+            if result is not None:
+                records.append({"timestamp": time.strftime("%Y-%m-%d %H:%M:%S"), "commit": commit,
+                                "dirty": dirty, "scenario": scenario, "settings": SCENARIOS[scenario],
+                                "workload": workload, "result": result})
+    finally:
+        shutil.rmtree(urls_dir, ignore_errors=True)
+        web_server.shutdown()
+        ollama_server.shutdown()
+
+    if not records:
+        return 1
+    print_results(records)
+    compare(records, history)
+    if not args.no_store:
+        store_results(records)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
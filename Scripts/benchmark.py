@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Benchmarks
+----------
+Offline benchmarks for performance work. Run with a benchmark name:
+
+    python benchmark.py concurrency
+    python benchmark.py schema
+    python benchmark.py e2e [options]   (see bench_e2e.py)
+"""
+
+import sys
+import time
+import random
+import argparse
+import threading
+import concurrent.futures
+from collections import deque
+from utils import percentile
+from concurrency import AIMDController
+from config import CATEGORIES
+from schema import get_schema
+from export_csv import parse_analysis
+
+
+class SimulatedServer:
+    """In-process model of an Ollama server with a fixed number of parallel slots
+
+    Each active request slows the others down a little (batched decoding), and
+    requests beyond the slot count queue inside the server, so throughput
+    flattens out past the knee while latency keeps growing.
+    """
+
+    def __init__(self, slots=8, tokens_per_second=40.0, batch_penalty=0.08, time_scale=0.005):
+        self.slots = slots
+        self.tokens_per_second = tokens_per_second
+        self.batch_penalty = batch_penalty
+        self.time_scale = time_scale
+        self.active = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+
+    def request(self, tokens):
+        """Serve one request (first come, first served) and block for its scaled duration"""
+        ticket = object()
+        with self._condition:
+            self._queue.append(ticket)
+            while self._queue[0] is not ticket or self.active >= self.slots:
+                self._condition.wait()
+            self._queue.popleft()
+            self.active += 1
+            active = self.active
+            self._condition.notify_all()
+
+        speed = self.tokens_per_second / (1 + self.batch_penalty * (active - 1))
+        time.sleep(tokens / speed * self.time_scale)
+
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+
+def _run_load(server, limiter, workers, token_counts):
+    """Push all requests through the limiter and return (elapsed, latencies)"""
+    latencies = []
+    lock = threading.Lock()
+
+    def one_request(tokens):
+        limiter.acquire()
+        start = time.time()
+        try:
+            server.request(tokens)
+        finally:
+            latency = time.time() - start
+            limiter.release(latency, tokens)
+            with lock:
+                latencies.append(latency)
+
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(one_request, token_counts))
+    return time.time() - start, latencies
+
+
+class _Unlimited:
+    """Limiter stand-in for fixed concurrency (the worker count is the limit)"""
+
+    def acquire(self):
+        pass
+
+    def release(self, latency, tokens=None, call_type=None):
+        pass
+
+
+def benchmark_concurrency(requests=1000, slots=8, max_concurrency=32, seed=1, tolerance=0.02):
+    """Compare fixed LLM concurrency settings with the adaptive controller on a simulated server
+
+    Fails unless the controller ends within 2 of the server's slot count and
+    its throughput is within tolerance (run-to-run noise) of the best fixed
+    setting's.
+    """
+    rng = random.Random(seed)
+    token_counts = [rng.randint(100, 400) for _ in range(requests)]
+
+    print(f"Simulated server: {slots} parallel slots, {requests} requests")
+    print(f"{'Setting':<16}{'Requests/s':>12}{'p50 (s)':>10}{'p95 (s)':>10}")
+
+    rows = []
+    for fixed in (1, 2, 4, 8, 16, 32):
+        server = SimulatedServer(slots=slots)
+        elapsed, latencies = _run_load(server, _Unlimited(), fixed, token_counts)
+        rows.append((f"fixed {fixed}", requests / elapsed, latencies))
+
+    controller = AIMDController(initial=4, minimum=1, maximum=max_concurrency)
+    server = SimulatedServer(slots=slots)
+    elapsed, latencies = _run_load(server, controller, max_concurrency, token_counts)
+    rows.append(("adaptive", requests / elapsed, latencies))
+
+    for name, throughput, latencies in rows:
+        print(f"{name:<16}{throughput:>12.1f}{percentile(latencies, 50):>10.3f}{percentile(latencies, 95):>10.3f}")
+    print(f"\n{controller.summary()}")
+    print("Limit over time: " + " ".join(str(limit) for _, limit in controller.history))
+
+    best_fixed = max(throughput for name, throughput, _ in rows[:-1])
+    adaptive = rows[-1][1]
+    failed = False
+    if abs(int(controller.limit) - slots) > 2:
+        print(f"FAIL: adaptive limit ended at {int(controller.limit)}, not within 2 of {slots} slots")
+        failed = True
+    if adaptive < best_fixed * (1 - tolerance):
+        print(f"FAIL: adaptive throughput {adaptive:.1f} req/s is below the best fixed setting ({best_fixed:.1f} req/s)")
+        failed = True
+    return 1 if failed else 0
+
+
+def _legacy_row(url, parsed_analysis, category):
+    """CSV row built the way append_to_category_csv did before the compiled schema"""
+    category_questions = CATEGORIES.get(category, CATEGORIES['Default'])
+    headers = []
+    for line in category_questions.strip().split('\n'):
+        line = line.strip()
+        if line and ". " in line:
+            headers.append(line.split(". ", 1)[1].strip())
+    row_data = [url]
+    for header in headers:
+        value = ""
+        for question, answer in parsed_analysis.items():
+            if header.lower() in question.lower() or question.lower() in header.lower():
+                value = answer
+                break
+        row_data.append(value)
+    return row_data
+
+
+def benchmark_schema(rows=20000):
+    """Compare per-row CSV building from the raw CATEGORIES strings with the compiled schema"""
+    samples = []
+    for category in CATEGORIES:
+        questions = get_schema(category).questions
+        analysis = "\n".join(f"{n}. {question}:\n- Answer {n}" for n, question in enumerate(questions, 1))
+        samples.append((category, parse_analysis(analysis)))
+
+    for category, parsed in samples:
+        if _legacy_row("u", parsed, category) != get_schema(category).row("u", parsed):
+            print(f"Row mismatch for {category}")
+            return 1
+
+    start = time.perf_counter()
+    for i in range(rows):
+        category, parsed = samples[i % len(samples)]
+        _legacy_row("u", parsed, category)
+    legacy = (time.perf_counter() - start) / rows
+
+    start = time.perf_counter()
+    for i in range(rows):
+        category, parsed = samples[i % len(samples)]
+        get_schema(category).row("u", parsed)
+    compiled = (time.perf_counter() - start) / rows
+
+    print(f"{rows} rows over {len(samples)} categories")
+    print(f"{'Parsing per row':<20}{legacy * 1e6:>8.2f} us/row")
+    print(f"{'Compiled schema':<20}{compiled * 1e6:>8.2f} us/row")
+    print(f"Speedup: {legacy / compiled:.1f}x")
+
+
+def benchmark_e2e(options=()):
+    """Whole-pipeline throughput against local fake web and Ollama servers"""
+    from bench_e2e import main as run_e2e
+    return run_e2e(list(options))
+
+
+BENCHMARKS = {
+    "concurrency": benchmark_concurrency,
+    "schema": benchmark_schema,
+    "e2e": benchmark_e2e,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an offline benchmark")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    args, options = parser.parse_known_args()
+    if args.benchmark == "e2e":
+        return benchmark_e2e(options)
+    if options:
+        parser.error(f"unrecognized arguments: {' '.join(options)}")
+    return BENCHMARKS[args.benchmark]()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+import os
+import time
+import heapq
+import threading
+from config import (CACHE_DIR, CACHE_EXPIRY_DAYS, CACHE_MAX_BYTES, CACHE_MAX_ENTRIES, CACHE_EVICTION,
+                    CACHE_JANITOR_INTERVAL)
+
+
+class CacheManager:
+    """TTL and size budget for the URL cache
+
+    The janitor walks the cache one shard directory per step with
+    os.scandir, keeping an inventory of (size, mtime) per entry. Each step
+    removes expired entries and, while the cache is over CACHE_MAX_BYTES or
+    CACHE_MAX_ENTRIES, evicts the least recently used (or, with "lfu", least
+    frequently used) entries. Recency and hit counts come from the lookups
+    made in this process; entries not looked up since start count as last
+    used when they were written.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_EXPIRY_DAYS * 24 * 60 * 60,
+                 max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES, policy=CACHE_EVICTION):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.policy = policy
+        self.inventory = {}    # path -> [size, mtime]
+        self.last_used = {}    # path -> last lookup hit
+        self.uses = {}         # path -> lookup hits
+        self.total_bytes = 0
+        self._shards = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.reset_stats()
+
+    def reset_stats(self):
+        """Clear the lookup and eviction counters"""
+        self.lookups = 0
+        self.hits = 0
+        self.expired = 0
+        self.evicted = 0
+
+    # Bookkeeping called by the cache readers and writers
+
+    def record_lookup(self, path, hit):
+        with self._lock:
+            self.lookups += 1
+            if hit:
+                self.hits += 1
+                self.last_used[path] = time.time()
+                self.uses[path] = self.uses.get(path, 0) + 1
+
+    def record_write(self, path, size):
+        with self._lock:
+            self._track(path, size, time.time())
+
+    def _track(self, path, size, mtime):
+        previous = self.inventory.get(path)
+        self.total_bytes += size - (previous[0] if previous else 0)
+        self.inventory[path] = [size, mtime]
+
+    def _forget(self, path):
+        entry = self.inventory.pop(path, None)
+        if entry:
+            self.total_bytes -= entry[0]
+        self.last_used.pop(path, None)
+        self.uses.pop(path, None)
+
+    # Janitor
+
+    def _scan_units(self):
+        """The cache root (flat entries from earlier versions) followed by each shard directory"""
+        units = [self.directory]
+        try:
+            with os.scandir(self.directory) as entries:
+                units += sorted(entry.path for entry in entries
+                                if entry.is_dir() and not entry.name.startswith('_'))
+        except FileNotFoundError:
+            pass
+        return units
+
+    def _scan(self, unit):
+        """Return {path: [size, mtime]} of the cache files in one scan unit"""
+        found = {}
+        pending = [unit]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.name.startswith('_') and directory == self.directory:
+                            continue  # Domain prior, vector store and other internal stores
+                        if entry.is_dir():
+                            if unit != self.directory:
+                                pending.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            found[entry.path] = [stat.st_size, stat.st_mtime]
+            except FileNotFoundError:
+                continue
+        return found
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error removing cache file {path}: {e}")
+            return False
+        self._forget(path)
+        return True
+
+    def step(self):
+        """Scan the next shard directory, drop its expired entries and enforce the budget"""
+        if not self._shards:
+            self._shards = self._scan_units()
+        unit = self._shards.pop(0)
+        found = self._scan(unit)
+        now = time.time()
+        with self._lock:
+            # Forget entries of this unit that disappeared since the last pass
+            if unit == self.directory:
+                in_unit = lambda path: os.path.dirname(path) == unit
+            else:
+                in_unit = lambda path: path.startswith(unit + os.sep)
+            for path in [p for p in self.inventory if in_unit(p) and p not in found]:
+                self._forget(path)
+            for path, (size, mtime) in found.items():
+                if now - mtime > self.ttl:
+                    if self._remove(path):
+                        self.expired += 1
+                else:
+                    self._track(path, size, mtime)
+            self._enforce_budget()
+
+    def _enforce_budget(self):
+        excess_entries = len(self.inventory) - self.max_entries
+        if self.total_bytes <= self.max_bytes and excess_entries <= 0:
+            return
+
+        def recency(path):
+            return self.last_used.get(path, self.inventory[path][1])
+
+        if self.policy == "lfu":
+            order = lambda path: (self.uses.get(path, 0), recency(path))
+        else:
+            order = recency
+
+        # Evict in chunks so a large overshoot doesn't sort the whole inventory
+        while self.total_bytes > self.max_bytes or excess_entries > 0:
+            chunk = max(excess_entries, 100)
+            victims = heapq.nsmallest(chunk, self.inventory, key=order)
+            removed = 0
+            for path in victims:
+                if self.total_bytes <= self.max_bytes and excess_entries <= 0:
+                    break
+                if self._remove(path):
+                    removed += 1
+                    excess_entries -= 1
+            self.evicted += removed
+            if not removed:
+                break  # Nothing left that can be removed
+
+    def sweep(self):
+        """Run a full pass over the cache"""
+        self._shards = self._scan_units()
+        while self._shards:
+            self.step()
+
+    def _run(self):
+        while not self._stop.wait(CACHE_JANITOR_INTERVAL if not self._shards else 0.05):
+            try:
+                self.step()
+            except Exception as e:
+                print(f"Error in cache janitor: {e}")
+
+    def start_janitor(self):
+        """Start the background janitor (at most one)"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._shards = self._scan_units()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def summary(self):
+        """Return a one-line description of the cache size, hit rate and evictions"""
+        with self._lock:
+            hit_rate = self.hits / self.lookups if self.lookups else 0
+            return (f"Cache: {len(self.inventory)} entries, {self.total_bytes / 1e6:.1f} MB, "
+                    f"{self.hits}/{self.lookups} hits ({hit_rate:.0%}), "
+                    f"{self.expired} expired, {self.evicted} evicted")
+
+
+cache_manager = CacheManager()
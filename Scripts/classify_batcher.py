@@ -0,0 +1,151 @@
+import re
+import time
+import threading
+import concurrent.futures
+from config import CLASSIFY_BATCH_SIZE, CLASSIFY_BATCH_WINDOW
+from llm import chat
+from utils import match_category
+from schema import CATEGORY_LIST
+
+
+class ClassificationBatcher:
+    """Classify several short pages with a single LLM call
+
+    Worker threads hand their short pages to classify(), which blocks until the
+    page's category is known. A flusher collects pages for up to
+    CLASSIFY_BATCH_WINDOW seconds (or until CLASSIFY_BATCH_SIZE pages are
+    waiting) and sends them as numbered snippets in one prompt. classify()
+    returns None when a page could not be classified in a batch, in which case
+    the caller falls back to an individual classification call. A page that
+    arrives when no other short page has been seen for a window goes straight
+    to that fallback instead of waiting for company that isn't coming.
+    """
+
+    def __init__(self, window=CLASSIFY_BATCH_WINDOW, max_size=CLASSIFY_BATCH_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._lone = False
+        self._last_arrival = 0.0
+        self._stats_lock = threading.Lock()
+        self.urls = 0
+        self.batch_calls = 0
+        self.fallbacks = 0
+
+    def classify(self, website_text, url):
+        """Return the category of a short page, or None to fall back to an individual call"""
+        future = concurrent.futures.Future()
+        now = time.time()
+        with self._condition:
+            # A page arriving with no other short page seen for a window is unlikely to get company
+            self._lone = not self._pending and now - self._last_arrival > self.window
+            self._last_arrival = now
+            self._pending.append((website_text, url, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+        category = future.result()
+        with self._stats_lock:
+            self.urls += 1
+            if category is None:
+                self.fallbacks += 1
+        return category
+
+    def _run(self):
+        """Collect pending pages into batches and dispatch them"""
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # Don't hold an isolated page for the window only to fall back anyway
+                deadline = time.time() if self._lone and len(self._pending) == 1 else time.time() + self.window
+                while len(self._pending) < self.max_size:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                items = self._pending[:self.max_size]
+                del self._pending[:self.max_size]
+
+            # A lone page gains nothing from batching
+            if len(items) == 1:
+                items[0][2].set_result(None)
+                continue
+            threading.Thread(target=self._classify_items, args=(items,), daemon=True).start()
+
+    def _classify_items(self, items):
+        """Classify a batch of pages in one call and resolve their futures"""
+        categories = CATEGORY_LIST
+        snippets = "\n\n".join(f"[{number}]\n{text}" for number, (text, _, _) in enumerate(items, 1))
+        message = f"""
+As a classifier, identify the category of each numbered website text below.
+Choose ONE category per website from: {categories}
+If no clear match, use: Default
+
+{snippets}
+
+Respond with exactly one line per website in the form "<number>. <category>" and nothing else.
+"""
+        messages = [
+            {'role': 'system', 'content': "You are a website category classifier that responds with numbered category names."},
+            {'role': 'user', 'content': message}
+        ]
+
+        answers = {}
+        try:
+            with self._stats_lock:
+                self.batch_calls += 1
+            response = chat(messages, 'classify_batch', urls=[url for _, url, _ in items])
+            answers = parse_numbered_categories(response['content'], len(items))
+        except Exception as e:
+            print(f"Error in batched classification: {e}")
+
+        for number, (_, _, future) in enumerate(items, 1):
+            future.set_result(answers.get(number))
+
+    def reset_stats(self):
+        """Clear the counters at the start of a batch"""
+        with self._stats_lock:
+            self.urls = 0
+            self.batch_calls = 0
+            self.fallbacks = 0
+
+    def amortized_calls_per_url(self):
+        """LLM calls per short page, counting the individual fallback calls"""
+        with self._stats_lock:
+            if not self.urls:
+                return None
+            return (self.batch_calls + self.fallbacks) / self.urls
+
+    def summary(self):
+        """Return a one-line description of the batching so far"""
+        calls_per_url = self.amortized_calls_per_url()
+        if calls_per_url is None:
+            return "Micro-batched classification: no short pages"
+        return (f"Micro-batched classification: {self.urls} short pages, {self.batch_calls} batch calls, "
+                f"{self.fallbacks} fallbacks, {calls_per_url:.2f} calls per URL")
+
+
+def parse_numbered_categories(reply, count):
+    """Parse a numbered reply ("1. News") into {number: category}
+
+    Lines that don't name a known category are left out so their pages fall
+    back to an individual call.
+    """
+    answers = {}
+    for line in reply.splitlines():
+        match = re.match(r'^\s*\[?(\d+)\]?\s*[.):\-]?\s*(.+)$', line)
+        if not match:
+            continue
+        number = int(match.group(1))
+        category = match_category(match.group(2))
+        if 1 <= number <= count and category and number not in answers:
+            answers[number] = category
+    return answers
+
+
+classify_batcher = ClassificationBatcher()
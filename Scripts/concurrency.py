@@ -0,0 +1,198 @@
+import os
+import json
+import time
+import threading
+from config import (MAX_WORKERS, ADAPTIVE_CONCURRENCY, LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN,
+                    LLM_CONCURRENCY_MAX, LLM_HOST_CONCURRENCY, CONCURRENCY_LOG_FILE)
+
+
+class AIMDController:
+    """Adapt the number of in-flight LLM requests to the server's throughput curve
+
+    Latency is measured per generated token and kept per call type, so long
+    and short replies and different prompts aren't compared with each other;
+    calls without a token count (failures) are ignored. For every limit it
+    tries, each call type remembers its seconds per generated token and the
+    concurrency actually reached. By Little's law throughput is concurrency
+    over latency, so after each window the controller compares the current
+    limit with the next lower one it has measured. While the extra requests
+    still buy min_efficiency of the ideal (linear) throughput gain the limit
+    grows, doubling until the first comparison fails. Once latency rises with
+    throughput flat, requests are only queuing inside the server and the limit
+    bisects back towards the lower level, so it settles at the knee of the
+    curve. There is no latency baseline to drift.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=16, min_efficiency=0.25,
+                 smoothing=0.5, min_window=4, log_file=None):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.min_efficiency = min_efficiency
+        self.smoothing = smoothing
+        self.min_window = min_window
+        self.log_file = log_file
+
+        self.in_flight = 0
+        self.slow_start = True
+        self.ceiling = None  # lowest limit found past the knee
+        self.windows = {}  # call type -> [(seconds, tokens, requests in flight)]
+        self.levels = {}   # call type -> {limit: (seconds per token, requests in flight)}
+        self._skip = 0     # completions of requests started before the last change
+        self.history = [(time.time(), int(self.limit))]
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Block until a request slot is free"""
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, latency, tokens=None, call_type=None):
+        """Free a slot and feed the request's latency into the controller"""
+        with self._condition:
+            in_flight = self.in_flight
+            self.in_flight -= 1
+            if self._skip:
+                self._skip -= 1
+            elif tokens:
+                window = self.windows.setdefault(call_type, [])
+                window.append((latency, tokens, in_flight))
+                if len(window) >= max(self.min_window, int(self.limit)):
+                    self._adjust(call_type)
+            self._condition.notify_all()
+
+    def _adjust(self, call_type):
+        """Move the limit after a full window of one call type"""
+        window = self.windows.pop(call_type)
+        latency = sum(sample[0] for sample in window) / sum(sample[1] for sample in window)
+        concurrency = sum(sample[2] for sample in window) / len(window)
+
+        limit = int(self.limit)
+        levels = self.levels.setdefault(call_type, {})
+        if limit in levels:
+            old_latency, old_concurrency = levels[limit]
+            latency = old_latency + self.smoothing * (latency - old_latency)
+            concurrency = old_concurrency + self.smoothing * (concurrency - old_concurrency)
+        levels[limit] = (latency, concurrency)
+
+        lower = max((level for level in levels if level < limit), default=None)
+        higher = min((level for level in levels if level > limit), default=None)
+        if lower is not None:
+            efficiency = self._efficiency(levels[lower], levels[limit])
+            if efficiency is None:
+                # The extra slots aren't used, so there's nothing to learn
+                new_limit = limit
+            elif efficiency >= self.min_efficiency:
+                if self.slow_start:
+                    new_limit = limit * 2
+                elif self.ceiling is not None and self.ceiling - limit > 1:
+                    new_limit = (limit + self.ceiling) // 2
+                else:
+                    new_limit = limit + 1
+            else:
+                # Past the knee: bisect back towards the last good level
+                self.slow_start = False
+                self.ceiling = limit
+                new_limit = (lower + limit) // 2 if limit - lower > 1 else lower
+        elif higher is not None:
+            # The knee may lie below the lowest level measured so far
+            efficiency = self._efficiency(levels[limit], levels[higher])
+            new_limit = limit + 1 if efficiency is not None and efficiency >= self.min_efficiency else limit - 1
+        else:
+            new_limit = limit * 2
+        self.limit = float(max(self.minimum, min(self.maximum, new_limit)))
+
+        if int(self.limit) != limit:
+            now = time.time()
+            self.history.append((now, int(self.limit)))
+            self.windows.clear()
+            self._skip = self.in_flight
+            self._log(now, latency, concurrency / latency)
+
+    @staticmethod
+    def _efficiency(lower, upper):
+        """Share of the ideal throughput gain between two (latency, concurrency) levels
+
+        None when the higher level didn't actually run more requests at once.
+        """
+        ideal = upper[1] / lower[1]
+        if ideal < 1.05:
+            return None
+        gain = (upper[1] / upper[0]) / (lower[1] / lower[0])
+        return (gain - 1) / (ideal - 1)
+
+    def _log(self, timestamp, latency, throughput):
+        """Append the chosen concurrency to the log file"""
+        if not self.log_file:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.log_file), exist_ok=True)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({
+                    "timestamp": timestamp,
+                    "limit": int(self.limit),
+                    "latency": latency,
+                    "throughput": throughput
+                }) + "\n")
+        except Exception as e:
+            print(f"Error writing concurrency log: {e}")
+
+    def summary(self):
+        """Return a one-line description of the limits chosen so far"""
+        limits = [limit for _, limit in self.history]
+        return (f"LLM concurrency: now {int(self.limit)}, "
+                f"range {min(limits)}-{max(limits)}, {len(limits) - 1} adjustments")
+
+
+class FixedLimiter:
+    """Fixed number of in-flight LLM requests (used when adaptive concurrency is off)"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._semaphore = threading.BoundedSemaphore(limit)
+
+    def acquire(self):
+        self._semaphore.acquire()
+
+    def release(self, latency, tokens=None, call_type=None):
+        self._semaphore.release()
+
+    def summary(self):
+        return f"LLM concurrency: fixed at {self.limit}"
+
+
+def _create_limiter():
+    """Build the process-wide LLM limiter from the configuration"""
+    maximum = LLM_CONCURRENCY_MAX
+    if LLM_HOST_CONCURRENCY:
+        maximum = min(maximum, sum(LLM_HOST_CONCURRENCY.values()))
+    if not ADAPTIVE_CONCURRENCY:
+        return FixedLimiter(min(LLM_CONCURRENCY_INITIAL, maximum))
+    return AIMDController(LLM_CONCURRENCY_INITIAL, LLM_CONCURRENCY_MIN, maximum,
+                          log_file=CONCURRENCY_LOG_FILE)
+
+
+llm_limiter = _create_limiter()
+
+# Optional per-backend caps, enforced on each attempt
+_host_slots = {host: threading.BoundedSemaphore(cap) for host, cap in LLM_HOST_CONCURRENCY.items()}
+
+
+def acquire_host(host):
+    """Wait for a free slot on a capped backend"""
+    if host in _host_slots:
+        _host_slots[host].acquire()
+
+
+def release_host(host):
+    if host in _host_slots:
+        _host_slots[host].release()
+
+
+def worker_count():
+    """Number of batch worker threads needed to keep the LLM limiter busy"""
+    if ADAPTIVE_CONCURRENCY:
+        return max(MAX_WORKERS, int(llm_limiter.maximum))
+    return MAX_WORKERS
@@ -80,8 +80,129 @@ BASE_SAVE_DIR = r"C:\Users\DESG ITAdmin\Extrext\Website Analysis"
 
 # Configuration for performance
 MAX_TEXT_LENGTH = 10000  # Limit text length to reduce token usage
-MAX_WORKERS = 4  # Number of concurrent processes/threads
+MAX_WORKERS = 4  # Number of concurrent processes/threads (raised to LLM_CONCURRENCY_MAX when concurrency is adaptive)
 CACHE_DIR = os.path.join(BASE_SAVE_DIR, "_cache")  # Cache directory for category classifications
 USE_STREAMING = False  # Set to False for faster non-streaming responses
 MODEL_NAME = "qwen3:8b"  # Model to use for inference
-CACHE_EXPIRY_DAYS = 7  # Number of days before cache entries expire
\ No newline at end of file
+CACHE_EXPIRY_DAYS = 7  # Number of days before cache entries expire
+CACHE_MAX_BYTES = 512 * 1024 * 1024  # Disk budget of the URL cache
+CACHE_MAX_ENTRIES = 1000000  # Entry budget of the URL cache
+CACHE_EVICTION = "lru"  # "lru" or "lfu" when the cache is over budget
+CACHE_JANITOR_INTERVAL = 60  # Seconds between full janitor passes during a batch
+
+# Grouped batches: classify URLs ahead of their analyses and run the analyses grouped by category
+# so consecutive prompts share a prefix that Ollama can reuse from its KV cache
+GROUP_BY_CATEGORY = True
+GROUPED_BATCH_SIZE = 200  # URLs in flight at once when grouping by category
+SUBMIT_WINDOW = 64  # URLs in flight at once when processing in completion order
+
+# Lease-based work queue for running a batch with several worker processes or machines (work_queue.py).
+# Every machine must see the same BASE_SAVE_DIR; the queue is a SQLite file in it.
+WORK_QUEUE_DB = os.path.join(BASE_SAVE_DIR, "work_queue.db")
+WORK_QUEUE_LEASE_SECONDS = 300  # A claimed URL not renewed for this long goes to another worker
+WORK_QUEUE_HEARTBEAT = 30  # How often a worker renews the leases of its URLs (seconds)
+WORK_QUEUE_CLAIM_SIZE = 16  # URLs claimed per queue transaction
+WORK_QUEUE_MAX_ATTEMPTS = 3  # A URL that failed or lost its lease this often is marked failed
+
+# Headless daemon (daemon.py): URL files dropped into the inbox and URLs sent to the local socket
+# are processed by one long-running process with warm models, pools and connections
+DAEMON_INBOX_DIR = os.path.join(BASE_SAVE_DIR, "_inbox")
+DAEMON_OUTBOX_DIR = os.path.join(BASE_SAVE_DIR, "_outbox")  # One results file per inbox file
+DAEMON_PORT = 8765  # Local socket on 127.0.0.1 (None: inbox only)
+DAEMON_POLL_INTERVAL = 2.0  # Seconds between inbox scans
+DAEMON_KEEPALIVE_INTERVAL = 600  # Touch the models after this long idle so KEEP_ALIVE doesn't unload them
+
+# Local HTTP API (api.py): analyze, classify and result lookup for other services
+API_PORT = 8766  # Listens on 127.0.0.1
+API_MAX_CONCURRENT = 8  # URLs scraped and analyzed at once; further requests wait in the admission queue
+API_MAX_QUEUE = 64  # Waiting requests beyond which new ones get 503
+API_QUEUE_TIMEOUT = 30  # Seconds a request may wait for admission before it gets 503
+
+# Where analyses are saved: "txt" (one file per URL in the category folders) or
+# "segments" (compressed, rotating segment files with an offset index, see segments.py)
+STORAGE_MODE = "txt"
+SEGMENT_DIR = os.path.join(BASE_SAVE_DIR, "_segments")
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024  # Start a new segment past this size
+
+# SQLite results store with full-text search (python results_store.py search "...")
+RESULTS_DB_ENABLED = False
+RESULTS_DB_FILE = os.path.join(BASE_SAVE_DIR, "results.db")
+
+# Category CSV writer used during batches: rows are buffered and written by one thread
+CSV_FLUSH_ROWS = 100  # Flush once this many rows are buffered
+CSV_FLUSH_INTERVAL = 2.0  # Flush at least this often (seconds)
+
+# Keep one current row per URL across the category CSVs (False: append every result)
+CSV_UPSERT = True
+CSV_INDEX_FILE = os.path.join(BASE_SAVE_DIR, "_csv_index.json")
+CSV_COMPACT_STALE_ROWS = 5000  # Compact a CSV during a batch once this many rows are superseded
+
+# Incremental TXT to CSV export: files whose mtime, size and hash are in the manifest are skipped
+EXPORT_MANIFEST_FILE = os.path.join(BASE_SAVE_DIR, "_export_manifest.json")
+EXPORT_WORKERS = None  # Parsing processes (None: one per CPU)
+EXPORT_POOL_MIN_FILES = 200  # Smaller exports are parsed in-process
+
+# Domain-level category prior: once a registrable domain has been classified the same way
+# DOMAIN_INHERIT_AFTER times in a row, its other pages inherit that category without an LLM call
+DOMAIN_CACHE_ENABLED = True
+DOMAIN_CACHE_FILE = os.path.join(CACHE_DIR, "_domain_categories.json")
+DOMAIN_INHERIT_AFTER = 5
+DOMAIN_SPOT_CHECK_RATE = 0.05  # Share of inheriting pages that are still classified to catch drift
+
+# Categorizer used by detect_category: "chat" asks MODEL_NAME, "embedding" compares an embedding of
+# the page against per-category centroids built from earlier chat-labeled pages (needs NumPy)
+CATEGORIZER = "chat"
+EMBED_MODEL = "nomic-embed-text"
+VECTOR_STORE_DIR = os.path.join(BASE_SAVE_DIR, "_vectors")
+EMBED_MIN_EXAMPLES = 5  # Chat-labeled pages a category needs before its centroid is used
+EMBED_MIN_MARGIN = 0.02  # Minimum cosine gap between the best and second-best centroid
+
+# Micro-batched classification: short pages are classified together in one prompt
+MICRO_BATCH_CLASSIFY = True
+SHORT_PAGE_CHARS = 800  # Pages with less extracted text than this are micro-batched
+CLASSIFY_BATCH_SIZE = 8  # Maximum pages per classification prompt
+CLASSIFY_BATCH_WINDOW = 0.5  # Seconds to wait for more short pages before sending a batch
+
+# LLM call limits (per call type: "classify" for detect_category, "classify_batch" for micro-batched
+# classification, "analyze" for analyze_with_ollama, "embed" for embedding calls)
+LLM_TIMEOUTS = {"classify": 60, "classify_batch": 120, "analyze": 300, "embed": 30}  # Hard deadline in seconds; the generation is cancelled when exceeded
+NUM_PREDICT = {"classify": 64, "classify_batch": 256, "analyze": 2048}  # Maximum number of tokens generated per call
+# Reasoning per call type: False appends qwen3's /no_think switch, True appends /think, None leaves the model default.
+# <think> blocks are always stripped from the reply.
+THINKING = {"classify": False, "classify_batch": False, "analyze": False}
+
+# Model residency: how long Ollama keeps the model loaded after a call, and which models are preloaded before a batch
+KEEP_ALIVE = "30m"
+WARMUP_MODELS = [MODEL_NAME] + ([EMBED_MODEL] if CATEGORIZER == "embedding" else [])
+
+# Ollama backends. None means the default host (OLLAMA_HOST or http://localhost:11434)
+OLLAMA_HOSTS = [None]
+HEDGE_ENABLED = True  # Send a hedged request to a second backend when a call runs slow (needs 2+ hosts)
+HEDGE_PERCENTILE = 95  # Latency percentile after which the hedged request is sent
+HEDGE_MIN_SAMPLES = 20  # Number of completed calls needed before hedging starts
+LLM_LATENCY_SAMPLE_SIZE = 10000  # Call latencies kept per call type for the summary percentiles; more calls are sampled
+
+# Adaptive LLM concurrency: the number of in-flight LLM requests is tuned to the knee of the server's throughput curve
+ADAPTIVE_CONCURRENCY = True
+LLM_CONCURRENCY_INITIAL = MAX_WORKERS  # Starting limit (the fixed limit when ADAPTIVE_CONCURRENCY is False)
+LLM_CONCURRENCY_MIN = 1
+LLM_CONCURRENCY_MAX = 16
+LLM_HOST_CONCURRENCY = {}  # Optional cap per backend, e.g. {"http://gpu1:11434": 8}
+CONCURRENCY_LOG_FILE = os.path.join(BASE_SAVE_DIR, "_metrics", "concurrency.jsonl")
+
+# LLM call metrics (one JSON line per call with Ollama's eval statistics)
+METRICS_ENABLED = True
+METRICS_FILE = os.path.join(BASE_SAVE_DIR, "_metrics", "llm_calls.jsonl")
+RELOAD_THRESHOLD_SECONDS = 0.5  # A load_duration above this counts as a model reload
+
+# Batch summary report (batch_report.txt and .json next to batch_results.txt, plus a dated JSON copy per run)
+REPORT_DIR = os.path.join(BASE_SAVE_DIR, "_reports")
+REPORT_SAMPLE_SIZE = 100000  # Latencies kept per stage for the percentiles; larger batches are sampled
+
+# End-to-end benchmark results (python benchmark.py e2e), one JSON line per scenario run
+BENCHMARK_RESULTS_FILE = os.path.join(BASE_SAVE_DIR, "_metrics", "benchmarks.jsonl")
+
+# Per-stage tracing of batches, exported as Chrome trace JSON (open in https://ui.perfetto.dev)
+TRACE_ENABLED = False
+TRACE_DIR = os.path.join(BASE_SAVE_DIR, "_traces")
+TRACE_MAX_EVENTS = 1000000  # Spans kept per batch; later ones are counted as dropped
@@ -0,0 +1,161 @@
+import os
+import csv
+import json
+import threading
+from config import BASE_SAVE_DIR, CSV_INDEX_FILE
+from schema import SCHEMAS
+
+HEADER_ROWS = 2  # "Category: ..." line and the column header
+
+
+def category_csv_path(category):
+    return os.path.join(BASE_SAVE_DIR, f"{category}.csv")
+
+
+class CSVIndex:
+    """Current row of every URL in the category CSVs
+
+    Rows are only ever appended. Writing a URL again, to the same or another
+    category, leaves its previous row stale; compact() rewrites a CSV without
+    its stale rows in one streaming pass. The index is saved with the file
+    sizes it describes and rebuilt from the CSVs when they no longer match
+    (e.g. after a crash or a manual edit).
+    """
+
+    def __init__(self, path=CSV_INDEX_FILE):
+        self.path = path
+        self.urls = {}   # url -> [category, data row number]
+        self.rows = {}   # category -> data rows in the file
+        self.stale = {}  # category -> rows superseded since the last compaction
+        self._lock = threading.Lock()
+        self._load()
+
+    def _file_sizes(self):
+        return {category: os.path.getsize(category_csv_path(category))
+                for category in SCHEMAS if os.path.exists(category_csv_path(category))}
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data["sizes"] == self._file_sizes():
+                self.urls, self.rows, self.stale = data["urls"], data["rows"], data["stale"]
+                return
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Error reading CSV index: {e}")
+        self.rebuild()
+
+    def rebuild(self):
+        """Index the category CSVs from scratch; duplicate rows count as stale"""
+        with self._lock:
+            self.urls, self.rows, self.stale = {}, {}, {}
+            for category in SCHEMAS:
+                path = category_csv_path(category)
+                if not os.path.exists(path):
+                    continue
+                with open(path, 'r', newline='', encoding='utf-8') as f:
+                    reader = csv.reader(f)
+                    for _ in range(HEADER_ROWS):
+                        next(reader, None)
+                    row_number = -1
+                    for row_number, row in enumerate(reader):
+                        if row:
+                            self._assign(row[0], category, row_number)
+                    self.rows[category] = row_number + 1
+
+    def _assign(self, url, category, row_number):
+        previous = self.urls.get(url)
+        if previous is not None:
+            self.stale[previous[0]] = self.stale.get(previous[0], 0) + 1
+        self.urls[url] = [category, row_number]
+
+    def category_of(self, url):
+        """Return the category of url's current row, or None"""
+        with self._lock:
+            entry = self.urls.get(url)
+            return entry[0] if entry else None
+
+    def assign(self, url, category):
+        """Record that the next row appended to a category CSV is the current row of url"""
+        with self._lock:
+            row_number = self.rows.get(category, 0)
+            self.rows[category] = row_number + 1
+            self._assign(url, category, row_number)
+
+    def forget(self, category):
+        """Drop a category whose CSV was (re)created empty"""
+        with self._lock:
+            self.urls = {url: entry for url, entry in self.urls.items() if entry[0] != category}
+            self.rows[category] = 0
+            self.stale[category] = 0
+
+    def stale_categories(self, min_stale=1):
+        """Return the categories with at least min_stale stale rows"""
+        with self._lock:
+            return [category for category, count in self.stale.items() if count >= min_stale]
+
+    def compact(self, category, retry=True):
+        """Rewrite a category CSV keeping only the current row of each URL
+
+        The caller must make sure nothing else writes to the file meanwhile.
+        If the file doesn't have the rows the index expects, it is left alone
+        and the index is rebuilt instead.
+        """
+        path = category_csv_path(category)
+        if not os.path.exists(path):
+            return
+        temp_path = path + ".tmp"
+        with self._lock:
+            kept = 0
+            row_number = -1
+            current = {}
+            with open(path, 'r', newline='', encoding='utf-8') as source, \
+                    open(temp_path, 'w', newline='', encoding='utf-8') as target:
+                reader = csv.reader(source)
+                writer = csv.writer(target)
+                for _ in range(HEADER_ROWS):
+                    header = next(reader, None)
+                    if header is not None:
+                        writer.writerow(header)
+                for row_number, row in enumerate(reader):
+                    if not row or self.urls.get(row[0]) != [category, row_number]:
+                        continue
+                    writer.writerow(row)
+                    current[row[0]] = [category, kept]
+                    kept += 1
+                target.flush()
+                os.fsync(target.fileno())
+
+            if row_number + 1 != self.rows.get(category, 0):
+                os.remove(temp_path)
+                in_sync = False
+            else:
+                os.replace(temp_path, path)
+                self.urls.update(current)
+                in_sync = True
+        if not in_sync:
+            print(f"{category} CSV changed outside the index; rebuilding the index")
+            self.rebuild()
+            if retry:
+                self.compact(category, retry=False)
+            return
+        with self._lock:
+            removed = self.rows.get(category, 0) - kept
+            self.rows[category] = kept
+            self.stale[category] = 0
+        print(f"Compacted {category} CSV: removed {removed} superseded rows")
+
+    def save(self):
+        """Write the index with the sizes of the files it describes"""
+        with self._lock:
+            data = json.dumps({"sizes": self._file_sizes(), "urls": self.urls,
+                               "rows": self.rows, "stale": self.stale})
+        try:
+            temp_path = self.path + ".tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"Error saving CSV index: {e}")
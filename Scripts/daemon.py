@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Daemon
+------
+Headless mode that starts once and keeps the models, the worker pool, the
+HTTP connections and the CSV writer warm between jobs. URL files dropped
+into the inbox are processed as they arrive, and URLs sent to the local
+socket are answered with one result line each.
+
+    python daemon.py [--inbox DIR] [--port 8765]
+    printf 'https://example.com\\n' | nc -N localhost 8765
+
+Write inbox files under a .tmp or .part name and rename them when complete;
+such names are ignored.
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+import socketserver
+import concurrent.futures
+from config import (DAEMON_INBOX_DIR, DAEMON_OUTBOX_DIR, DAEMON_PORT, DAEMON_POLL_INTERVAL,
+                    DAEMON_KEEPALIVE_INTERVAL, SUBMIT_WINDOW)
+from processor import process_url, _future_result
+from file_handler import create_folders, BatchResultsWriter
+from export_csv import start_csv_writer, stop_csv_writer
+from llm import warm_up, reset_stats, pop_think_tokens, print_latency_summary
+from utils import iter_urls_from_file
+from concurrency import llm_limiter, worker_count
+from domain_cache import domain_cache
+from segments import close_segment_store
+from cache_manager import cache_manager
+
+PARTIAL_SUFFIXES = ('.tmp', '.part')
+
+
+class _Job:
+    """Results of one inbox file or socket connection, written as they finish"""
+
+    def __init__(self, name, write):
+        self.name = name
+        self.write = write
+        self.submitted = 0
+        self.count = 0
+        self.succeeded = 0
+        self.start_time = time.time()
+        self._condition = threading.Condition()
+
+    def add(self):
+        with self._condition:
+            self.submitted += 1
+
+    def record(self, result):
+        with self._condition:
+            try:
+                self.write(result)
+            except Exception as e:
+                print(f"Error writing result of {result[0]} for {self.name}: {e}")
+            self.count += 1
+            self.succeeded += bool(result[1])
+            self._condition.notify_all()
+
+    def wait(self):
+        """Block until every submitted URL has a result"""
+        with self._condition:
+            while self.count < self.submitted:
+                self._condition.wait()
+
+
+class Daemon:
+    """Long-running batch processor fed from an inbox directory and a local socket
+
+    All jobs share one thread pool, CSV writer and cache janitor, and at most
+    SUBMIT_WINDOW URLs are in flight across them. Each inbox file gets its
+    own results file in the outbox. When the daemon has been idle for
+    DAEMON_KEEPALIVE_INTERVAL the models are touched again so Ollama keeps
+    them loaded.
+    """
+
+    def __init__(self, inbox=DAEMON_INBOX_DIR, outbox=DAEMON_OUTBOX_DIR, port=DAEMON_PORT):
+        self.inbox = inbox
+        self.outbox = outbox
+        self.port = port
+        self.processing = os.path.join(inbox, "_processing")
+        self.done = os.path.join(inbox, "_done")
+        self.executor = None
+        self.server = None
+        self.stopping = threading.Event()
+        self.last_activity = time.time()
+        self._slots = threading.BoundedSemaphore(SUBMIT_WINDOW)
+        self._lock = threading.Lock()
+        self._active_jobs = 0
+        self._threads = []
+        self._connections = set()  # sockets of the open socket jobs
+
+    # URL processing
+
+    def submit(self, url, job):
+        """Process a URL on the shared pool, blocking while the window is full"""
+        self._slots.acquire()
+        job.add()
+        try:
+            future = self.executor.submit(process_url, url)
+        except Exception as e:
+            # The pool is shut down
+            self._slots.release()
+            job.record((url, False, str(e)))
+            return
+
+        def finished(future):
+            self._slots.release()
+            job.record(_future_result(future, url))
+            self.last_activity = time.time()
+
+        future.add_done_callback(finished)
+
+    def _job_started(self):
+        with self._lock:
+            self._active_jobs += 1
+            self.last_activity = time.time()
+
+    def _job_finished(self, job):
+        print(f"Finished {job.name}: {job.succeeded}/{job.count} URLs in {time.time() - job.start_time:.2f} seconds")
+        print_latency_summary()
+        with self._lock:
+            self._active_jobs -= 1
+            idle = self._active_jobs == 0
+        if idle:
+            print(llm_limiter.summary())
+            print(cache_manager.summary())
+            cache_manager.reset_stats()
+            domain_cache.save()
+
+    # Inbox
+
+    def _recover(self):
+        """Put files left in _processing by an earlier run back into the inbox"""
+        for name in os.listdir(self.processing):
+            os.replace(os.path.join(self.processing, name), os.path.join(self.inbox, name))
+            print(f"Resuming {name}")
+
+    def _claim_inbox_files(self):
+        """Move complete new inbox files to _processing and return their paths"""
+        claimed = []
+        for entry in sorted(os.scandir(self.inbox), key=lambda entry: entry.stat().st_mtime):
+            if (not entry.is_file() or entry.name.startswith(('.', '_'))
+                    or entry.name.endswith(PARTIAL_SUFFIXES)):
+                continue
+            path = os.path.join(self.processing, entry.name)
+            try:
+                os.replace(entry.path, path)
+            except OSError as e:
+                print(f"Error claiming {entry.name}: {e}")
+                continue
+            claimed.append(path)
+        return claimed
+
+    def _run_file_job(self, path):
+        name = os.path.basename(path)
+        results_path = os.path.join(self.outbox, f"{name}.results.txt")
+        writer = BatchResultsWriter(path=results_path)
+        job = _Job(name, lambda result: writer.write(result, pop_think_tokens(result[0])))
+        self._job_started()
+        try:
+            for url in iter_urls_from_file(path):
+                if self.stopping.is_set():
+                    break
+                self.submit(url, job)
+            job.wait()
+        finally:
+            writer.close()
+            self._job_finished(job)
+        if not self.stopping.is_set():
+            os.replace(path, os.path.join(self.done, name))
+            print(f"Results saved to: {results_path}")
+
+    def _watch_inbox(self):
+        while not self.stopping.wait(DAEMON_POLL_INTERVAL):
+            try:
+                for path in self._claim_inbox_files():
+                    print(f"Processing {os.path.basename(path)}")
+                    thread = threading.Thread(target=self._run_file_job, args=(path,), daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+                self._threads = [thread for thread in self._threads if thread.is_alive()]
+            except Exception as e:
+                print(f"Error scanning inbox: {e}")
+
+            with self._lock:
+                idle = self._active_jobs == 0
+            if idle and time.time() - self.last_activity >= DAEMON_KEEPALIVE_INTERVAL:
+                warm_up()
+                self.last_activity = time.time()
+
+    # Local socket
+
+    def _start_server(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def setup(self):
+                super().setup()
+                with daemon._lock:
+                    daemon._connections.add(self.connection)
+
+            def finish(self):
+                with daemon._lock:
+                    daemon._connections.discard(self.connection)
+                super().finish()
+
+            def handle(self):
+                lock = threading.Lock()
+
+                def write(result):
+                    pop_think_tokens(result[0])
+                    line = f"{result[0]}\t{result[1]}\t{result[2]}\n".encode('utf-8')
+                    with lock:
+                        self.wfile.write(line)
+                        self.wfile.flush()
+
+                job = _Job(f"connection from {self.client_address[0]}:{self.client_address[1]}", write)
+                daemon._job_started()
+                try:
+                    for raw in self.rfile:
+                        if daemon.stopping.is_set():
+                            break
+                        url = raw.decode('utf-8', errors='replace').strip()
+                        if url and not url.startswith('#'):
+                            daemon.submit(url, job)
+                    job.wait()
+                finally:
+                    daemon._job_finished(job)
+
+        # Handler threads aren't daemon threads, so server_close() joins them
+        class Server(socketserver.ThreadingTCPServer):
+            allow_reuse_address = True
+
+        self.server = Server(("127.0.0.1", self.port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Listening for URLs on 127.0.0.1:{self.port}")
+
+    # Lifecycle
+
+    def run(self):
+        for directory in (self.inbox, self.outbox, self.processing, self.done):
+            os.makedirs(directory, exist_ok=True)
+        create_folders()
+        warm_up()
+        reset_stats()
+        self._recover()
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count())
+        start_csv_writer()
+        cache_manager.start_janitor()
+        if self.port:
+            self._start_server()
+        print(f"Watching {self.inbox} (Ctrl+C to stop)")
+        try:
+            self._watch_inbox()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """Stop taking jobs, finish the URLs in flight and close the outputs"""
+        print("\nStopping daemon...")
+        self.stopping.set()
+        if self.server is not None:
+            self.server.shutdown()
+            # End the reads of open connections; their URLs in flight are still answered
+            with self._lock:
+                connections = list(self._connections)
+            for connection in connections:
+                try:
+                    connection.shutdown(socket.SHUT_RD)
+                except OSError:
+                    pass
+            self.server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self.executor.shutdown(wait=True)
+        stop_csv_writer()
+        close_segment_store()
+        cache_manager.stop_janitor()
+        domain_cache.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process URL files and socket requests in one long-running process")
+    parser.add_argument("--inbox", default=DAEMON_INBOX_DIR, help="Directory watched for URL files")
+    parser.add_argument("--outbox", default=DAEMON_OUTBOX_DIR, help="Directory for the per-file results")
+    parser.add_argument("--port", type=int, default=DAEMON_PORT, help="Local socket port (0 disables it)")
+    args = parser.parse_args()
+
+    daemon = Daemon(args.inbox, args.outbox, args.port)
+    if hasattr(signal, "SIGTERM"):
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stopping.set())
+    daemon.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
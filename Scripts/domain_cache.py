@@ -0,0 +1,142 @@
+import os
+import json
+import random
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+from config import DOMAIN_CACHE_FILE, DOMAIN_INHERIT_AFTER, DOMAIN_SPOT_CHECK_RATE
+from utils import file_lock
+
+# Second-level public suffixes under which a registrable domain has three labels
+SECOND_LEVEL_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au", "edu.au", "gov.au",
+    "com.sg", "edu.sg", "gov.sg", "org.sg", "co.jp", "ne.jp", "or.jp", "ac.jp", "com.br",
+    "co.in", "co.nz", "co.za", "com.cn", "com.hk", "com.my", "co.kr", "com.tw", "com.mx",
+}
+
+SPOT_CHECKS_MAX = 1000  # Spot-checked URLs awaiting their classification
+
+
+def registrable_domain(url):
+    """Return the registrable domain of a URL (e.g. shop.example.co.uk -> example.co.uk)"""
+    host = (urlparse(url).hostname or "").lower().rstrip(".")
+    labels = host.split(".")
+    if len(labels) <= 2 or host.replace(".", "").isdigit():
+        return host
+    if ".".join(labels[-2:]) in SECOND_LEVEL_SUFFIXES:
+        return ".".join(labels[-3:])
+    return ".".join(labels[-2:])
+
+
+class DomainCategoryCache:
+    """Category prior per registrable domain
+
+    After DOMAIN_INHERIT_AFTER consecutive classifications with the same
+    category, later pages of the domain inherit it without an LLM call. A
+    DOMAIN_SPOT_CHECK_RATE share of those pages is still classified to catch
+    drift; a disagreement resets the domain's streak. Saving merges the
+    domains changed here into the file under a lock, so processes sharing
+    the cache (e.g. work queue workers) don't overwrite each other.
+    """
+
+    def __init__(self, path=DOMAIN_CACHE_FILE):
+        self.path = path
+        self.domains = {}
+        # URL -> None; capped, since a failed classification never records its URL
+        self._spot_checks = OrderedDict()
+        self._changed = set()  # domains recorded since the last save
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self.reset_stats()
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.domains = json.load(f)
+        except Exception as e:
+            print(f"Error reading domain cache: {e}")
+
+    def save(self):
+        """Merge the domains changed since the last save into the file and pick up the others' changes"""
+        with self._lock:
+            if not self._changed:
+                return
+            changed = {domain: dict(self.domains[domain]) for domain in self._changed}
+            self._changed = set()
+            self._dirty = 0
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with file_lock(self.path + ".lock"):
+                domains = {}
+                if os.path.exists(self.path):
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        domains = json.load(f)
+                domains.update(changed)
+                temp_path = self.path + ".tmp"
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(domains, f)
+                os.replace(temp_path, self.path)
+        except Exception as e:
+            print(f"Error saving domain cache: {e}")
+            return
+        with self._lock:
+            for domain, entry in domains.items():
+                if domain not in self._changed:
+                    self.domains[domain] = entry
+
+    def reset_stats(self):
+        """Clear the hit and spot-check counters"""
+        self.lookups = 0
+        self.hits = 0
+        self.spot_checks = 0
+        self.disagreements = 0
+
+    def inherited_category(self, url):
+        """Return the domain's category if it is established, else None"""
+        domain = registrable_domain(url)
+        with self._lock:
+            self.lookups += 1
+            entry = self.domains.get(domain)
+            if not entry or entry["streak"] < DOMAIN_INHERIT_AFTER:
+                return None
+            if random.random() < DOMAIN_SPOT_CHECK_RATE:
+                self._spot_checks[url] = None
+                if len(self._spot_checks) > SPOT_CHECKS_MAX:
+                    self._spot_checks.popitem(last=False)
+                return None
+            self.hits += 1
+            return entry["category"]
+
+    def record(self, url, category):
+        """Feed a classification made by the LLM (or the embedding categorizer) into the prior"""
+        domain = registrable_domain(url)
+        with self._lock:
+            entry = self.domains.setdefault(domain, {"category": category, "streak": 0})
+            if url in self._spot_checks:
+                del self._spot_checks[url]
+                self.spot_checks += 1
+                if category != entry["category"]:
+                    self.disagreements += 1
+            if category == entry["category"]:
+                entry["streak"] += 1
+            else:
+                entry["category"] = category
+                entry["streak"] = 1
+            self._changed.add(domain)
+            self._dirty += 1
+            flush = self._dirty >= 20
+        if flush:
+            self.save()
+
+    def summary(self):
+        """Return a one-line description of the hit and disagreement rates"""
+        hit_rate = self.hits / self.lookups if self.lookups else 0
+        disagreement_rate = self.disagreements / self.spot_checks if self.spot_checks else 0
+        return (f"Domain category cache: {self.hits}/{self.lookups} inherited ({hit_rate:.0%}), "
+                f"{self.spot_checks} spot checks, {self.disagreements} disagreements ({disagreement_rate:.0%})")
+
+
+domain_cache = DomainCategoryCache()
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Embedding categorizer
+---------------------
+Classifies pages by comparing an embedding of their text with per-category
+centroids, and finds previously analyzed pages similar to a given one.
+
+    python embeddings.py similar <url> [-k 5]
+    python embeddings.py stats
+"""
+
+import os
+import sys
+import mmap
+import json
+import argparse
+import threading
+from collections import OrderedDict
+from config import VECTOR_STORE_DIR, EMBED_MIN_EXAMPLES, EMBED_MIN_MARGIN
+from llm import embed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EMBED_TEXT_CHARS = 3000  # Same sample size as the chat classifier
+UNLABELED_MAX = 1000  # Embeddings kept while waiting for the chat classifier's label
+
+
+def _normalize(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorStore:
+    """Append-only store of normalized page embeddings in a memory-mapped float32 matrix
+
+    Files in the store directory:
+    - vectors.f32: the matrix, preallocated in chunks and grown by doubling
+    - labels.jsonl: one line per row (url, category, source); its length is the row count
+    - store.json: the embedding dimension and current capacity
+
+    Rows labeled by the chat classifier (source "chat") feed the per-category
+    centroids; every row is available for similarity lookups.
+    """
+
+    def __init__(self, directory=VECTOR_STORE_DIR):
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.labels_path = os.path.join(directory, "labels.jsonl")
+        self.meta_path = os.path.join(directory, "store.json")
+        self.dim = None
+        self.capacity = 0
+        self.count = 0
+        self.labels = []
+        self.url_rows = {}
+        self.sums = {}
+        self.counts = {}
+        self._matrix = None
+        self._file = None
+        self._mmap = None
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        """Open an existing store and rebuild the centroid sums"""
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.dim, self.capacity = meta["dim"], meta["capacity"]
+        self._map()
+
+        if os.path.exists(self.labels_path):
+            with open(self.labels_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        self.labels.append(json.loads(line))
+        # Rows past the capacity belong to a write that didn't finish
+        self.labels = self.labels[:self.capacity]
+        self.count = len(self.labels)
+
+        for row, label in enumerate(self.labels):
+            self.url_rows[label["url"]] = row
+            if label["source"] == "chat":
+                self._add_to_centroid(label["category"], self._matrix[row])
+
+    def _add_to_centroid(self, category, vector):
+        if category not in self.sums:
+            self.sums[category] = np.zeros(self.dim, dtype=np.float64)
+            self.counts[category] = 0
+        self.sums[category] += vector
+        self.counts[category] += 1
+
+    def _map(self):
+        """Memory-map the matrix file at the current capacity"""
+        self._file = open(self.vectors_path, 'r+b')
+        self._mmap = mmap.mmap(self._file.fileno(), self.capacity * self.dim * 4)
+        self._matrix = np.frombuffer(self._mmap, dtype=np.float32).reshape(self.capacity, self.dim)
+
+    def _unmap(self):
+        """Flush and close the mapping; fails rather than leaving a view of a closed map"""
+        if self._mmap is None:
+            return
+        self._mmap.flush()
+        self._matrix = None
+        self._mmap.close()
+        self._file.close()
+        self._mmap = self._file = None
+
+    def _grow(self, dim):
+        """Create the matrix or double its capacity"""
+        os.makedirs(self.directory, exist_ok=True)
+        # The file is only resized once nothing maps it
+        self._unmap()
+        self.dim = dim
+        self.capacity = max(1024, self.capacity * 2)
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(self.capacity * self.dim * 4)
+        self._map()
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({"dim": self.dim, "capacity": self.capacity}, f)
+
+    def add(self, vector, url, category, source):
+        """Store a normalized embedding with its label"""
+        with self._lock:
+            if self.dim is not None and len(vector) != self.dim:
+                raise ValueError(f"Embedding has {len(vector)} dimensions, the store at "
+                                 f"{self.directory} has {self.dim} (was EMBED_MODEL changed?)")
+            if self._matrix is None or self.count >= self.capacity:
+                self._grow(len(vector))
+            row = self.count
+            self._matrix[row] = vector
+            label = {"url": url, "category": category, "source": source}
+            # The label line is written last, so a crash never exposes a row without its vector
+            with open(self.labels_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(label) + "\n")
+            self.labels.append(label)
+            self.url_rows[url] = row
+            self.count += 1
+            if source == "chat":
+                self._add_to_centroid(category, vector)
+
+    def nearest_centroid(self, vector):
+        """Return the closest category, or None when centroids are missing or too close to call"""
+        with self._lock:
+            ready = [c for c, n in self.counts.items() if n >= EMBED_MIN_EXAMPLES]
+            if len(ready) < 2:
+                return None
+            centroids = np.stack([_normalize(self.sums[c]) for c in ready])
+        similarities = centroids @ vector
+        order = np.argsort(similarities)[::-1]
+        if similarities[order[0]] - similarities[order[1]] < EMBED_MIN_MARGIN:
+            return None
+        return ready[order[0]]
+
+    def top_k(self, vector, k=5, exclude_url=None):
+        """Return up to k (url, category, similarity) tuples of the most similar stored pages"""
+        with self._lock:
+            if not self.count:
+                return []
+            similarities = np.asarray(self._matrix[:self.count] @ vector)
+            labels = self.labels[:self.count]
+            url_rows = dict(self.url_rows)
+
+        # Take a few extra candidates to make up for superseded rows of re-analyzed URLs
+        candidates = min(self.count, k * 2 + 1)
+        rows = np.argpartition(-similarities, candidates - 1)[:candidates]
+        rows = rows[np.argsort(-similarities[rows])]
+
+        results = []
+        for row in rows:
+            label = labels[row]
+            if url_rows.get(label["url"]) != row or label["url"] == exclude_url:
+                continue
+            results.append((label["url"], label["category"], float(similarities[row])))
+            if len(results) == k:
+                break
+        return results
+
+    def vector_for(self, url):
+        """Return the latest stored embedding of a URL, or None"""
+        with self._lock:
+            row = self.url_rows.get(url)
+            return None if row is None else np.array(self._matrix[row])
+
+
+class EmbeddingCategorizer:
+    """Nearest-centroid classifier over page embeddings
+
+    classify() returns None until enough chat-labeled examples exist (or when
+    the page sits between two centroids); detect_category then falls back to
+    the chat classifier and hands its answer back through add_label().
+    """
+
+    def __init__(self, store):
+        self.store = store
+        # URL -> embedding until add_label(); capped, since a failed classification never labels it
+        self._unlabeled = OrderedDict()
+        self._lock = threading.Lock()
+
+    def classify(self, website_text, url):
+        vector = _normalize(embed(website_text[:EMBED_TEXT_CHARS], url))
+        category = self.store.nearest_centroid(vector)
+        if category:
+            self.store.add(vector, url, category, source="embedding")
+        else:
+            with self._lock:
+                self._unlabeled[url] = vector
+                self._unlabeled.move_to_end(url)
+                if len(self._unlabeled) > UNLABELED_MAX:
+                    self._unlabeled.popitem(last=False)
+        return category
+
+    def add_label(self, url, category, website_text=None):
+        """Store a chat-labeled page so it contributes to its category's centroid"""
+        with self._lock:
+            vector = self._unlabeled.pop(url, None)
+        if vector is None:
+            if website_text is None:
+                return
+            vector = _normalize(embed(website_text[:EMBED_TEXT_CHARS], url))
+        self.store.add(vector, url, category, source="chat")
+
+    def similar_pages(self, website_text, k=5, url=None):
+        """Return the k stored pages most similar to a text"""
+        vector = _normalize(embed(website_text[:EMBED_TEXT_CHARS], url))
+        return self.store.top_k(vector, k, exclude_url=url)
+
+
+_categorizer = None
+_categorizer_lock = threading.Lock()
+_numpy_warning_shown = False
+
+
+def get_categorizer():
+    """Return the shared embedding categorizer, or None if NumPy is not installed"""
+    global _categorizer, _numpy_warning_shown
+    if np is None:
+        if not _numpy_warning_shown:
+            print("NumPy is not installed; falling back to the chat categorizer (pip install numpy)")
+            _numpy_warning_shown = True
+        return None
+    with _categorizer_lock:
+        if _categorizer is None:
+            _categorizer = EmbeddingCategorizer(VectorStore())
+        return _categorizer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the page embedding store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    similar = subparsers.add_parser("similar", help="List stored pages similar to a stored URL")
+    similar.add_argument("url")
+    similar.add_argument("-k", type=int, default=5)
+    subparsers.add_parser("stats", help="Show store size and examples per category")
+    args = parser.parse_args()
+
+    if np is None:
+        print("NumPy is required: pip install numpy")
+        return 1
+    store = VectorStore()
+
+    if args.command == "stats":
+        print(f"{store.count} pages stored ({store.dim or 0} dimensions)")
+        for category, count in sorted(store.counts.items()):
+            print(f"  {category}: {count} chat-labeled examples")
+        return 0
+
+    vector = store.vector_for(args.url)
+    if vector is None:
+        print(f"URL not in the store: {args.url}")
+        return 1
+    for url, category, similarity in store.top_k(vector, args.k, exclude_url=args.url):
+        print(f"{similarity:.3f}  {category:<14} {url}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
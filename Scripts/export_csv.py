@@ -1,33 +1,38 @@
 import os
 import re
 import csv
-from config import BASE_SAVE_DIR, CATEGORIES
+import json
+import time
+import hashlib
+import queue
+import threading
+from contextlib import contextmanager
+from config import (BASE_SAVE_DIR, CSV_FLUSH_ROWS, CSV_FLUSH_INTERVAL, CSV_UPSERT, CSV_COMPACT_STALE_ROWS,
+                    EXPORT_MANIFEST_FILE)
+from schema import SCHEMAS, get_schema
+from csv_index import CSVIndex
+from utils import file_lock
+from tracing import tracer
 
 def create_csv_files():
     """Create base directory and initialize CSVs for each category with headers"""
     if not os.path.exists(BASE_SAVE_DIR):
         os.makedirs(BASE_SAVE_DIR)
 
-    for category, questions in CATEGORIES.items():
-        category_csv = os.path.join(BASE_SAVE_DIR, f"{category}.csv")
-        if not os.path.exists(category_csv):
-            with open(category_csv, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                # Write category name as the first row
-                writer.writerow([f"Category: {category}"])
-                
-                # Extract headers from questions
-                headers = ["URL"]  # Add URL as the first column
-                for line in questions.strip().split('\n'):
-                    line = line.strip()
-                    if line and ". " in line:
-                        # Extract the question text after the number
-                        question = line.split(". ", 1)[1].strip()
-                        headers.append(question)
-                
-                # Write headers row
-                writer.writerow(headers)
-            print(f"Created CSV file for category: {category}")
+    with _process_lock():
+        for category, schema in SCHEMAS.items():
+            category_csv = os.path.join(BASE_SAVE_DIR, f"{category}.csv")
+            if not os.path.exists(category_csv):
+                with open(category_csv, 'w', newline='', encoding='utf-8') as f:
+                    writer = csv.writer(f)
+                    # Write category name as the first row
+                    writer.writerow([f"Category: {category}"])
+                    
+                    # Write headers row
+                    writer.writerow(schema.header)
+                if _csv_index is not None:
+                    _csv_index.forget(category)
+                print(f"Created CSV file for category: {category}")
 
 def parse_analysis(analysis_text):
     """Parse structured analysis text into a dictionary"""
@@ -75,47 +80,311 @@ def extract_analysis_text(content):
     else:
         return content.strip()
 
-def append_to_category_csv(url, analysis_text, category):
-    """Append analysis results to the appropriate category CSV file"""
-    # Make sure category CSVs exist
+class CSVWriter:
+    """Single writer thread that owns the category CSV files
+
+    Worker threads hand rows over through a queue. Rows are buffered per
+    category and written with one writerows() call when CSV_FLUSH_ROWS rows
+    are pending or CSV_FLUSH_INTERVAL seconds have passed. The files stay open
+    for the whole batch and are fsynced on close.
+
+    With CSV_UPSERT the writer also keeps the CSV index: categories collecting
+    CSV_COMPACT_STALE_ROWS superseded rows are compacted during the batch and
+    all others when the writer closes.
+    """
+
+    _STOP = object()
+
+    def __init__(self, flush_rows=CSV_FLUSH_ROWS, flush_interval=CSV_FLUSH_INTERVAL):
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._handles = {}
+        self._buffers = {}
+        self._pending = 0
+        self.failed_rows = 0  # rows lost to write errors
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def write(self, category, row):
+        """Queue a row for the category CSV"""
+        self._queue.put((category, row))
+
+    def close(self):
+        """Flush all queued rows, fsync and close the files; return the number of rows that failed to write"""
+        self._queue.put(self._STOP)
+        self._thread.join()
+        return self.failed_rows
+
+    def _run(self):
+        last_flush = time.time()
+        while True:
+            timeout = max(0, self.flush_interval - (time.time() - last_flush))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is self._STOP:
+                self._flush()
+                self._close_files()
+                self._compact_stale(final=True)
+                return
+            if item is not None:
+                category, row = item
+                self._buffers.setdefault(category, []).append(row)
+                self._pending += 1
+
+            if self._pending >= self.flush_rows or time.time() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush = time.time()
+
+    def _flush(self):
+        """Write all buffered rows, one batch per category"""
+        if self._pending:
+            with tracer.span("csv_flush", "io", rows=self._pending):
+                self._write_buffers()
+        self._pending = 0
+        self._compact_stale()
+
+    def _compact_stale(self, final=False):
+        """Compact categories with CSV_COMPACT_STALE_ROWS superseded rows, or all with any when final"""
+        try:
+            index = _get_csv_index()
+            if index is None:
+                return
+            for category in index.stale_categories(1 if final else CSV_COMPACT_STALE_ROWS):
+                self._compact(category)
+            if final:
+                index.save()
+        except Exception as e:
+            print(f"Error compacting CSVs: {e}")
+
+    def _write_buffers(self):
+        for category, rows in self._buffers.items():
+            if not rows:
+                continue
+            try:
+                index = _get_csv_index()
+                handle = self._handles.get(category)
+                if handle is None:
+                    _ensure_category_csv(category)
+                    handle = open(os.path.join(BASE_SAVE_DIR, f"{category}.csv"), 'a', newline='', encoding='utf-8')
+                    self._handles[category] = handle
+                if index is not None:
+                    for row in rows:
+                        index.assign(row[0], category)
+                # Append mode writes at the end of the file even if another process appended meanwhile
+                with _process_lock():
+                    csv.writer(handle).writerows(rows)
+                    handle.flush()
+            except Exception as e:
+                self.failed_rows += len(rows)
+                print(f"Error writing {category} CSV: {e}")
+            rows.clear()
+
+    def _compact(self, category):
+        """Close the category's handle and drop its superseded rows"""
+        handle = self._handles.pop(category, None)
+        try:
+            if handle is not None:
+                handle.close()
+            with tracer.span("csv_compact", "io", category=category):
+                _get_csv_index().compact(category)
+        except Exception as e:
+            print(f"Error compacting {category} CSV: {e}")
+
+    def _close_files(self):
+        for category, handle in self._handles.items():
+            try:
+                os.fsync(handle.fileno())
+                handle.close()
+            except Exception as e:
+                print(f"Error closing {category} CSV: {e}")
+        self._handles.clear()
+
+
+_csv_writer = None
+_csv_lock = threading.Lock()
+_known_csvs = set()
+_csv_index = None
+_csv_index_lock = threading.Lock()
+_process_lock_path = None
+
+
+def enable_process_lock():
+    """Share the category CSVs with other processes writing to BASE_SAVE_DIR
+
+    Used by work queue workers: CSV writes are serialized with a lock file
+    and rows are only appended, because the CSV index of one process can't
+    see the rows of the others. Superseded rows are compacted afterwards by
+    a single process (python work_queue.py results).
+    """
+    global _process_lock_path
+    _process_lock_path = os.path.join(BASE_SAVE_DIR, "_csv.lock")
+
+
+@contextmanager
+def _process_lock():
+    if _process_lock_path is None:
+        yield
+    else:
+        with file_lock(_process_lock_path):
+            yield
+
+
+def _get_csv_index():
+    """Return the shared CSV index, or None when CSVs are append-only"""
+    global _csv_index
+    if not CSV_UPSERT or _process_lock_path is not None:
+        return None
+    with _csv_index_lock:
+        if _csv_index is None:
+            _csv_index = CSVIndex()
+        return _csv_index
+
+
+def start_csv_writer():
+    """Route CSV rows through a single buffered writer thread until stop_csv_writer()
+
+    Returns False if a writer was already running.
+    """
+    global _csv_writer
+    if _csv_writer is not None:
+        return False
+    _csv_writer = CSVWriter()
+    _csv_writer.start()
+    return True
+
+
+def stop_csv_writer():
+    """Flush and close the CSV writer and return the number of rows it failed to write"""
+    global _csv_writer
+    if _csv_writer is None:
+        return 0
+    writer, _csv_writer = _csv_writer, None
+    return writer.close()
+
+
+def indexed_category(url):
+    """Return the category of url's current CSV row, or None (also when CSVs are append-only)"""
+    index = _get_csv_index()
+    return index.category_of(url) if index is not None else None
+
+
+def compact_csvs():
+    """Drop superseded rows from every category CSV that has them"""
+    index = _get_csv_index()
+    if index is None:
+        return
+    with _csv_lock:
+        for category in index.stale_categories():
+            try:
+                index.compact(category)
+            except Exception as e:
+                print(f"Error compacting {category} CSV: {e}")
+        index.save()
+
+
+def _ensure_category_csv(category):
+    """Create the category CSV once per run instead of checking every category per row"""
+    if category in _known_csvs:
+        return
     create_csv_files()
-    
+    _known_csvs.add(category)
+
+
+def append_to_category_csv(url, analysis_text, category):
+    """Append analysis results to the appropriate category CSV file
+
+    While the CSV writer runs, True only means the row was queued; rows that
+    fail to write are counted by stop_csv_writer().
+    """
     # Get the analysis content
     parsed_analysis = parse_analysis(analysis_text)
     if not parsed_analysis:
         print(f"Warning: Could not parse analysis for {url}")
         return False
         
-    # Get the questions for this category
-    category_questions = CATEGORIES.get(category, CATEGORIES['Default'])
-    headers = []
-    for line in category_questions.strip().split('\n'):
-        line = line.strip()
-        if line and ". " in line:
-            question = line.split(". ", 1)[1].strip()
-            headers.append(question)
-    
-    # Prepare the row data
-    row_data = [url]  # Start with URL
+    # Match the answers to this category's questions
+    row_data = get_schema(category).row(url, parsed_analysis)
     
-    # Add values for each header/question
-    for header in headers:
-        value = ""
-        # Look for this header in the parsed analysis
-        for question, answer in parsed_analysis.items():
-            if header.lower() in question.lower() or question.lower() in header.lower():
-                value = answer
-                break
-        row_data.append(value)
+    # During a batch the writer thread owns the files
+    writer = _csv_writer
+    if writer is not None:
+        writer.write(category, row_data)
+        return True
         
     # Write to the CSV file
-    category_csv = os.path.join(BASE_SAVE_DIR, f"{category}.csv")
     try:
-        with open(category_csv, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(row_data)
+        append_rows_to_category_csv(category, [row_data])
         print(f"Appended analysis for {url} to {category} CSV")
         return True
     except Exception as e:
         print(f"Error appending to CSV: {e}")
-        return False
\ No newline at end of file
+        return False
+
+
+def append_rows_to_category_csv(category, rows):
+    """Append prepared rows to a category CSV with a single write (outside the batch writer)"""
+    category_csv = os.path.join(BASE_SAVE_DIR, f"{category}.csv")
+    with _csv_lock:
+        _ensure_category_csv(category)
+        index = _get_csv_index()
+        if index is not None:
+            for row in rows:
+                index.assign(row[0], category)
+        with _process_lock(), open(category_csv, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerows(rows)
+        if index is not None and category in index.stale_categories(CSV_COMPACT_STALE_ROWS):
+            index.compact(category)
+
+
+def read_txt_analysis(path, category):
+    """Read a saved TXT analysis and build its CSV row
+
+    Returns (sha256, row, error); row is None when the file could not be read
+    or parsed. Runs in the export process pool, so it takes and returns plain
+    values and never raises.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        content = data.decode('utf-8')
+    except Exception as e:
+        return None, None, str(e)
+    
+    # Extract URL and analysis text
+    url = ""
+    if "URL:" in content:
+        url = content.split("URL:")[1].split("\n")[0].strip()
+    parsed_analysis = parse_analysis(extract_analysis_text(content))
+    if not parsed_analysis:
+        return digest, None, "Could not parse analysis"
+    return digest, get_schema(category).row(url, parsed_analysis), None
+
+
+def load_export_manifest():
+    """Return {txt path: [mtime, size, sha256]} of the files already exported"""
+    try:
+        with open(EXPORT_MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"Error reading export manifest: {e}")
+        return {}
+
+
+def save_export_manifest(manifest):
+    try:
+        temp_path = EXPORT_MANIFEST_FILE + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, EXPORT_MANIFEST_FILE)
+    except Exception as e:
+        print(f"Error saving export manifest: {e}")
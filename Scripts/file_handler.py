@@ -1,7 +1,6 @@
 import os
-from config import BASE_SAVE_DIR, CACHE_DIR
-from utils import is_cache_expired
-from export_csv import create_csv_files, append_to_category_csv
+from config import BASE_SAVE_DIR, CACHE_DIR, RESULTS_DB_ENABLED, STORAGE_MODE
+from export_csv import create_csv_files, append_to_category_csv, indexed_category
 
 def create_folders():
     """Create base and cache directories"""
@@ -22,13 +21,46 @@ def create_folders():
     # Create CSV files for all categories
     create_csv_files()
 
-def save_analysis_to_file(analysis_text, category, url):
-    """Save analysis to a file in the category folder and update the category CSV"""
+def save_analysis_to_file(analysis_text, category, url, website_text=None, analyze_seconds=None):
+    """Save analysis to a file in the category folder and update the category CSV
+
+    With STORAGE_MODE "segments" the analysis is appended to the segment
+    storage instead of a TXT file. With RESULTS_DB_ENABLED it is also stored in
+    the SQLite results store; website_text and analyze_seconds are kept there
+    as metadata.
+    """
+    if STORAGE_MODE == "segments":
+        return save_analysis_to_segments(analysis_text, category, url, website_text, analyze_seconds)
+    
     # Create category folder if it doesn't exist
     category_dir = os.path.join(BASE_SAVE_DIR, category)
     if not os.path.exists(category_dir):
         os.makedirs(category_dir)
     
+    file_path_txt = analysis_txt_path(url, category)
+    
+    try:
+        # Save the TXT file
+        with open(file_path_txt, 'w', encoding='utf-8') as f:
+            f.write(f"URL: {url}\n\n")
+            f.write(f"ANALYSIS:\n{analysis_text}")
+        remove_previous_category_txt(url, category)
+        
+        # Append to the category CSV file
+        csv_result = append_to_category_csv(url, analysis_text, category)
+        
+        if RESULTS_DB_ENABLED:
+            save_to_results_store(analysis_text, category, url, website_text, analyze_seconds)
+        
+        if csv_result:
+            return True, file_path_txt
+        else:
+            return True, f"{file_path_txt} (CSV update failed)"
+    except Exception as e:
+        return False, str(e)
+
+def analysis_txt_path(url, category):
+    """Return the TXT file an analysis of url is saved to in its category folder"""
     # Create a filename from the URL (sanitized)
     import re
     from urllib.parse import urlparse
@@ -48,48 +80,95 @@ def save_analysis_to_file(analysis_text, category, url):
     if not filename:
         filename = f"analysis_{int(time.time())}"
     
-    file_path_txt = os.path.join(category_dir, f"{filename}.txt")
-    
+    return os.path.join(BASE_SAVE_DIR, category, f"{filename}.txt")
+
+def remove_previous_category_txt(url, category):
+    """Delete the analysis of a reclassified URL from its previous category folder
+
+    The previous category comes from the CSV index, so it has to be looked up
+    before the new row is appended. Without the index (append-only CSVs) the
+    old file stays; the TXT export keeps only the newest analysis of a URL.
+    """
+    previous = indexed_category(url)
+    if previous is None or previous == category:
+        return
+    path = analysis_txt_path(url, previous)
     try:
-        # Save the TXT file
-        with open(file_path_txt, 'w', encoding='utf-8') as f:
-            f.write(f"URL: {url}\n\n")
-            f.write(f"ANALYSIS:\n{analysis_text}")
-        
-        # Append to the category CSV file
+        with open(path, 'r', encoding='utf-8') as f:
+            first_line = f.readline().rstrip("\n")
+        # Truncated file names can collide, so check the URL inside
+        if first_line == f"URL: {url}":
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print(f"Error removing old analysis of {url} in {previous}: {e}")
+
+def save_analysis_to_segments(analysis_text, category, url, website_text=None, analyze_seconds=None):
+    """Append an analysis to the segment storage and update the category CSV"""
+    from segments import get_segment_store
+    try:
+        location = get_segment_store().append(url, category, analysis_text)
         csv_result = append_to_category_csv(url, analysis_text, category)
-        
+        if RESULTS_DB_ENABLED:
+            save_to_results_store(analysis_text, category, url, website_text, analyze_seconds)
         if csv_result:
-            return True, file_path_txt
+            return True, location
         else:
-            return True, f"{file_path_txt} (CSV update failed)"
+            return True, f"{location} (CSV update failed)"
     except Exception as e:
         return False, str(e)
 
-def save_batch_results(results):
-    """Save overall batch summary to a TXT file"""
-    summary_file = os.path.join(BASE_SAVE_DIR, "batch_results.txt")
-    with open(summary_file, 'w', encoding='utf-8') as f:
-        f.write("URL\tSuccess\tResult\n")
+def save_to_results_store(analysis_text, category, url, website_text=None, analyze_seconds=None):
+    """Store an analysis in the SQLite results store"""
+    from results_store import get_results_store
+    try:
+        get_results_store().save(url, category, analysis_text, website_text, analyze_seconds=analyze_seconds)
+    except Exception as e:
+        print(f"Error saving to results store: {e}")
+
+class BatchResultsWriter:
+    """Writes the batch summary TXT line by line as URLs finish"""
+
+    def __init__(self, think_tokens=True, path=None):
+        self.path = path or os.path.join(BASE_SAVE_DIR, "batch_results.txt")
+        self.think_tokens = think_tokens
+        self._file = open(self.path, 'w', encoding='utf-8')
+        if think_tokens:
+            self._file.write("URL\tSuccess\tResult\tThinkTokens\n")
+        else:
+            self._file.write("URL\tSuccess\tResult\n")
+
+    def write(self, result, think_tokens=0):
+        # Join the result list with tabs
+        line = f"{result[0]}\t{result[1]}\t{result[2]}"
+        if self.think_tokens:
+            line += f"\t{think_tokens}"
+        self._file.write(line + "\n")
+
+    def close(self):
+        self._file.close()
+
+def save_batch_results(results, think_tokens=None):
+    """Save overall batch summary to a TXT file
+
+    think_tokens optionally maps each URL to the reasoning tokens its LLM calls used.
+    """
+    writer = BatchResultsWriter(think_tokens is not None)
+    try:
         for result in results:
-            # Join the result list with tabs
-            f.write(f"{result[0]}\t{result[1]}\t{result[2]}\n")
-    return summary_file
+            writer.write(result, think_tokens.get(result[0], 0) if think_tokens is not None else 0)
+    finally:
+        writer.close()
+    return writer.path
 
 def clean_cache():
-    """Clean expired cache files"""
+    """Remove expired cache files and evict entries over the cache budget"""
+    from cache_manager import cache_manager
     if not os.path.exists(CACHE_DIR):
         return
     
     print("Cleaning expired cache files...")
-    count = 0
-    for filename in os.listdir(CACHE_DIR):
-        file_path_txt = os.path.join(CACHE_DIR, filename)
-        if is_cache_expired(file_path_txt):
-            try:
-                os.remove(file_path_txt)
-                count += 1
-            except Exception as e:
-                print(f"Error removing cache file {filename}: {e}")
-    
-    print(f"Removed {count} expired cache files.")
\ No newline at end of file
+    cache_manager.sweep()
+    print(f"Removed {cache_manager.expired} expired and evicted {cache_manager.evicted} cache files.")
+    print(cache_manager.summary())
@@ -0,0 +1,580 @@
+import time
+import random
+import socket
+import threading
+import concurrent.futures
+from collections import deque
+import httpx
+import ollama
+from config import (MODEL_NAME, LLM_TIMEOUTS, NUM_PREDICT, THINKING, OLLAMA_HOSTS,
+                    HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, LLM_LATENCY_SAMPLE_SIZE,
+                    KEEP_ALIVE, WARMUP_MODELS, EMBED_MODEL)
+from utils import percentile
+from metrics import record_llm_call, is_reload
+from concurrency import llm_limiter, acquire_host, release_host
+from tracing import tracer
+
+
+class LLMTimeoutError(Exception):
+    """Raised when an LLM call does not finish before its deadline"""
+
+
+class LLMCancelledError(Exception):
+    """Raised inside an attempt that lost a hedged race"""
+
+
+class ThinkFilter:
+    """Drop <think>...</think> blocks from a streamed reply
+
+    Tags may be split across chunks, so a possible partial tag at the end of a
+    chunk is held back until the next one arrives. Ollama streams roughly one
+    token per chunk, so chunks inside a think block are counted as think tokens.
+    """
+
+    OPEN_TAG = '<think>'
+    CLOSE_TAG = '</think>'
+
+    def __init__(self):
+        self.in_think = False
+        self.pending = ''
+        self.think_tokens = 0
+
+    def feed(self, chunk):
+        """Return the visible part of a chunk"""
+        text = self.pending + chunk
+        self.pending = ''
+        visible = []
+        counted = False
+
+        while text:
+            tag = self.CLOSE_TAG if self.in_think else self.OPEN_TAG
+            index = text.find(tag)
+            if index == -1:
+                keep = _partial_tag_length(text, tag)
+                segment = text[:len(text) - keep]
+                self.pending = text[len(text) - keep:]
+                text = ''
+            else:
+                segment = text[:index]
+                text = text[index + len(tag):]
+
+            if not self.in_think:
+                visible.append(segment)
+            elif segment and not counted:
+                self.think_tokens += 1
+                counted = True
+
+            if index != -1:
+                self.in_think = not self.in_think
+
+        return ''.join(visible)
+
+    def flush(self):
+        """Return any held-back text once the stream has ended"""
+        rest = '' if self.in_think else self.pending
+        self.pending = ''
+        return rest
+
+
+def _partial_tag_length(text, tag):
+    """Return the length of the longest suffix of text that is a prefix of tag"""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+
+def _apply_thinking(messages, call_type):
+    """Append qwen3's /think or /no_think switch to the last user message"""
+    thinking = THINKING.get(call_type)
+    if thinking is None:
+        return messages
+    switch = '/think' if thinking else '/no_think'
+    messages = [dict(message) for message in messages]
+    for message in reversed(messages):
+        if message['role'] == 'user':
+            message['content'] = f"{message['content']}\n{switch}"
+            break
+    return messages
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_recent_latencies = {}  # call type -> recent successful latencies, used for the hedge threshold
+_call_stats = {}  # call type -> counters and sampled latencies since the last reset
+_reloads = 0  # calls that paid for a model load since the last reset
+_think_by_url = {}  # think tokens of URLs that haven't been written to the batch results yet
+_host_counter = 0
+_attempt = threading.local()  # control of the chat attempt running on this thread
+
+
+class _AttemptControl:
+    """Cancellation and deadline of one streamed chat attempt
+
+    Chat connections aren't kept alive, so every attempt has a connection of
+    its own, picked up from httpcore's connect trace. stop() shuts it down,
+    which ends a blocked read at once, even while Ollama is still evaluating
+    the prompt.
+    """
+
+    def __init__(self):
+        self.cancelled = False  # lost a hedged race
+        self.expired = False    # passed its deadline
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def trace(self, event, info):
+        if event == 'connection.connect_tcp.complete':
+            with self._lock:
+                self._stream = info.get('return_value')
+                stopped = self.cancelled or self.expired
+            if stopped:
+                _shutdown(self._stream)
+
+    def stop(self, expired=False):
+        with self._lock:
+            if expired:
+                self.expired = True
+            else:
+                self.cancelled = True
+            stream = self._stream
+        if stream is not None:
+            _shutdown(stream)
+
+
+def _shutdown(stream):
+    """Shut down a connection so a read blocked on it returns at once"""
+    sock = stream.get_extra_info('socket') if stream is not None else None
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _on_request(request):
+    """Let the chat attempt running on this thread see the connection of its request"""
+    control = getattr(_attempt, 'control', None)
+    if control is not None:
+        request.extensions['trace'] = control.trace
+
+
+def get_client(host, timeout):
+    """Return a shared Ollama client for a host with the given read timeout"""
+    key = (host, timeout)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = ollama.Client(host=host, timeout=timeout,
+                                          limits=httpx.Limits(max_keepalive_connections=0),
+                                          event_hooks={'request': [_on_request]})
+        return _clients[key]
+
+
+def _pick_host(hosts):
+    """Pick the primary backend for a call (round-robin)"""
+    global _host_counter
+    with _stats_lock:
+        host = hosts[_host_counter % len(hosts)]
+        _host_counter += 1
+    return host
+
+
+def _hedge_threshold(call_type):
+    """Return the delay after which a hedged request is sent, or None if not enough data"""
+    with _stats_lock:
+        latencies = list(_recent_latencies.get(call_type, ()))
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return None
+    return percentile(latencies, HEDGE_PERCENTILE)
+
+
+def _run_attempt(host, messages, call_type, deadline, control, on_chunk):
+    """Stream one chat request, aborting it on cancellation or when the deadline passes"""
+    client = get_client(host, LLM_TIMEOUTS[call_type])
+    acquire_host(host)
+    try:
+        return _stream_attempt(client, host, messages, call_type, deadline, control, on_chunk)
+    finally:
+        release_host(host)
+
+
+def _stream_attempt(client, host, messages, call_type, deadline, control, on_chunk):
+    """Consume the streamed reply of one attempt
+
+    A timer shuts the connection down when the deadline passes, so the
+    deadline holds even while no chunk arrives (e.g. during prompt evaluation).
+    """
+    stream = client.chat(
+        model=MODEL_NAME,
+        messages=messages,
+        stream=True,
+        options={'num_predict': NUM_PREDICT[call_type]},
+        keep_alive=KEEP_ALIVE
+    )
+
+    parts = []
+    final_chunk = None
+    think_filter = ThinkFilter()
+    _attempt.control = control
+    timer = threading.Timer(max(deadline - time.time(), 0), control.stop, kwargs={'expired': True})
+    timer.daemon = True
+    timer.start()
+    try:
+        for chunk in stream:
+            if control.cancelled:
+                raise LLMCancelledError()
+            if time.time() > deadline:
+                raise LLMTimeoutError(f"{call_type} call exceeded {LLM_TIMEOUTS[call_type]}s deadline")
+
+            # Reasoning never reaches the buffer, the parser or the console
+            content = think_filter.feed(chunk['message']['content'] or '')
+            if content:
+                parts.append(content)
+                if on_chunk:
+                    on_chunk(content)
+            if chunk.get('done'):
+                final_chunk = chunk
+        if final_chunk is None:
+            # A connection shut down by stop() can look like a normal end of the reply
+            if control.cancelled:
+                raise LLMCancelledError()
+            if control.expired:
+                raise LLMTimeoutError(f"{call_type} call exceeded {LLM_TIMEOUTS[call_type]}s deadline")
+    except (LLMCancelledError, LLMTimeoutError):
+        raise
+    except Exception as e:
+        # A read cut short by stop()
+        if control.cancelled:
+            raise LLMCancelledError() from e
+        if control.expired or time.time() >= deadline:
+            raise LLMTimeoutError(f"{call_type} call exceeded {LLM_TIMEOUTS[call_type]}s deadline") from e
+        raise
+    finally:
+        timer.cancel()
+        _attempt.control = None
+        # Closing the stream drops the connection, which stops the generation on the server
+        stream.close()
+    parts.append(think_filter.flush())
+
+    if final_chunk is not None and is_reload(final_chunk):
+        _record_reload(host, final_chunk)
+
+    return {'content': ''.join(parts).lstrip(), 'response': final_chunk, 'host': host,
+            'think_tokens': think_filter.think_tokens}
+
+
+def _record_reload(host, response):
+    """Surface a model load that happened in the middle of a run"""
+    global _reloads
+    load_seconds = response.get('load_duration') / 1e9
+    with _stats_lock:
+        _reloads += 1
+    print(f"Warning: model {MODEL_NAME} was reloaded on {host or 'default host'} "
+          f"({load_seconds:.1f}s load time). Check KEEP_ALIVE and other workloads on the server.")
+
+
+def warm_up(models=None):
+    """Load the configured models on every backend and pin them with KEEP_ALIVE
+
+    An empty generate request makes Ollama load a model without producing
+    any tokens, so the load time is paid here rather than by the first URLs.
+    """
+    models = models or WARMUP_MODELS
+    for host in list(OLLAMA_HOSTS) or [None]:
+        client = get_client(host, max(LLM_TIMEOUTS.values()))
+        for model in models:
+            start = time.time()
+            try:
+                if model == EMBED_MODEL:
+                    client.embed(model=model, input='', keep_alive=KEEP_ALIVE)
+                else:
+                    client.generate(model=model, prompt='', keep_alive=KEEP_ALIVE)
+                print(f"Model {model} ready on {host or 'default host'} ({time.time() - start:.1f}s)")
+            except Exception as e:
+                print(f"Error warming up model {model} on {host or 'default host'}: {e}")
+
+
+def _start_attempt(host, messages, call_type, deadline):
+    """Run an attempt in a background thread and return (future, control)"""
+    future = concurrent.futures.Future()
+    control = _AttemptControl()
+
+    def run():
+        try:
+            future.set_result(_run_attempt(host, messages, call_type, deadline, control, None))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future, control
+
+
+def _hedged_chat(hosts, primary, messages, call_type, deadline, threshold, record):
+    """Send the call to the primary backend and hedge to another one if it runs past the threshold
+
+    The losing attempt is cancelled as soon as the other one finishes. When
+    the hedge wins, the primary's latency is only known to exceed the time it
+    ran, so it is recorded as censored.
+    """
+    start = time.time()
+    first, first_control = _start_attempt(primary, messages, call_type, deadline)
+    attempts = {first: first_control}
+
+    done, _ = concurrent.futures.wait([first], timeout=threshold)
+    if not done:
+        backup = hosts[(hosts.index(primary) + 1) % len(hosts)]
+        future, control = _start_attempt(backup, messages, call_type, deadline)
+        attempts[future] = control
+        record['hedged'] = True
+
+    pending = set(attempts)
+    error = None
+    try:
+        while pending:
+            remaining = max(deadline - time.time(), 0)
+            done, pending = concurrent.futures.wait(
+                pending, timeout=remaining, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    record['hedge_won'] = future is not first
+                    record['primary_latency'] = time.time() - start
+                    record['primary_censored'] = future is not first
+                    return future.result()
+                error = future.exception()
+    finally:
+        for control in attempts.values():
+            control.stop()
+
+    if error is not None and not isinstance(error, LLMCancelledError):
+        raise error
+    raise LLMTimeoutError(f"{call_type} call exceeded {LLM_TIMEOUTS[call_type]}s deadline")
+
+
+def chat(messages, call_type, url=None, category=None, on_chunk=None, urls=None):
+    """Run a chat call with a hard deadline, a num_predict ceiling and optional hedging
+
+    Returns a dict with the reply 'content' (without <think> blocks), the final
+    Ollama 'response' chunk (which carries the eval statistics), the 'host' that
+    answered and the number of 'think_tokens' the model spent reasoning.
+    Every call is recorded in the metrics file together with its eval statistics;
+    a call serving several pages passes their URLs as urls instead of url.
+    """
+    messages = _apply_thinking(messages, call_type)
+    wait_start = time.perf_counter()
+    llm_limiter.acquire()
+    call_start = time.perf_counter()
+    tracer.record("llm_wait", wait_start, call_start, "llm", url=url, call_type=call_type)
+    start = time.time()
+    deadline = start + LLM_TIMEOUTS[call_type]
+    hosts = list(OLLAMA_HOSTS) or [None]
+    primary = _pick_host(hosts)
+
+    # Streamed output can't be hedged without interleaving two replies
+    threshold = None
+    if HEDGE_ENABLED and len(hosts) > 1 and on_chunk is None:
+        threshold = _hedge_threshold(call_type)
+
+    record = {'call_type': call_type, 'url': url, 'hedged': False, 'hedge_won': False,
+              'timed_out': False, 'success': False, 'think_tokens': 0}
+    result = None
+    try:
+        if threshold is None:
+            result = _run_attempt(primary, messages, call_type, deadline, _AttemptControl(), on_chunk)
+        else:
+            result = _hedged_chat(hosts, primary, messages, call_type, deadline, threshold, record)
+        record['success'] = True
+        record['think_tokens'] = result['think_tokens']
+        if result['response'] is not None:
+            record['prompt_eval_duration'] = result['response'].get('prompt_eval_duration')
+            record['prompt_tokens'] = result['response'].get('prompt_eval_count') or 0
+            record['eval_tokens'] = result['response'].get('eval_count') or 0
+        return result
+    except LLMTimeoutError:
+        record['timed_out'] = True
+        raise
+    finally:
+        record['latency'] = time.time() - start
+        # A primary that never finished only bounds its latency from below
+        record.setdefault('primary_latency', record['latency'])
+        record.setdefault('primary_censored', not record['success'])
+        response = result['response'] if result else None
+        llm_limiter.release(record['latency'], response.get('eval_count') if response else None, call_type)
+        tracer.record(f"llm {call_type}", call_start, time.perf_counter(), "llm", url=url,
+                      host=result['host'] if result else primary, hedged=record['hedged'],
+                      timed_out=record['timed_out'], success=record['success'],
+                      eval_count=response.get('eval_count') if response else None)
+        _record_call(record)
+        record_llm_call(
+            url, call_type, category, MODEL_NAME, record['latency'],
+            response,
+            host=result['host'] if result else primary,
+            think_tokens=record['think_tokens'],
+            success=record['success'],
+            timed_out=record['timed_out'],
+            hedged=record['hedged'],
+            **({'urls': urls} if urls else {})
+        )
+
+
+def embed(text, url=None):
+    """Return the embedding vector of a text from EMBED_MODEL
+
+    Embedding calls are cheap, so they bypass the concurrency limiter; they are
+    still recorded in the metrics file.
+    """
+    host = _pick_host(list(OLLAMA_HOSTS) or [None])
+    client = get_client(host, LLM_TIMEOUTS['embed'])
+    start = time.time()
+    response = None
+    try:
+        response = client.embed(model=EMBED_MODEL, input=text, keep_alive=KEEP_ALIVE)
+        return response['embeddings'][0]
+    finally:
+        record_llm_call(url, 'embed', None, EMBED_MODEL, time.time() - start, response,
+                        host=host, success=response is not None)
+
+
+def _record_call(record):
+    """Add a finished call to the hedge thresholds and the batch summary
+
+    Counts and token sums are exact; latencies are kept exactly up to
+    LLM_LATENCY_SAMPLE_SIZE per call type and as a uniform reservoir sample
+    beyond that, so the statistics of a long-running process stay bounded.
+    """
+    with _stats_lock:
+        stats = _call_stats.setdefault(record['call_type'], {
+            'calls': 0, 'timeouts': 0, 'hedged': 0, 'hedge_wins': 0, 'think_tokens': 0,
+            'prompt_tokens': 0, 'eval_tokens': 0, 'prompt_eval_ns': 0, 'prompt_evals': 0,
+            'samples': []})
+        stats['calls'] += 1
+        stats['timeouts'] += record['timed_out']
+        stats['hedged'] += record['hedged']
+        stats['hedge_wins'] += record['hedge_won']
+        stats['think_tokens'] += record['think_tokens']
+        stats['prompt_tokens'] += record.get('prompt_tokens', 0)
+        stats['eval_tokens'] += record.get('eval_tokens', 0)
+        if record.get('prompt_eval_duration'):
+            stats['prompt_eval_ns'] += record['prompt_eval_duration']
+            stats['prompt_evals'] += 1
+
+        sample = (record['latency'], record['primary_latency'], record['primary_censored'])
+        samples = stats['samples']
+        if len(samples) < LLM_LATENCY_SAMPLE_SIZE:
+            samples.append(sample)
+        else:
+            slot = random.randrange(stats['calls'])
+            if slot < LLM_LATENCY_SAMPLE_SIZE:
+                samples[slot] = sample
+
+        if record['url'] and record['think_tokens']:
+            _think_by_url[record['url']] = _think_by_url.get(record['url'], 0) + record['think_tokens']
+        if record['success']:
+            recent = _recent_latencies.setdefault(record['call_type'], deque(maxlen=200))
+            recent.append(record['latency'])
+
+
+def reset_stats(think_tokens=True):
+    """Clear the per-batch call statistics (recent latencies are kept for hedging)
+
+    With think_tokens=False the think tokens of URLs not yet popped are kept,
+    for long-running processes whose other URLs are still in flight.
+    """
+    global _reloads
+    with _stats_lock:
+        _call_stats.clear()
+        _reloads = 0
+        if think_tokens:
+            _think_by_url.clear()
+
+
+def reload_count():
+    """Return the number of model reloads seen since the last reset"""
+    with _stats_lock:
+        return _reloads
+
+
+def token_totals():
+    """Return {call type: {calls, prompt_tokens, eval_tokens, think_tokens}} since the last reset"""
+    with _stats_lock:
+        return {call_type: {key: stats[key] for key in ('calls', 'prompt_tokens', 'eval_tokens', 'think_tokens')}
+                for call_type, stats in _call_stats.items()}
+
+
+def pop_think_tokens(url):
+    """Return the think tokens spent on a finished URL and stop tracking it"""
+    with _stats_lock:
+        return _think_by_url.pop(url, 0)
+
+
+def latency_summary():
+    """Summarize call latencies per call type
+
+    'before' percentiles estimate the primary attempt's own completion time.
+    A primary cancelled by a winning hedge or cut off by the deadline is
+    censored, so they are Kaplan-Meier estimates; 'after' percentiles use the
+    latency actually seen by the caller.
+    """
+    with _stats_lock:
+        stats_by_type = {call_type: dict(stats, samples=list(stats['samples']))
+                         for call_type, stats in _call_stats.items()}
+
+    summary = {}
+    for call_type in sorted(stats_by_type):
+        stats = stats_by_type[call_type]
+        before = [(primary, censored) for _, primary, censored in stats['samples']]
+        after = [latency for latency, _, _ in stats['samples']]
+        summary[call_type] = {
+            'calls': stats['calls'],
+            'timeouts': stats['timeouts'],
+            'hedged': stats['hedged'],
+            'hedge_wins': stats['hedge_wins'],
+            'think_tokens': stats['think_tokens'],
+            'prompt_eval_ms': stats['prompt_eval_ns'] / stats['prompt_evals'] / 1e6 if stats['prompt_evals'] else None,
+            'before': {p: _censored_percentile(before, p) for p in (50, 95, 99)},
+            'after': {p: percentile(after, p) for p in (50, 95, 99)},
+        }
+    return summary
+
+
+def _censored_percentile(samples, pct):
+    """Kaplan-Meier estimate of the pct-th percentile of (seconds, censored) samples
+
+    When the percentile lies beyond the last completed sample, the largest
+    sample is returned as a lower bound.
+    """
+    if not samples:
+        return None
+    # At equal times, completions count before censorings
+    ordered = sorted(samples)
+    at_risk = len(ordered)
+    survival = 1.0
+    for seconds, censored in ordered:
+        if not censored:
+            survival *= 1 - 1 / at_risk
+            if 1 - survival >= pct / 100 - 1e-9:
+                return seconds
+        at_risk -= 1
+    return ordered[-1][0]
+
+
+def print_latency_summary():
+    """Print the tail latency of LLM calls made since the last reset"""
+    summary = latency_summary()
+    if not summary:
+        return
+    print(f"\nModel reloads during the batch: {reload_count()}")
+    print("LLM call latency (seconds):")
+    for call_type, stats in summary.items():
+        before, after = stats['before'], stats['after']
+        print(f"  {call_type}: {stats['calls']} calls, {stats['timeouts']} timed out, "
+              f"{stats['hedged']} hedged ({stats['hedge_wins']} won by hedge)")
+        print(f"    without hedging: p50 {before[50]:.2f}  p95 {before[95]:.2f}  p99 {before[99]:.2f}")
+        print(f"    with hedging:    p50 {after[50]:.2f}  p95 {after[95]:.2f}  p99 {after[99]:.2f}")
+        print(f"    think tokens: {stats['think_tokens']}")
+        if stats['prompt_eval_ms'] is not None:
+            print(f"    prompt evaluation: {stats['prompt_eval_ms']:.0f} ms per call")
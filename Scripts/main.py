@@ -5,68 +5,186 @@ Website Analyzer
 This script analyzes websites and categorizes them based on their content.
 """
 
-from utils import check_dependencies, read_urls_from_file
+from utils import check_dependencies, iter_urls_from_file
 from processor import process_single_url, batch_process_urls
 from file_handler import clean_cache, create_folders
-from export_csv import create_csv_files
+from export_csv import create_csv_files, compact_csvs
+from metrics import print_metrics_report
 import os
+import time
+import itertools
 
-def export_all_txt_to_csv():
-    """Export all existing TXT analysis files to their category CSVs"""
-    from export_csv import extract_analysis_text, append_to_category_csv
-    from config import BASE_SAVE_DIR, CATEGORIES
+def export_all_txt_to_csv(full=False):
+    """Export new and changed TXT analysis files to their category CSVs
+
+    A manifest remembers the (mtime, size, hash, URL) of every exported file,
+    so unchanged files are skipped without being read. Changed files are
+    parsed in a process pool and each category gets one batched write. When
+    several files hold an analysis of the same URL (left over from a
+    reclassification), only the newest one is exported. With full=True every
+    file is exported again.
+    """
+    import concurrent.futures
+    from export_csv import (read_txt_analysis, append_rows_to_category_csv,
+                            load_export_manifest, save_export_manifest)
+    from config import BASE_SAVE_DIR, CATEGORIES, EXPORT_WORKERS, EXPORT_POOL_MIN_FILES
+    
+    # Files of a deleted CSV are exported again even if the manifest knows them
+    missing = {category for category in CATEGORIES
+               if not os.path.exists(os.path.join(BASE_SAVE_DIR, f"{category}.csv"))}
     
     # Ensure CSVs are created
     create_csv_files()
     
-    total_processed = 0
-    total_failed = 0
+    start_time = time.time()
+    manifest = {} if full else load_export_manifest()
+    current = {}
+    changed = []
+    skipped = 0
+    newest = {}  # url -> (mtime, path) of its most recent TXT analysis
     
-    # Process each category folder
+    # Find new and changed files in each category folder
     for category in CATEGORIES.keys():
         category_dir = os.path.join(BASE_SAVE_DIR, category)
         if not os.path.exists(category_dir):
             continue
-        
-        print(f"\nProcessing {category} folder...")
-        processed = 0
-        failed = 0
-        
-        # Process each TXT file in the category folder
-        for filename in os.listdir(category_dir):
-            if filename.endswith(".txt"):
-                txt_path = os.path.join(category_dir, filename)
-                try:
-                    # Read the file
-                    with open(txt_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                    
-                    # Extract URL and analysis text
-                    url = ""
-                    if "URL:" in content:
-                        url_line = content.split("URL:")[1].split("\n")[0].strip()
-                        url = url_line
-                    
-                    analysis_text = extract_analysis_text(content)
-                    
-                    # Append to CSV
-                    if append_to_category_csv(url, analysis_text, category):
-                        processed += 1
-                        print(f"✅ Processed: {filename}")
-                    else:
-                        failed += 1
-                        print(f"❌ Failed to process: {filename}")
-                except Exception as e:
-                    failed += 1
-                    print(f"❌ Error processing {filename}: {e}")
-        
-        print(f"Category {category}: Processed {processed}, Failed {failed}")
-        total_processed += processed
-        total_failed += failed
+        for entry in os.scandir(category_dir):
+            if not entry.name.endswith(".txt"):
+                continue
+            stat = entry.stat()
+            if category in missing:
+                manifest.pop(entry.path, None)
+            known = manifest.get(entry.path)
+            current[entry.path] = known
+            if known and known[0] == stat.st_mtime and known[1] == stat.st_size:
+                skipped += 1
+                if len(known) < 4:
+                    # Manifests written before URLs were recorded
+                    known = current[entry.path] = known[:3] + [_txt_url(entry.path)]
+                _track_newest(newest, known[3], stat.st_mtime, entry.path)
+            else:
+                changed.append((entry.path, category, stat.st_mtime, stat.st_size))
+    
+    print(f"{len(changed)} new or changed TXT files, {skipped} unchanged")
+    
+    # Parse the changed files, in parallel when there are enough of them
+    rows_by_category = {}
+    counts = {}
+    total_failed = 0
+    paths = [item[0] for item in changed]
+    categories = [item[1] for item in changed]
+    if len(changed) >= EXPORT_POOL_MIN_FILES:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=EXPORT_WORKERS)
+        parsed = executor.map(read_txt_analysis, paths, categories, chunksize=64)
+    else:
+        executor = None
+        parsed = map(read_txt_analysis, paths, categories)
+    
+    exportable = []
+    try:
+        for (path, category, mtime, size), (digest, row, error) in zip(changed, parsed):
+            if row is None:
+                total_failed += 1
+                print(f"❌ Failed to process {os.path.basename(path)}: {error}")
+                continue
+            known = manifest.get(path)
+            current[path] = [mtime, size, digest, row[0]]
+            _track_newest(newest, row[0], mtime, path)
+            if known and known[2] == digest:
+                continue  # Touched but not modified
+            exportable.append((path, category, row))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    
+    superseded = 0
+    for path, category, row in exportable:
+        if newest[row[0]][1] != path:
+            superseded += 1
+            continue
+        rows_by_category.setdefault(category, []).append(row)
+    if superseded:
+        print(f"{superseded} TXT files skipped: a newer analysis of the same URL exists")
     
-    print(f"\nTotal: Processed {total_processed}, Failed {total_failed}")
+    # Stream the segment storage from where the last export stopped
+    segment_paths = _collect_segment_rows(manifest, current, missing, rows_by_category)
+    
+    # One batched write per category
+    for category, rows in rows_by_category.items():
+        try:
+            append_rows_to_category_csv(category, rows)
+            counts[category] = len(rows)
+        except Exception as e:
+            total_failed += len(rows)
+            for path, file_category, _, _ in changed:
+                if file_category == category:
+                    current[path] = None
+            for path in segment_paths:
+                current[path] = manifest.get(path)
+            print(f"❌ Error writing {category} CSV: {e}")
+    
+    for category, count in counts.items():
+        print(f"Category {category}: Exported {count}")
+    total_processed = sum(counts.values())
+    
+    # Re-exported files replace their earlier rows
+    compact_csvs()
+    save_export_manifest({path: entry for path, entry in current.items() if entry})
+    
+    print(f"\nTotal: Processed {total_processed}, Failed {total_failed}, Unchanged {skipped} "
+          f"({time.time() - start_time:.1f} seconds)")
     return total_processed, total_failed
 
+def _txt_url(path):
+    """Return the URL on the first line of a saved TXT analysis, or None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            first_line = f.readline()
+    except Exception:
+        return None
+    return first_line[len("URL:"):].strip() if first_line.startswith("URL:") else None
+
+def _track_newest(newest, url, mtime, path):
+    if url and (url not in newest or mtime > newest[url][0]):
+        newest[url] = (mtime, path)
+
+def _collect_segment_rows(manifest, current, missing, rows_by_category):
+    """Add CSV rows for the analyses appended to the segment storage since the last export
+
+    Segments are append-only, so the manifest keeps the size each one was
+    exported up to and reading resumes there. Returns the segment paths read.
+    """
+    from config import SEGMENT_DIR
+    from export_csv import parse_analysis
+    from schema import get_schema
+    from segments import SegmentStore
+    
+    if not os.path.isdir(SEGMENT_DIR):
+        return []
+    store = SegmentStore()
+    start = {}
+    for number in store.segment_numbers():
+        known = manifest.get(store.segment_path(number))
+        if known and not missing:
+            start[number] = known[1]
+    
+    added = 0
+    progress = {}
+    for number, _, record in store.iter_records(start, progress=progress):
+        parsed_analysis = parse_analysis(record["analysis"])
+        if not parsed_analysis:
+            print(f"❌ Failed to process {record['url']} in {os.path.basename(store.segment_path(number))}")
+            continue
+        rows_by_category.setdefault(record["category"], []).append(
+            get_schema(record["category"]).row(record["url"], parsed_analysis))
+        added += 1
+    
+    for number, offset in progress.items():
+        current[store.segment_path(number)] = [None, offset, None]
+    store.close()
+    print(f"{added} analyses read from the segment storage")
+    return [store.segment_path(number) for number in progress]
+
 def main():
     # Check dependencies before starting
     if not check_dependencies():
@@ -78,8 +196,9 @@ def main():
     print("2. Batch process URLs from a file")
     print("3. Clean expired cache")
     print("4. Export all TXT files to CSV")
+    print("5. Show LLM metrics report")
     
-    choice = input("Select an option (1/2/3/4): ")
+    choice = input("Select an option (1/2/3/4/5): ")
     
     if choice == "1":
         # Single URL mode
@@ -93,12 +212,14 @@ def main():
             print(f"File not found: {file_path}")
             return
         
-        urls = read_urls_from_file(file_path)
-        if not urls:
+        # Stream the file so processing starts on the first line
+        urls = iter_urls_from_file(file_path)
+        first_url = next(urls, None)
+        if first_url is None:
             print("No valid URLs found in the file.")
             return
         
-        batch_process_urls(urls)
+        batch_process_urls(itertools.chain([first_url], urls), collect_results=False)
     
     elif choice == "3":
         # Clean cache mode
@@ -108,6 +229,10 @@ def main():
         # Export all TXT files to CSV
         export_all_txt_to_csv()
     
+    elif choice == "5":
+        # LLM metrics report
+        print_metrics_report()
+    
     else:
         print("Invalid choice.")
 
@@ -0,0 +1,162 @@
+import os
+import sys
+import json
+import time
+import threading
+from config import METRICS_ENABLED, METRICS_FILE, RELOAD_THRESHOLD_SECONDS
+from utils import percentile
+
+# Ollama reports these fields on the final response of every call (durations in nanoseconds)
+OLLAMA_STAT_FIELDS = [
+    "prompt_eval_count", "prompt_eval_duration", "eval_count",
+    "eval_duration", "load_duration", "total_duration"
+]
+
+_write_lock = threading.Lock()
+_context = {}  # extra fields added to every record, e.g. the batch ordering
+
+
+def set_metrics_context(**fields):
+    """Set fields that are stored with every following LLM call record"""
+    _context.clear()
+    _context.update(fields)
+
+
+def record_llm_call(url, call_type, category, model, wall_time, response, **extra):
+    """Append one LLM call with its Ollama eval statistics to the metrics file"""
+    if not METRICS_ENABLED:
+        return
+
+    entry = {
+        "timestamp": time.time(),
+        "url": url,
+        "call_type": call_type,
+        "category": category,
+        "model": model,
+        "wall_time": round(wall_time, 4),
+    }
+    for field in OLLAMA_STAT_FIELDS:
+        entry[field] = response.get(field) if response is not None else None
+    entry.update(_context)
+    entry.update(extra)
+
+    try:
+        with _write_lock:
+            os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+            with open(METRICS_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + "\n")
+    except Exception as e:
+        print(f"Error writing metrics: {e}")
+
+
+def read_metrics(path=METRICS_FILE):
+    """Read all recorded LLM calls from a metrics file"""
+    entries = []
+    if not os.path.exists(path):
+        return entries
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A partially written last line from an interrupted run
+                continue
+    return entries
+
+
+def is_reload(entry):
+    """Check whether a call paid for (re)loading the model"""
+    load_duration = entry.get("load_duration") or 0
+    return load_duration / 1e9 > RELOAD_THRESHOLD_SECONDS
+
+
+def summarize_metrics(entries):
+    """Summarize LLM calls per (call type, model)"""
+    groups = {}
+    for entry in entries:
+        groups.setdefault((entry["call_type"], entry["model"]), []).append(entry)
+
+    summary = {}
+    for (call_type, model), rows in sorted(groups.items()):
+        wall_times = [r["wall_time"] for r in rows]
+        eval_tokens = sum(r.get("eval_count") or 0 for r in rows)
+        eval_seconds = sum(r.get("eval_duration") or 0 for r in rows) / 1e9
+        prompt_tokens = sum(r.get("prompt_eval_count") or 0 for r in rows)
+        prompt_seconds = sum(r.get("prompt_eval_duration") or 0 for r in rows) / 1e9
+        load_seconds = sum(r.get("load_duration") or 0 for r in rows) / 1e9
+        summary[(call_type, model)] = {
+            "calls": len(rows),
+            "eval_tokens": eval_tokens,
+            "prompt_tokens": prompt_tokens,
+            "generation_tokens_per_second": eval_tokens / eval_seconds if eval_seconds else None,
+            "prompt_tokens_per_second": prompt_tokens / prompt_seconds if prompt_seconds else None,
+            "prompt_eval_seconds": prompt_seconds,
+            "eval_seconds": eval_seconds,
+            "load_seconds": load_seconds,
+            "reloads": sum(1 for r in rows if is_reload(r)),
+            "p50": percentile(wall_times, 50),
+            "p95": percentile(wall_times, 95),
+            "p99": percentile(wall_times, 99),
+        }
+    return summary
+
+
+def summarize_prompt_eval_by_ordering(entries):
+    """Average prompt evaluation of analysis calls per batch ordering"""
+    groups = {}
+    for entry in entries:
+        if entry["call_type"] == "analyze" and entry.get("ordering") and entry.get("prompt_eval_duration"):
+            groups.setdefault(entry["ordering"], []).append(entry)
+
+    summary = {}
+    for ordering, rows in sorted(groups.items()):
+        summary[ordering] = {
+            "calls": len(rows),
+            "prompt_eval_ms": sum(r["prompt_eval_duration"] for r in rows) / len(rows) / 1e6,
+            "prompt_eval_tokens": sum(r.get("prompt_eval_count") or 0 for r in rows) / len(rows),
+        }
+    return summary
+
+
+def _format_rate(value):
+    return f"{value:.1f}" if value is not None else "n/a"
+
+
+def print_metrics_report(path=METRICS_FILE):
+    """Print tokens/s, latency percentiles and model reloads per call type and model"""
+    entries = read_metrics(path)
+    if not entries:
+        print(f"No LLM metrics recorded in {path}")
+        return
+
+    print(f"LLM metrics report ({len(entries)} calls from {path})")
+    print("=" * 60)
+    for (call_type, model), stats in summarize_metrics(entries).items():
+        print(f"\n{call_type} / {model}: {stats['calls']} calls")
+        print(f"  Generation: {stats['eval_tokens']} tokens, "
+              f"{_format_rate(stats['generation_tokens_per_second'])} tokens/s")
+        print(f"  Prompt:     {stats['prompt_tokens']} tokens, "
+              f"{_format_rate(stats['prompt_tokens_per_second'])} tokens/s")
+        print(f"  Time split: prompt {stats['prompt_eval_seconds']:.1f}s, "
+              f"generation {stats['eval_seconds']:.1f}s, model load {stats['load_seconds']:.1f}s")
+        print(f"  Latency:    p50 {stats['p50']:.2f}s  p95 {stats['p95']:.2f}s  p99 {stats['p99']:.2f}s")
+        print(f"  Model reloads: {stats['reloads']}")
+
+    # Prompt prefix reuse: grouped batches vs. completion-order batches
+    orderings = summarize_prompt_eval_by_ordering(entries)
+    if orderings:
+        print("\nAnalysis prompt evaluation by batch ordering:")
+        for ordering, stats in orderings.items():
+            print(f"  {ordering}: {stats['calls']} calls, {stats['prompt_eval_ms']:.0f} ms and "
+                  f"{stats['prompt_eval_tokens']:.0f} evaluated tokens per call")
+        if "grouped" in orderings and "completion" in orderings:
+            baseline = orderings["completion"]["prompt_eval_ms"]
+            saving = 1 - orderings["grouped"]["prompt_eval_ms"] / baseline if baseline else 0
+            print(f"  Grouping by category saves {saving:.0%} of prompt evaluation time")
+
+
+if __name__ == "__main__":
+    print_metrics_report(sys.argv[1] if len(sys.argv) > 1 else METRICS_FILE)
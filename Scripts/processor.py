@@ -1,14 +1,43 @@
 import time
 import concurrent.futures
+from contextlib import contextmanager
 from tqdm import tqdm
-from config import USE_STREAMING
+from config import USE_STREAMING, GROUP_BY_CATEGORY, GROUPED_BATCH_SIZE, SUBMIT_WINDOW
 from scraper import scrape_website, extract_main_content
-from analyzer import detect_category, analyze_with_ollama
-from file_handler import save_analysis_to_file, save_batch_results, create_folders
+from analyzer import detect_category, detect_category_with_source, analyze_with_ollama
+from llm import reset_stats, print_latency_summary, pop_think_tokens, warm_up
+from file_handler import save_analysis_to_file, BatchResultsWriter, create_folders
+from export_csv import start_csv_writer, stop_csv_writer, compact_csvs
 from utils import validate_url
+from concurrency import llm_limiter, worker_count
+from metrics import set_metrics_context
+from classify_batcher import classify_batcher
+from domain_cache import domain_cache
+from segments import close_segment_store
+from cache_manager import cache_manager
+from tracing import tracer
+from batch_report import batch_report, format_report, write_report
 
-def process_url(url):
-    """Process a single URL completely with optimized workflow"""
+@contextmanager
+def _stage(info, name, url):
+    """Trace a pipeline stage and record its duration in info["timings"] when the caller asked for details"""
+    start = time.time()
+    try:
+        with tracer.span(name, url=url) as span:
+            yield span
+    finally:
+        elapsed = time.time() - start
+        batch_report.record_stage(name, elapsed)
+        if info is not None:
+            info.setdefault("timings", {})[name] = elapsed
+
+def prepare_url(url, info=None):
+    """Scrape, extract and classify a URL
+
+    Returns (url, True, (website_text, category)) on success or
+    (url, False, message) on failure. An info dict, if given, receives the
+    stage timings, the page size and where the category came from.
+    """
     # Validate URL
     validated_url = validate_url(url)
     if not validated_url:
@@ -16,24 +45,54 @@ def process_url(url):
     
     try:
         # Scrape with optimized settings
-        html_content = scrape_website(validated_url)
+        with _stage(info, "fetch", validated_url) as span:
+            html_content = scrape_website(validated_url)
+            span["bytes"] = len(html_content) if html_content else 0
+            if html_content:
+                batch_report.record_fetch(span["bytes"])
         if not html_content:
             return validated_url, False, "Failed to scrape website"
         
         # Extract with length limits
-        website_text = extract_main_content(html_content)
+        with _stage(info, "extract", validated_url) as span:
+            website_text = extract_main_content(html_content)
+            span["chars"] = len(website_text)
         if not website_text:
             return validated_url, False, "Failed to extract content"
         
         # Classify content
-        category = detect_category(website_text, validated_url)
+        with _stage(info, "classify", validated_url) as span:
+            category, source = detect_category_with_source(website_text, validated_url)
+            span.update(category=category, source=source, cache_hit=source in ("cache", "domain"))
+            batch_report.record_category_source(source)
+        if info is not None:
+            info["html_bytes"] = len(html_content)
+            info["category_source"] = source
         print(f"URL: {validated_url} - Category: {category}")
         
+        return validated_url, True, (website_text, category)
+    except Exception as e:
+        return validated_url, False, f"Error: {str(e)}"
+
+def finish_url(validated_url, website_text, category, info=None):
+    """Analyze a classified URL and save the results
+
+    An info dict, if given, receives the stage timings and the analysis text.
+    """
+    try:
         # Analyze content
-        analysis_text = analyze_with_ollama(website_text, category, validated_url)
+        analyze_start = time.time()
+        with _stage(info, "analyze", validated_url) as span:
+            span["category"] = category
+            analysis_text = analyze_with_ollama(website_text, category, validated_url)
+        analyze_seconds = time.time() - analyze_start
+        if info is not None:
+            info["analysis"] = analysis_text
         
         # Save results - this will now save both TXT and update the CSV
-        success, result = save_analysis_to_file(analysis_text, category, validated_url)
+        with _stage(info, "save", validated_url):
+            success, result = save_analysis_to_file(analysis_text, category, validated_url,
+                                                    website_text, analyze_seconds)
         
         if success:
             return validated_url, True, result
@@ -42,49 +101,182 @@ def process_url(url):
     except Exception as e:
         return validated_url, False, f"Error: {str(e)}"
 
-def batch_process_urls(urls):
-    """Process multiple URLs with multithreading"""
-    from config import MAX_WORKERS
+def process_url(url):
+    """Process a single URL completely with optimized workflow"""
+    validated_url, success, outcome = prepare_url(url)
+    if not success:
+        return validated_url, success, outcome
+    
+    website_text, category = outcome
+    return finish_url(validated_url, website_text, category)
+
+class _BatchResults:
+    """Counts finished URLs and writes them to the batch results file as they come in"""
+
+    def __init__(self, collect):
+        self.writer = BatchResultsWriter()
+        self.results = [] if collect else None
+        self.count = 0
+        self.succeeded = 0
+
+    def add(self, result):
+        self.count += 1
+        self.succeeded += bool(result[1])
+        self.writer.write(result, pop_think_tokens(result[0]))
+        batch_report.record_result(result)
+        if self.results is not None:
+            self.results.append(result)
+
+def _record_result(result, results, pbar):
+    """Add a finished URL to the batch results and report it"""
+    results.add(result)
+    if result[1]:  # Success
+        tqdm.write(f"✅ {result[0]}")
+    else:
+        tqdm.write(f"❌ {result[0]}: {result[2]}")
+    pbar.update(1)
+
+def _future_result(future, url):
+    try:
+        return future.result()
+    except Exception as exc:
+        return url, False, str(exc)
+
+def _collect_results(future_to_url, results, pbar):
+    """Wait for submitted URLs and record them as they complete"""
+    for future in concurrent.futures.as_completed(future_to_url):
+        _record_result(_future_result(future, future_to_url[future]), results, pbar)
+
+def _process_streamed(executor, urls, results, pbar):
+    """Process URLs in completion order with at most SUBMIT_WINDOW of them in flight"""
+    pending = {}
+    for url in urls:
+        if len(pending) >= SUBMIT_WINDOW:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                _record_result(_future_result(future, pending.pop(future)), results, pbar)
+        pending[tracer.submit(executor, process_url, url, url=url)] = url
+    _collect_results(pending, results, pbar)
+
+def _process_grouped(executor, urls, results, pbar):
+    """Classify URLs ahead of their analyses and dispatch the analyses grouped by category
+
+    Analysis prompts of one category share a long byte-identical prefix, so
+    dispatching them back to back lets Ollama reuse its prompt KV cache. Up
+    to GROUPED_BATCH_SIZE URLs are in flight, and new ones are classified
+    while earlier ones are analyzed, so the pool never drains between
+    windows. A category's analyses are dispatched as soon as enough of them
+    are ready to fill the LLM concurrency limit, and all ready ones whenever
+    no classification is left to wait for.
+    """
+    urls = iter(urls)
+    pending = {}  # future -> (url, True for prepare_url / False for finish_url)
+    groups = {}   # category -> [(url, website_text, category)] waiting for analysis
+    classifying = 0
+    in_flight = 0
+    exhausted = False
+    while True:
+        while not exhausted and in_flight < GROUPED_BATCH_SIZE:
+            url = next(urls, None)
+            if url is None:
+                exhausted = True
+                break
+            pending[tracer.submit(executor, prepare_url, url, url=url)] = (url, True)
+            classifying += 1
+            in_flight += 1
+
+        # The pool runs tasks in submission order, so a group's analyses run together
+        group_size = max(2, int(llm_limiter.limit))
+        for category in list(groups):
+            if classifying == 0 or len(groups[category]) >= group_size:
+                for item in groups.pop(category):
+                    pending[tracer.submit(executor, finish_url, *item, url=item[0])] = (item[0], False)
+
+        if not pending:
+            return
+        done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+            url, prepared = pending.pop(future)
+            validated_url, success, outcome = _future_result(future, url)
+            if prepared:
+                classifying -= 1
+                if success:
+                    website_text, category = outcome
+                    groups.setdefault(category, []).append((validated_url, website_text, category))
+                    continue
+            in_flight -= 1
+            _record_result((validated_url, success, outcome), results, pbar)
+
+def batch_process_urls(urls, collect_results=True):
+    """Process multiple URLs with multithreading
+
+    urls can be any iterable, e.g. iter_urls_from_file(); it is consumed
+    lazily so only a bounded window of URLs is in memory at a time. Results
+    are written to batch_results.txt as they finish and, with collect_results,
+    also returned as a list.
+    """
     
     # Ensure folders exist
     create_folders()
     
-    results = []
-    processed_count = 0
+    # Load the model(s) before timing starts so cold-start latency stays out of the batch
+    warm_up()
+    
+    total = len(urls) if hasattr(urls, '__len__') else None
+    results = _BatchResults(collect_results)
     
-    print(f"Starting batch processing of {len(urls)} URLs...")
+    print(f"Starting batch processing of {total if total is not None else 'streamed'} URLs...")
     start_time = time.time()
+    reset_stats()
+    classify_batcher.reset_stats()
+    domain_cache.reset_stats()
+    cache_manager.reset_stats()
+    tracer.reset()
+    batch_report.start()
+    set_metrics_context(ordering="grouped" if GROUP_BY_CATEGORY else "completion")
     
-    # Process URLs concurrently with a thread pool
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_url = {executor.submit(process_url, url): url for url in urls}
-        
-        # Use tqdm for progress tracking
-        with tqdm(total=len(urls), desc="Processing websites") as pbar:
-            for future in concurrent.futures.as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    result = future.result()
-                    if result:
-                        results.append(result)
-                        if result[1]:  # Success
-                            processed_count += 1
-                            tqdm.write(f"✅ {result[0]}")
-                        else:
-                            tqdm.write(f"❌ {result[0]}: {result[2]}")
-                except Exception as exc:
-                    tqdm.write(f"❌ {url}: {exc}")
-                finally:
-                    pbar.update(1)
+    # Process URLs concurrently with a thread pool; a caller that already runs the CSV writer keeps it
+    owns_writer = start_csv_writer()
+    csv_failures = 0
+    cache_manager.start_janitor()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count()) as executor:
+            # Use tqdm for progress tracking
+            with tqdm(total=total, desc="Processing websites") as pbar:
+                if GROUP_BY_CATEGORY:
+                    _process_grouped(executor, urls, results, pbar)
+                else:
+                    _process_streamed(executor, urls, results, pbar)
+    finally:
+        batch_report.stop()
+        results.writer.close()
+        if owns_writer:
+            csv_failures = stop_csv_writer()
+        close_segment_store()
+        cache_manager.stop_janitor()
     
     # Save results summary
-    summary_file = save_batch_results(results)
+    domain_cache.save()
     
     elapsed = time.time() - start_time
-    print(f"\nProcessed {processed_count}/{len(urls)} URLs in {elapsed:.2f} seconds")
-    print(f"Results saved to: {summary_file}")
+    print(f"\nProcessed {results.succeeded}/{results.count} URLs in {elapsed:.2f} seconds")
+    print(f"Results saved to: {results.writer.path}")
+    if csv_failures:
+        print(f"Warning: {csv_failures} CSV rows could not be written (see the errors above)")
+    print_latency_summary()
+    print(llm_limiter.summary())
+    print(classify_batcher.summary())
+    print(domain_cache.summary())
+    print(cache_manager.summary())
+    if tracer.enabled:
+        print(f"Trace saved to: {tracer.export()} (open in https://ui.perfetto.dev)")
+    
+    report = batch_report.build()
+    text_path, json_path = write_report(report)
+    print(f"\n{format_report(report)}")
+    print(f"Report saved to: {text_path} and {json_path}")
     
-    return results
+    return results.results
 
 def process_single_url(url):
     """Process a single URL with streaming output"""
@@ -121,11 +313,15 @@ def process_single_url(url):
         print(f"\n✔ Detected Category: {category}")
         
         # Analyze website
+        analyze_start = time.time()
         analysis_text = analyze_with_ollama(website_text, category, validated_url)
+        analyze_seconds = time.time() - analyze_start
         
         # Save analysis - this will now save both TXT and update the CSV
-        success, file_path = save_analysis_to_file(analysis_text, category, validated_url)
+        success, file_path = save_analysis_to_file(analysis_text, category, validated_url,
+                                                   website_text, analyze_seconds)
         if success:
+            compact_csvs()
             print(f"\nAnalysis saved to: {file_path}")
             print(f"Analysis also added to {category}.csv")
         
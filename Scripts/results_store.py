@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Results store
+-------------
+Optional SQLite backend (RESULTS_DB_ENABLED) holding every analysis, its
+parsed answers and metadata, with an FTS5 index over the analysis text.
+
+    python results_store.py search "Basel III" --category Finance
+    python results_store.py show <url>
+    python results_store.py stats
+    python results_store.py import
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from config import RESULTS_DB_FILE, MODEL_NAME, BASE_SAVE_DIR
+from schema import SCHEMAS, get_schema
+from export_csv import parse_analysis, extract_analysis_text
+
+TABLES_SQL = """
+CREATE TABLE IF NOT EXISTS analyses (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    category TEXT NOT NULL,
+    model TEXT,
+    analysis TEXT NOT NULL,
+    content_hash TEXT,
+    content_chars INTEGER,
+    analyze_seconds REAL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS analyses_category ON analyses (category, created_at);
+CREATE INDEX IF NOT EXISTS analyses_content_hash ON analyses (content_hash);
+
+CREATE TABLE IF NOT EXISTS answers (
+    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    PRIMARY KEY (analysis_id, position)
+);
+CREATE INDEX IF NOT EXISTS answers_question ON answers (question);
+"""
+
+# External-content FTS5 table kept in sync with the analyses table by triggers
+FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5 (
+    url, category, analysis, content='analyses', content_rowid='id'
+);
+CREATE TRIGGER IF NOT EXISTS analyses_ai AFTER INSERT ON analyses BEGIN
+    INSERT INTO analyses_fts (rowid, url, category, analysis)
+    VALUES (new.id, new.url, new.category, new.analysis);
+END;
+CREATE TRIGGER IF NOT EXISTS analyses_ad AFTER DELETE ON analyses BEGIN
+    INSERT INTO analyses_fts (analyses_fts, rowid, url, category, analysis)
+    VALUES ('delete', old.id, old.url, old.category, old.analysis);
+END;
+CREATE TRIGGER IF NOT EXISTS analyses_au AFTER UPDATE ON analyses BEGIN
+    INSERT INTO analyses_fts (analyses_fts, rowid, url, category, analysis)
+    VALUES ('delete', old.id, old.url, old.category, old.analysis);
+    INSERT INTO analyses_fts (rowid, url, category, analysis)
+    VALUES (new.id, new.url, new.category, new.analysis);
+END;
+"""
+
+
+def content_hash(text):
+    """Return the SHA-256 of a page's extracted text"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultsStore:
+    """One SQLite database with all analyses, their answers and a full-text index
+
+    A single connection is shared by the worker threads and serialized with a
+    lock; WAL mode lets the query CLI read while a batch is writing. Saving a
+    URL again replaces its previous analysis.
+    """
+
+    def __init__(self, path=RESULTS_DB_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Work queue workers in other processes may hold the write lock briefly
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(TABLES_SQL)
+        self.fts = self._create_fts()
+
+    def _create_fts(self):
+        try:
+            self.conn.executescript(FTS_SQL)
+            return True
+        except sqlite3.OperationalError:
+            print("SQLite was built without FTS5; search falls back to substring matching")
+            return False
+
+    def save(self, url, category, analysis_text, website_text=None, model=MODEL_NAME,
+             analyze_seconds=None, created_at=None):
+        """Insert or replace the analysis of a URL together with its parsed answers"""
+        schema = get_schema(category)
+        values = schema.row(url, parse_analysis(analysis_text))[1:]
+        answers = list(zip(schema.questions, values))
+        digest = content_hash(website_text) if website_text else None
+        chars = len(website_text) if website_text else None
+        created_at = created_at or time.time()
+
+        with self._lock, self.conn:
+            self.conn.execute(
+                """INSERT INTO analyses (url, category, model, analysis, content_hash, content_chars,
+                                         analyze_seconds, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (url) DO UPDATE SET
+                       category = excluded.category, model = excluded.model,
+                       analysis = excluded.analysis, content_hash = excluded.content_hash,
+                       content_chars = excluded.content_chars,
+                       analyze_seconds = excluded.analyze_seconds, created_at = excluded.created_at""",
+                (url, category, model, analysis_text, digest, chars, analyze_seconds, created_at))
+            analysis_id = self.conn.execute("SELECT id FROM analyses WHERE url = ?", (url,)).fetchone()[0]
+            self.conn.execute("DELETE FROM answers WHERE analysis_id = ?", (analysis_id,))
+            self.conn.executemany(
+                "INSERT INTO answers (analysis_id, position, question, answer) VALUES (?, ?, ?, ?)",
+                [(analysis_id, position, question, answer)
+                 for position, (question, answer) in enumerate(answers, 1)])
+
+    def search(self, query, category=None, limit=20):
+        """Return (url, category, snippet) rows for analyses matching a full-text query"""
+        with self._lock:
+            if self.fts:
+                sql = """SELECT a.url, a.category,
+                                snippet(analyses_fts, 2, '[', ']', '...', 12) AS snippet
+                         FROM analyses_fts JOIN analyses a ON a.id = analyses_fts.rowid
+                         WHERE analyses_fts MATCH ?"""
+                params = [query]
+            else:
+                sql = """SELECT url, category, substr(analysis, 1, 120) AS snippet
+                         FROM analyses a WHERE analysis LIKE ?"""
+                params = [f"%{query}%"]
+            if category:
+                sql += " AND a.category = ?"
+                params.append(category)
+            sql += " ORDER BY rank LIMIT ?" if self.fts else " ORDER BY created_at DESC LIMIT ?"
+            params.append(limit)
+            return [tuple(row) for row in self.conn.execute(sql, params)]
+
+    def get(self, url):
+        """Return the stored analysis of a URL with its answers, or None"""
+        with self._lock:
+            row = self.conn.execute("SELECT * FROM analyses WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            result = dict(row)
+            result["answers"] = [tuple(answer) for answer in self.conn.execute(
+                "SELECT question, answer FROM answers WHERE analysis_id = ? ORDER BY position", (row["id"],))]
+            return result
+
+    def category_counts(self):
+        """Return {category: stored analyses}"""
+        with self._lock:
+            return dict(self.conn.execute(
+                "SELECT category, COUNT(*) FROM analyses GROUP BY category ORDER BY category").fetchall())
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_results_store():
+    """Return the shared results store, opening the database on first use"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultsStore()
+        return _store
+
+
+def import_txt_results(store):
+    """Load the existing TXT analyses from the category folders into the store"""
+    imported = 0
+    for category in SCHEMAS:
+        category_dir = os.path.join(BASE_SAVE_DIR, category)
+        if not os.path.isdir(category_dir):
+            continue
+        for entry in os.scandir(category_dir):
+            if not entry.name.endswith(".txt"):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                url = content.split("URL:")[1].split("\n")[0].strip() if "URL:" in content else entry.path
+                store.save(url, category, extract_analysis_text(content), model=None,
+                           created_at=entry.stat().st_mtime)
+                imported += 1
+            except Exception as e:
+                print(f"Error importing {entry.path}: {e}")
+    return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the SQLite results store")
+    parser.add_argument("--db", default=RESULTS_DB_FILE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    search = subparsers.add_parser("search", help="Full-text search over all analyses")
+    search.add_argument("query", help='FTS5 query, e.g. "Basel III" or \'basel AND "capital ratio"\'')
+    search.add_argument("--category")
+    search.add_argument("-n", "--limit", type=int, default=20)
+    show = subparsers.add_parser("show", help="Show the stored analysis of a URL")
+    show.add_argument("url")
+    subparsers.add_parser("stats", help="Show stored analyses per category")
+    subparsers.add_parser("import", help="Load the existing TXT analyses into the store")
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+
+    if args.command == "search":
+        start = time.perf_counter()
+        try:
+            rows = store.search(args.query, args.category, args.limit)
+        except sqlite3.OperationalError as e:
+            print(f"Invalid query: {e}")
+            return 1
+        elapsed = (time.perf_counter() - start) * 1000
+        for url, category, snippet in rows:
+            print(f"{category:<14} {url}\n    {' '.join(snippet.split())}")
+        print(f"{len(rows)} results in {elapsed:.1f} ms")
+
+    elif args.command == "show":
+        result = store.get(args.url)
+        if result is None:
+            print(f"URL not in the store: {args.url}")
+            return 1
+        print(f"URL: {result['url']}\nCategory: {result['category']}\nModel: {result['model']}")
+        for question, answer in result["answers"]:
+            print(f"\n{question}:\n  {answer or '-'}")
+
+    elif args.command == "stats":
+        counts = store.category_counts()
+        print(f"{sum(counts.values())} analyses in {args.db}")
+        for category, count in counts.items():
+            print(f"  {category}: {count}")
+
+    elif args.command == "import":
+        start = time.time()
+        imported = import_txt_results(store)
+        print(f"Imported {imported} analyses in {time.time() - start:.1f} seconds")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,57 @@
+from config import CATEGORIES
+
+MATCH_CACHE_SIZE = 4096  # Distinct answer labels remembered per category
+
+
+class CategorySchema:
+    """Questions of one category, parsed once from config.CATEGORIES
+
+    Holds the ordered question list, their lowercased keys, the CSV header and
+    an index from answer labels (as the model wrote them) to the question
+    columns they fill, so building a CSV row needs no string splitting and
+    each label is compared with the questions only the first time it is seen.
+    """
+
+    def __init__(self, name, points):
+        self.name = name
+        self.points = points  # The question block exactly as configured, used in the prompt
+        questions = []
+        for line in points.strip().split('\n'):
+            line = line.strip()
+            if line and ". " in line:
+                questions.append(line.split(". ", 1)[1].strip())
+        self.questions = tuple(questions)
+        self.keys = tuple(question.lower() for question in questions)
+        self.header = ("URL",) + self.questions
+        self._columns = {}
+
+    def columns_for(self, label):
+        """Return the question positions an answer label matches (substring either way)"""
+        columns = self._columns.get(label)
+        if columns is None:
+            key = label.lower()
+            columns = tuple(i for i, question in enumerate(self.keys) if question in key or key in question)
+            if len(self._columns) >= MATCH_CACHE_SIZE:
+                self._columns.clear()
+            self._columns[label] = columns
+        return columns
+
+    def row(self, url, parsed_analysis):
+        """Build the CSV row for a parsed analysis; each question takes the first matching answer"""
+        values = [None] * len(self.questions)
+        for label, answer in parsed_analysis.items():
+            for column in self.columns_for(label):
+                if values[column] is None:
+                    values[column] = answer
+        return [url] + [value if value is not None else "" for value in values]
+
+
+SCHEMAS = {name: CategorySchema(name, points) for name, points in CATEGORIES.items()}
+CATEGORY_NAMES = tuple(SCHEMAS)
+CATEGORY_LIST = ", ".join(CATEGORY_NAMES)  # As listed in the classification prompts
+CATEGORY_KEYS = tuple((name.lower(), name) for name in CATEGORY_NAMES)
+
+
+def get_schema(category):
+    """Return the schema of a category, falling back to Default"""
+    return SCHEMAS.get(category) or SCHEMAS['Default']
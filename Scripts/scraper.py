@@ -1,20 +1,32 @@
 import requests
 import time
+import threading
 from bs4 import BeautifulSoup
 from config import MAX_TEXT_LENGTH
 
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml',
+    'Accept-Encoding': 'gzip, deflate',
+    'Connection': 'keep-alive'
+}
+
+_local = threading.local()
+
+def get_session():
+    """Return this thread's requests session, so connections to a site are kept alive across URLs"""
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        _local.session = session
+    return session
+
 def scrape_website(url, timeout=10, max_retries=2):
     """Scrape website with retry logic and timeout"""
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml',
-        'Accept-Encoding': 'gzip, deflate',
-        'Connection': 'keep-alive'
-    }
-    
     for attempt in range(max_retries + 1):
         try:
-            response = requests.get(url, headers=headers, timeout=timeout)
+            response = get_session().get(url, timeout=timeout)
             response.raise_for_status()
             return response.text
         except requests.RequestException as e:
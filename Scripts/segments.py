@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Segment storage
+---------------
+Optional storage for analyses (STORAGE_MODE = "segments"): instead of one TXT
+file per URL, analyses are appended to compressed, rotating segment files
+with an offset index keyed by URL hash.
+
+    python segments.py get <url>
+    python segments.py extract <directory> [--category News]
+    python segments.py stats
+    python segments.py rebuild
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import struct
+import hashlib
+import argparse
+import threading
+from config import SEGMENT_DIR, SEGMENT_MAX_BYTES
+
+RECORD_HEADER = struct.Struct("<I")           # compressed record length
+INDEX_ENTRY = struct.Struct("<16sIQI")        # url hash, segment number, offset, length
+
+
+def url_key(url):
+    """Return the 16-byte hash a URL is indexed by"""
+    return hashlib.blake2b(url.encode('utf-8'), digest_size=16).digest()
+
+
+def _segment_name(number):
+    return f"seg-{number:06d}.dat"
+
+
+class SegmentStore:
+    """Append-only segment files with an offset index
+
+    Each record is a length-prefixed, zlib-compressed JSON object (url,
+    category, analysis, saved_at). A segment is closed once it passes
+    SEGMENT_MAX_BYTES and the next one is started. index.bin holds one
+    fixed-size entry per record; it is read into a dict at startup, where the
+    latest entry of a URL wins. Entries are written after their record, so
+    the index never points at missing data, and rebuild() recreates it from
+    the segments.
+    """
+
+    def __init__(self, directory=SEGMENT_DIR, max_bytes=SEGMENT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.bin")
+        self.index = {}
+        self._lock = threading.Lock()
+        self._segment = None
+        self._segment_number = 0
+        self._index_file = None
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def segment_numbers(self):
+        """Return the numbers of the existing segments in order"""
+        numbers = []
+        for name in os.listdir(self.directory):
+            if name.startswith("seg-") and name.endswith(".dat"):
+                numbers.append(int(name[4:-4]))
+        return sorted(numbers)
+
+    def segment_path(self, number):
+        return os.path.join(self.directory, _segment_name(number))
+
+    def _load_index(self):
+        numbers = self.segment_numbers()
+        self._segment_number = numbers[-1] if numbers else 1
+        if not os.path.exists(self.index_path):
+            if numbers:
+                self.rebuild()
+            return
+        sizes = {number: os.path.getsize(self.segment_path(number)) for number in numbers}
+        with open(self.index_path, 'rb') as f:
+            data = f.read()
+        # A torn last entry or one pointing past its segment's end is from an interrupted write
+        for position in range(0, len(data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size):
+            key, number, offset, length = INDEX_ENTRY.unpack_from(data, position)
+            if offset + length <= sizes.get(number, 0):
+                self.index[key] = (number, offset, length)
+
+    def _recover_tail(self, number):
+        """Index complete records written after the last index entry and cut off a torn one"""
+        path = self.segment_path(number)
+        if not os.path.exists(path):
+            return
+        end = max((offset + length for n, offset, length in self.index.values() if n == number), default=0)
+        with open(path, 'r+b') as f:
+            f.seek(end)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                (length,) = RECORD_HEADER.unpack(header)
+                data = f.read(length)
+                try:
+                    record = json.loads(zlib.decompress(data))
+                except Exception:
+                    break
+                key = url_key(record["url"])
+                self._index_file.write(INDEX_ENTRY.pack(key, number, end, RECORD_HEADER.size + length))
+                self.index[key] = (number, end, RECORD_HEADER.size + length)
+                end += RECORD_HEADER.size + length
+            f.truncate(end)
+
+    def _open_for_append(self):
+        """Return the current segment file, rotating it when it is full"""
+        if self._segment is None:
+            self._index_file = open(self.index_path, 'ab')
+            self._recover_tail(self._segment_number)
+            self._segment = open(self.segment_path(self._segment_number), 'ab')
+        elif self._segment.tell() >= self.max_bytes:
+            self._segment.close()
+            self._segment_number += 1
+            self._segment = open(self.segment_path(self._segment_number), 'ab')
+        return self._segment
+
+    def append(self, url, category, analysis_text):
+        """Store an analysis and return its location as "segment:offset" """
+        record = {"url": url, "category": category, "analysis": analysis_text, "saved_at": time.time()}
+        blob = zlib.compress(json.dumps(record).encode('utf-8'))
+        with self._lock:
+            segment = self._open_for_append()
+            offset = segment.tell()
+            segment.write(RECORD_HEADER.pack(len(blob)) + blob)
+            segment.flush()
+            length = RECORD_HEADER.size + len(blob)
+            key = url_key(url)
+            self._index_file.write(INDEX_ENTRY.pack(key, self._segment_number, offset, length))
+            self._index_file.flush()
+            self.index[key] = (self._segment_number, offset, length)
+            return f"{_segment_name(self._segment_number)}:{offset}"
+
+    def get(self, url):
+        """Return the latest stored record of a URL, or None"""
+        with self._lock:
+            location = self.index.get(url_key(url))
+            if self._segment is not None:
+                self._segment.flush()
+        if location is None:
+            return None
+        number, offset, length = location
+        with open(self.segment_path(number), 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        return json.loads(zlib.decompress(data[RECORD_HEADER.size:]))
+
+    def iter_records(self, start=None, latest_only=True, progress=None):
+        """Stream records in storage order
+
+        start optionally maps segment numbers to the byte offset to resume
+        from, and progress (a dict) is kept up to date with the offset read up
+        to in each segment. With latest_only, records superseded by a later
+        save of the same URL are skipped. Yields (segment number, end offset,
+        record).
+        """
+        start = start or {}
+        progress = {} if progress is None else progress
+        with self._lock:
+            if self._segment is not None:
+                self._segment.flush()
+            index = dict(self.index)
+        for number in self.segment_numbers():
+            with open(self.segment_path(number), 'rb') as f:
+                offset = start.get(number, 0)
+                progress[number] = offset
+                f.seek(offset)
+                while True:
+                    header = f.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        break
+                    (length,) = RECORD_HEADER.unpack(header)
+                    data = f.read(length)
+                    if len(data) < length:
+                        break  # Torn record at the end of the segment
+                    record = json.loads(zlib.decompress(data))
+                    location = (number, offset, RECORD_HEADER.size + length)
+                    offset += RECORD_HEADER.size + length
+                    progress[number] = offset
+                    if latest_only and index.get(url_key(record["url"])) != location:
+                        continue
+                    yield number, offset, record
+
+    def rebuild(self):
+        """Recreate the index from the segments"""
+        with self._lock:
+            if self._index_file is not None:
+                self._index_file.close()
+                self._index_file = None
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            self.index = {}
+        entries = []
+        for number, end, record in self.iter_records(latest_only=False):
+            entries.append((url_key(record["url"]), number, end))
+        with self._lock:
+            previous_end = {}
+            temp_path = self.index_path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                for key, number, end in entries:
+                    offset = previous_end.get(number, 0)
+                    previous_end[number] = end
+                    f.write(INDEX_ENTRY.pack(key, number, offset, end - offset))
+                    self.index[key] = (number, offset, end - offset)
+            os.replace(temp_path, self.index_path)
+        return len(entries)
+
+    def close(self):
+        with self._lock:
+            for handle in (self._segment, self._index_file):
+                if handle is not None:
+                    handle.flush()
+                    os.fsync(handle.fileno())
+                    handle.close()
+            self._segment = None
+            self._index_file = None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_segment_store():
+    """Return the shared segment store"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SegmentStore()
+        return _store
+
+
+def close_segment_store():
+    """Flush and fsync the shared segment store if it was used"""
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+
+
+def format_analysis(record):
+    """Render a record the way save_analysis_to_file writes TXT files"""
+    return f"URL: {record['url']}\n\nANALYSIS:\n{record['analysis']}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Read analyses from the segment storage")
+    parser.add_argument("--dir", default=SEGMENT_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    get = subparsers.add_parser("get", help="Print the stored analysis of a URL")
+    get.add_argument("url")
+    extract = subparsers.add_parser("extract", help="Write the current analyses out as TXT files")
+    extract.add_argument("directory")
+    extract.add_argument("--category")
+    subparsers.add_parser("stats", help="Show segment and record counts")
+    subparsers.add_parser("rebuild", help="Recreate the offset index from the segments")
+    args = parser.parse_args()
+
+    store = SegmentStore(args.dir)
+
+    if args.command == "get":
+        record = store.get(args.url)
+        if record is None:
+            print(f"URL not in the segments: {args.url}")
+            return 1
+        print(f"Category: {record['category']}\n{format_analysis(record)}")
+
+    elif args.command == "extract":
+        count = 0
+        for _, _, record in store.iter_records():
+            if args.category and record["category"] != args.category:
+                continue
+            category_dir = os.path.join(args.directory, record["category"])
+            os.makedirs(category_dir, exist_ok=True)
+            # Hash-based names can't collide the way truncated URLs do
+            path = os.path.join(category_dir, f"{url_key(record['url']).hex()}.txt")
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(format_analysis(record))
+            count += 1
+        print(f"Extracted {count} analyses to {args.directory}")
+
+    elif args.command == "stats":
+        numbers = store.segment_numbers()
+        size = sum(os.path.getsize(store.segment_path(number)) for number in numbers)
+        print(f"{len(numbers)} segments, {size / 1e6:.1f} MB, {len(store.index)} URLs")
+
+    elif args.command == "rebuild":
+        print(f"Indexed {store.rebuild()} records")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from config import TRACE_ENABLED, TRACE_DIR, TRACE_MAX_EVENTS
+
+
+class Tracer:
+    """Spans of the pipeline stages of each URL in Chrome trace event format
+
+    Every span is a complete ("X") event on the thread that ran it, with the
+    URL and annotations such as the category source in its args. export()
+    writes a JSON file that Perfetto or chrome://tracing shows as a timeline
+    per worker thread, so queueing and stalls are visible directly. When
+    tracing is off, span() only yields its args and record() returns at once.
+    """
+
+    def __init__(self, enabled=TRACE_ENABLED, max_events=TRACE_MAX_EVENTS):
+        self.enabled = enabled
+        self.max_events = max_events
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Drop the recorded spans and restart the clock"""
+        with self._lock:
+            self.events = []
+            self.dropped = 0
+            self._threads = {}
+            self._origin = time.perf_counter()
+
+    def record(self, name, start, end, cat="stage", **args):
+        """Record a span between two time.perf_counter() values on the current thread"""
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        event = {"name": name, "cat": cat, "ph": "X", "pid": self.pid, "tid": thread.ident,
+                 "ts": round((start - self._origin) * 1e6, 1), "dur": round((end - start) * 1e6, 1),
+                 "args": args}
+        with self._lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            self.events.append(event)
+            self._threads.setdefault(thread.ident, thread.name)
+
+    @contextmanager
+    def span(self, name, cat="stage", **args):
+        """Trace the enclosed block; annotations added to the yielded dict end up in the span's args"""
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self.record(name, start, time.perf_counter(), cat, **args)
+
+    def submit(self, executor, function, *args, url=None):
+        """executor.submit() that also traces how long the task waited for a worker thread"""
+        if not self.enabled:
+            return executor.submit(function, *args)
+        submitted = time.perf_counter()
+
+        def run():
+            self.record("queued", submitted, time.perf_counter(), "queue", url=url)
+            return function(*args)
+
+        return executor.submit(run)
+
+    def export(self, path=None):
+        """Write the spans as Chrome trace JSON and return the file path"""
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self._threads)
+            dropped = self.dropped
+        metadata = [{"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": "Website Analyzer"}}]
+        metadata += [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                     for tid, name in threads.items()]
+        if path is None:
+            now = time.time()
+            name = f"trace-{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}-{int(now * 1000) % 1000:03d}-{self.pid}.json"
+            path = os.path.join(TRACE_DIR, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": metadata + events, "displayTimeUnit": "ms",
+                       "otherData": {"dropped_events": dropped}}, f)
+        return path
+
+
+tracer = Tracer()
@@ -1,6 +1,11 @@
 import os
+import gzip
 import time
+import hashlib
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
 from config import CACHE_DIR, CACHE_EXPIRY_DAYS
+from schema import CATEGORY_KEYS
 
 def check_dependencies():
     """Check if all required libraries are installed"""
@@ -51,7 +56,11 @@ def sanitize_filename(filename):
     return filename
 
 def get_filename_from_url(url):
-    """Generate a valid filename from a URL"""
+    """Generate a valid filename from a URL
+
+    Different URLs can map to the same name; cache files use cache_path()
+    and only fall back to this for entries written by earlier versions.
+    """
     clean_url = url.replace('https://', '').replace('http://', '').replace('www.', '')
     
     if clean_url.endswith('/'):
@@ -65,6 +74,28 @@ def get_filename_from_url(url):
         
     return f"{clean_url}.txt"
 
+def canonical_url(url):
+    """Normalize a URL for use as a cache key
+
+    Lowercases the scheme and host, drops default ports and the fragment and
+    gives an empty path a "/". The path and query are kept as they are.
+    """
+    parsed = urlsplit(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").rstrip(".")
+    port = parsed.port
+    netloc = host if port is None or (scheme, port) in (("http", 80), ("https", 443)) else f"{host}:{port}"
+    return urlunsplit((scheme, netloc, parsed.path or "/", parsed.query, ""))
+
+def cache_key(url):
+    """Return the hex hash of a URL's canonical form"""
+    return hashlib.blake2b(canonical_url(url).encode('utf-8'), digest_size=16).hexdigest()
+
+def cache_path(url, suffix):
+    """Return the cache file of a URL in a two-level sharded layout (CACHE_DIR/ab/cd/<key><suffix>)"""
+    key = cache_key(url)
+    return os.path.join(CACHE_DIR, key[:2], key[2:4], f"{key}{suffix}")
+
 def is_cache_expired(file_path):
     """Check if a cache file is expired based on its modification time"""
     if not os.path.exists(file_path):
@@ -80,21 +111,87 @@ def is_cache_expired(file_path):
     
     return False
 
+def _is_gzip(filename):
+    """Check for a gzip file by extension or magic number"""
+    if filename.endswith('.gz'):
+        return True
+    with open(filename, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+def _decode_line(raw):
+    """Decode one input line, falling back per line instead of per file"""
+    # latin1 accepts any byte, so it has to come last
+    for encoding in ['utf-8', 'windows-1252', 'latin1']:
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+
+def iter_urls_from_file(filename):
+    """Yield the valid URLs of a (optionally gzip-compressed) file one line at a time"""
+    invalid = 0
+    try:
+        opener = gzip.open if _is_gzip(filename) else open
+        with opener(filename, 'rb') as f:
+            for raw in f:
+                line = _decode_line(raw)
+                url = line.strip()
+                if not url or line.startswith('#'):
+                    continue
+                if validate_url(url):
+                    yield url
+                else:
+                    invalid += 1
+    except Exception as e:
+        print(f"Error reading {filename}: {e}")
+    if invalid:
+        print(f"Warning: {invalid} invalid URLs were skipped.")
+
 def read_urls_from_file(filename):
     """Read URLs from a file with fallback encoding"""
-    for encoding in ['utf-8', 'latin1', 'windows-1252']:
+    return list(iter_urls_from_file(filename))
+
+@contextmanager
+def file_lock(path):
+    """Hold an exclusive lock on a lock file, across processes and machines sharing the volume"""
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            while True:
+                try:
+                    # LK_LOCK gives up after 10 one-second attempts
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
         try:
-            with open(filename, 'r', encoding=encoding) as f:
-                urls = [line.strip() for line in f if line.strip() and not line.startswith('#')]
-                # Filter out invalid URLs
-                valid_urls = [url for url in urls if validate_url(url)]
-                if len(valid_urls) < len(urls):
-                    print(f"Warning: {len(urls) - len(valid_urls)} invalid URLs were skipped.")
-                return valid_urls
-        except UnicodeDecodeError:
-            print(f"Encoding {encoding} failed, trying next...")
-        except Exception as e:
-            print(f"Error reading file with encoding {encoding}: {e}")
-            break
-    print("Failed to read file with known encodings.")
-    return []
\ No newline at end of file
+            yield
+        finally:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def percentile(values, pct):
+    """Return the pct-th percentile of a list of numbers (linear interpolation)"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def match_category(reply):
+    """Return the first category named in a model reply, or None"""
+    reply = reply.lower()
+    for key, category in CATEGORY_KEYS:
+        if key in reply:
+            return category
+    return None
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Work queue
+----------
+Runs a batch with several worker processes, on one machine or on several
+machines that share BASE_SAVE_DIR. URLs are enqueued once; each worker
+claims a few at a time under a lease, renews the lease while it works and
+records the outcome. URLs of a worker that dies are handed to another one
+when their lease expires.
+
+    python work_queue.py enqueue urls.txt
+    python work_queue.py worker [--exit-when-done] [--ollama-host http://gpu2:11434]
+    python work_queue.py local 4 urls.txt
+    python work_queue.py status
+    python work_queue.py results
+    python work_queue.py requeue-failed
+"""
+
+import os
+import sys
+import time
+import socket
+import sqlite3
+import argparse
+import itertools
+import threading
+import subprocess
+import concurrent.futures
+from config import (WORK_QUEUE_DB, WORK_QUEUE_LEASE_SECONDS, WORK_QUEUE_HEARTBEAT, WORK_QUEUE_CLAIM_SIZE,
+                    WORK_QUEUE_MAX_ATTEMPTS, SUBMIT_WINDOW, STORAGE_MODE, CATEGORIZER, RESULTS_DB_ENABLED)
+
+JOBS_SQL = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL UNIQUE,
+    state TEXT NOT NULL DEFAULT 'pending',  -- pending, leased, done or failed
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    think_tokens INTEGER,
+    updated_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+"""
+
+
+class WorkQueue:
+    """URL jobs with leases in a SQLite database
+
+    The database uses the default rollback journal rather than WAL, since
+    WAL only works for processes on the same machine. Claims run in a
+    BEGIN IMMEDIATE transaction, so two workers never lease the same URL;
+    a worker can only complete a URL while it still holds its lease.
+    """
+
+    def __init__(self, path=WORK_QUEUE_DB, lease_seconds=WORK_QUEUE_LEASE_SECONDS,
+                 max_attempts=WORK_QUEUE_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.executescript(JOBS_SQL)
+
+    def _transaction(self, statements):
+        """Run statements(conn) in one write transaction and return its result"""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, urls, batch_size=1000):
+        """Add URLs that aren't queued yet and return how many were added"""
+        added = 0
+        urls = iter(urls)
+        while True:
+            batch = list(itertools.islice(urls, batch_size))
+            if not batch:
+                return added
+            now = time.time()
+            added += self._transaction(lambda conn: conn.executemany(
+                "INSERT OR IGNORE INTO jobs (url, updated_at) VALUES (?, ?)",
+                [(url, now) for url in batch]).rowcount)
+
+    def claim(self, worker, count):
+        """Lease up to count pending (or abandoned) URLs to a worker; returns [(job id, url)]"""
+        def statements(conn):
+            now = time.time()
+            # URLs whose lease keeps expiring are probably taking their workers down
+            conn.execute("""UPDATE jobs SET state = 'failed', result = 'Lease expired', updated_at = ?
+                            WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                         (now, now, self.max_attempts))
+            jobs = conn.execute("""SELECT id, url FROM jobs
+                                   WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                                   ORDER BY id LIMIT ?""", (now, count)).fetchall()
+            conn.executemany("""UPDATE jobs SET state = 'leased', worker = ?, lease_expires = ?,
+                                    attempts = attempts + 1, updated_at = ?
+                                WHERE id = ?""",
+                             [(worker, now + self.lease_seconds, now, job_id) for job_id, _ in jobs])
+            return jobs
+        return self._transaction(statements)
+
+    def heartbeat(self, worker):
+        """Renew the leases of a worker's URLs; returns how many it still holds"""
+        now = time.time()
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET lease_expires = ? WHERE worker = ? AND state = 'leased'",
+            (now + self.lease_seconds, worker)).rowcount)
+
+    def complete(self, worker, job_id, success, result, think_tokens=0):
+        """Record the outcome of a leased URL
+
+        Failed URLs go back to pending until they have used up their
+        attempts. Returns False if the worker had lost the lease, in which
+        case the outcome is not recorded.
+        """
+        now = time.time()
+        return self._transaction(lambda conn: conn.execute(
+            """UPDATE jobs SET state = CASE WHEN ? THEN 'done' WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                   lease_expires = NULL, result = ?, think_tokens = ?, updated_at = ?
+               WHERE id = ? AND worker = ? AND state = 'leased'""",
+            (bool(success), self.max_attempts, result, think_tokens, now, job_id, worker)).rowcount == 1)
+
+    def release(self, worker):
+        """Hand a worker's unfinished URLs back without counting the attempt"""
+        return self._transaction(lambda conn: conn.execute(
+            """UPDATE jobs SET state = 'pending', worker = NULL, lease_expires = NULL,
+                   attempts = attempts - 1, updated_at = ?
+               WHERE worker = ? AND state = 'leased'""", (time.time(), worker)).rowcount)
+
+    def requeue_failed(self):
+        """Give failed URLs a fresh set of attempts"""
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET state = 'pending', attempts = 0, updated_at = ? WHERE state = 'failed'",
+            (time.time(),)).rowcount)
+
+    def stats(self):
+        """Return {state: URLs} and {worker: leased URLs}"""
+        with self._lock:
+            states = dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+            workers = dict(self.conn.execute(
+                "SELECT worker, COUNT(*) FROM jobs WHERE state = 'leased' GROUP BY worker").fetchall())
+        return states, workers
+
+    def finished(self):
+        """Return True when no URL is pending or leased"""
+        states, _ = self.stats()
+        return not states.get('pending') and not states.get('leased')
+
+    def results(self):
+        """Yield (url, success, result, think tokens) of the finished URLs in queue order"""
+        with self._lock:
+            rows = self.conn.execute("""SELECT url, state, result, think_tokens FROM jobs
+                                        WHERE state IN ('done', 'failed') ORDER BY id""").fetchall()
+        for url, state, result, think_tokens in rows:
+            yield url, state == 'done', result, think_tokens or 0
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def _heartbeat(queue, worker, stop):
+    while not stop.wait(WORK_QUEUE_HEARTBEAT):
+        try:
+            queue.heartbeat(worker)
+        except Exception as e:
+            print(f"Error renewing leases: {e}")
+
+
+def run_worker(worker=None, exit_when_done=False, path=WORK_QUEUE_DB, poll_interval=5.0):
+    """Process URLs from the queue until it is drained (or forever) and return the URLs processed"""
+    from tqdm import tqdm
+    from processor import process_url, _future_result
+    from file_handler import create_folders
+    from export_csv import enable_process_lock, start_csv_writer, stop_csv_writer
+    from llm import warm_up, reset_stats, pop_think_tokens, print_latency_summary
+    from concurrency import worker_count
+    from cache_manager import cache_manager
+    from domain_cache import domain_cache
+    from tracing import tracer
+
+    if STORAGE_MODE == "segments":
+        print("The segment storage has a single writer; run workers with STORAGE_MODE = \"txt\"")
+        return 0
+    if CATEGORIZER == "embedding":
+        print("The embedding store keeps its row count in one process; run workers with CATEGORIZER = \"chat\"")
+        return 0
+    if RESULTS_DB_ENABLED:
+        print("The results store uses SQLite in WAL mode, which doesn't work across machines; "
+              "run workers with RESULTS_DB_ENABLED = False")
+        return 0
+
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    queue = WorkQueue(path)
+    enable_process_lock()
+    create_folders()
+    warm_up()
+    reset_stats()
+    tracer.reset()
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(queue, worker, stop), daemon=True)
+    heartbeat.start()
+    start_csv_writer()
+    cache_manager.start_janitor()
+
+    print(f"Worker {worker} processing {path}")
+    start_time = time.time()
+    processed = succeeded = 0
+    pending = {}  # future -> (job id, url)
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=worker_count())
+    try:
+        with tqdm(desc=f"Worker {worker}") as pbar:
+            while True:
+                # Keep up to SUBMIT_WINDOW URLs leased and in flight
+                wanted = min(SUBMIT_WINDOW - len(pending), WORK_QUEUE_CLAIM_SIZE)
+                drained = True
+                if wanted > 0:
+                    jobs = queue.claim(worker, wanted)
+                    drained = len(jobs) < wanted
+                    for job_id, url in jobs:
+                        pending[tracer.submit(executor, process_url, url, url=url)] = (job_id, url)
+
+                if not pending:
+                    if exit_when_done and queue.finished():
+                        break
+                    time.sleep(poll_interval)
+                    continue
+
+                if drained:
+                    timeout = poll_interval  # Check the queue again later
+                elif len(pending) < SUBMIT_WINDOW:
+                    timeout = 0  # Claim more right away
+                else:
+                    timeout = None
+                done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job_id, url = pending.pop(future)
+                    result = _future_result(future, url)
+                    if not queue.complete(worker, job_id, result[1], str(result[2]), pop_think_tokens(result[0])):
+                        tqdm.write(f"Lease of {url} was lost; its result was not recorded")
+                    processed += 1
+                    succeeded += bool(result[1])
+                    if result[1]:
+                        tqdm.write(f"✅ {result[0]}")
+                    else:
+                        tqdm.write(f"❌ {result[0]}: {result[2]}")
+                    pbar.update(1)
+    except KeyboardInterrupt:
+        print("\nStopping worker...")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        stop.set()
+        released = queue.release(worker)
+        if released:
+            print(f"Released {released} unfinished URLs")
+        queue.close()
+        stop_csv_writer()
+        cache_manager.stop_janitor()
+        domain_cache.save()
+
+    print(f"\nWorker {worker} processed {succeeded}/{processed} URLs in {time.time() - start_time:.2f} seconds")
+    print_latency_summary()
+    if tracer.enabled:
+        print(f"Trace saved to: {tracer.export()}")
+    return processed
+
+
+def write_results(queue):
+    """Write the merged batch results of all workers and compact the category CSVs"""
+    from file_handler import save_batch_results
+    from export_csv import compact_csvs
+
+    results = list(queue.results())
+    think_tokens = {url: tokens for url, _, _, tokens in results}
+    path = save_batch_results([result[:3] for result in results], think_tokens)
+    compact_csvs()
+    return path, len(results)
+
+
+def print_status(queue):
+    states, workers = queue.stats()
+    total = sum(states.values())
+    print(f"{total} URLs: " + ", ".join(f"{states.get(state, 0)} {state}"
+                                         for state in ("pending", "leased", "done", "failed")))
+    for worker, leased in sorted(workers.items()):
+        print(f"  {worker}: {leased} leased")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a batch with several worker processes or machines")
+    parser.add_argument("--db", default=WORK_QUEUE_DB)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    enqueue = subparsers.add_parser("enqueue", help="Add the URLs of a file (.txt or .gz) to the queue")
+    enqueue.add_argument("file")
+    worker = subparsers.add_parser("worker", help="Process URLs from the queue")
+    worker.add_argument("--id", help="Worker name (default: hostname-pid)")
+    worker.add_argument("--exit-when-done", action="store_true", help="Exit once no URL is pending or leased")
+    worker.add_argument("--ollama-host", action="append",
+                        help="Ollama backend for this worker, repeatable (default: OLLAMA_HOSTS)")
+    local = subparsers.add_parser("local", help="Enqueue a file and process it with N local workers")
+    local.add_argument("workers", type=int)
+    local.add_argument("file")
+    subparsers.add_parser("status", help="Show URLs per state and leases per worker")
+    subparsers.add_parser("results", help="Write the merged batch results and compact the CSVs")
+    subparsers.add_parser("requeue-failed", help="Put failed URLs back in the queue")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        if args.ollama_host:
+            import llm
+            llm.OLLAMA_HOSTS[:] = args.ollama_host
+        run_worker(args.id, args.exit_when_done, args.db)
+        return 0
+
+    queue = WorkQueue(args.db)
+
+    if args.command in ("enqueue", "local"):
+        from utils import iter_urls_from_file
+        if not os.path.exists(args.file):
+            print(f"Error: File not found: {args.file}")
+            return 1
+        added = queue.enqueue(iter_urls_from_file(args.file))
+        print(f"Enqueued {added} new URLs")
+
+    if args.command == "local":
+        start_time = time.time()
+        host = socket.gethostname()
+        processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--db", args.db, "worker",
+                                       "--exit-when-done", "--id", f"{host}-local{number}"])
+                     for number in range(1, args.workers + 1)]
+        try:
+            for process in processes:
+                process.wait()
+        except KeyboardInterrupt:
+            # The workers got the interrupt too and release their leases
+            for process in processes:
+                process.wait()
+        print(f"\n{args.workers} workers finished in {time.time() - start_time:.2f} seconds")
+
+    if args.command in ("local", "results"):
+        path, count = write_results(queue)
+        print(f"Results of {count} URLs saved to: {path}")
+
+    elif args.command == "requeue-failed":
+        print(f"Requeued {queue.requeue_failed()} failed URLs")
+
+    if args.command in ("local", "status", "results", "enqueue"):
+        print_status(queue)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())